@@ -2,6 +2,7 @@ from logging.config import fileConfig
 from typing import TYPE_CHECKING
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Connection
 
 from alembic import context
 
@@ -11,7 +12,11 @@ if TYPE_CHECKING:
     # TODO: create a class that handles these configs
     from configs_example import DB_CONNECTION
 else:
-    from configs import DB_CONNECTION
+    try:
+        from configs import DB_CONNECTION
+    except ImportError:
+        # not needed when a connection is passed in
+        DB_CONNECTION = None
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -66,15 +71,25 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
+    # a connection can be passed in through the config's attributes, e.g. by tests migrating a scratch database
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        run_migrations(connection)
+        return
+
     connectable = create_engine(DB_CONNECTION)
 
     with connectable.connect() as connection:
-        context.configure(
-            connection=connection, target_metadata=target_metadata
-        )
+        run_migrations(connection)
+
 
-        with context.begin_transaction():
-            context.run_migrations()
+def run_migrations(connection: Connection) -> None:
+    context.configure(
+        connection=connection, target_metadata=target_metadata
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
 
 
 if context.is_offline_mode():
@@ -0,0 +1,43 @@
+"""Discord IDs as BigInteger
+
+Revision ID: 5b8e1c2d9a40
+Revises: e459df704c3e
+Create Date: 2026-10-19 10:12:41.522904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e1c2d9a40'
+down_revision = 'e459df704c3e'
+branch_labels = None
+depends_on = None
+
+# discord channel and user IDs are 64 bit snowflakes, which overflow Integer columns on Postgres
+BIGINT_COLUMNS = (
+    ('match', 'channel'),
+    ('status_message', 'channel'),
+    ('subscription', 'channel'),
+    ('subscription', 'discord_id'),
+)
+# message types added after the initial tables, which Postgres needs added to the enum type
+NEW_MESSAGE_TYPES = ('GAME_TIMEOUT', 'GAME_FORFEIT')
+
+
+def upgrade() -> None:
+    for table, column in BIGINT_COLUMNS:
+        # batch mode recreates the table on SQLite, which can't alter column types
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(column, type_=sa.BigInteger(), existing_type=sa.Integer(), existing_nullable=False)
+    if op.get_bind().dialect.name == 'postgresql':
+        for message_type in NEW_MESSAGE_TYPES:
+            op.execute(f"ALTER TYPE messagetype ADD VALUE IF NOT EXISTS '{message_type}'")
+
+
+def downgrade() -> None:
+    # Postgres can't remove values from an enum type, so the new message types are left in place
+    for table, column in BIGINT_COLUMNS:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(column, type_=sa.Integer(), existing_type=sa.BigInteger(), existing_nullable=False)
@@ -0,0 +1,53 @@
+"""Add player rollups for leaderboards
+
+Revision ID: 8f3a6d1e7b25
+Revises: 5b8e1c2d9a40
+Create Date: 2026-10-19 14:37:05.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f3a6d1e7b25'
+down_revision = '5b8e1c2d9a40'
+branch_labels = None
+depends_on = None
+
+
+def rollup_columns() -> list[sa.Column[sa.Integer]]:
+    return [
+        sa.Column(name, sa.Integer(), nullable=False)
+        for name in ('games_played', 'wins', 'total_score', 'best_score', 'best_bird_points',
+                     'best_bonus_card_points', 'best_goals_points', 'best_eggs_points', 'best_cached_food_points',
+                     'best_tucked_cards_points')
+    ]
+
+
+def upgrade() -> None:
+    op.create_table(
+        'channel_player_rollup',
+        *rollup_columns(),
+        sa.Column('channel', sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column('player_name', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('channel', 'player_name')
+    )
+    op.create_table(
+        'global_player_rollup',
+        *rollup_columns(),
+        sa.Column('player_name', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('player_name')
+    )
+    op.create_table(
+        'rolled_up_match',
+        sa.Column('match_id', sa.String(), nullable=False),
+        sa.Column('rolled_up', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('match_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rolled_up_match')
+    op.drop_table('global_player_rollup')
+    op.drop_table('channel_player_rollup')
@@ -0,0 +1,115 @@
+"""Add player table, referenced by ID instead of by name
+
+Revision ID: c7e24b9f3a18
+Revises: 8f3a6d1e7b25
+Create Date: 2026-10-19 16:05:27.640193
+
+"""
+from typing import Any
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e24b9f3a18'
+down_revision = '8f3a6d1e7b25'
+branch_labels = None
+depends_on = None
+
+# tables with a column naming a player: (table, name column, whether it's nullable)
+NAME_COLUMNS = (
+    ('status_message', 'player_turn', True),
+    ('subscription', 'wingspan_name', False),
+)
+SCORE_COLUMNS = ('updated', 'score', 'bird_points', 'bonus_card_points', 'goals_points', 'eggs_points',
+                 'cached_food_points', 'tucked_cards_points', 'food_tokens')
+ROLLUP_COLUMNS = ('games_played', 'wins', 'total_score', 'best_score', 'best_bird_points', 'best_bonus_card_points',
+                  'best_goals_points', 'best_eggs_points', 'best_cached_food_points', 'best_tucked_cards_points')
+# tables keyed by player, with the other columns of their primary key
+KEYED_TABLES = (
+    ('score', ('match_id',), SCORE_COLUMNS),
+    ('channel_player_rollup', ('channel',), ROLLUP_COLUMNS),
+    ('global_player_rollup', (), ROLLUP_COLUMNS),
+)
+
+
+def key_column(name: str) -> sa.Column[Any]:
+    return sa.Column(name, sa.String() if name == 'match_id' else sa.BigInteger(), autoincrement=False,
+                     nullable=False)
+
+
+def value_column(name: str) -> sa.Column[Any]:
+    return sa.Column(name, sa.DateTime() if name == 'updated' else sa.Integer(), nullable=False)
+
+
+def replace_table(table: str, columns: list[sa.Column[Any]], primary_key: list[str], copy: str) -> None:
+    """ Swaps the table for one with the columns and primary key, filled by the `copy` select of its rows """
+    op.create_table(f'{table}_new', *columns, sa.PrimaryKeyConstraint(*primary_key))
+    op.execute(f"INSERT INTO {table}_new ({', '.join(column.name for column in columns)}) {copy}")
+    op.drop_table(table)
+    op.rename_table(f'{table}_new', table)
+    if op.get_bind().dialect.name == 'postgresql':
+        # the primary key's index keeps its name, which would clash the next time the table is replaced
+        op.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {table}_new_pkey TO {table}_pkey")
+
+
+def upgrade() -> None:
+    op.create_table(
+        'player',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chilli_connect_id', sa.String(), nullable=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('chilli_connect_id')
+    )
+    op.create_index(op.f('ix_player_name'), 'player', ['name'], unique=False)
+    # only names were stored, so each becomes a player, given their ChilliConnect ID when next seen in a match
+    op.execute(
+        "INSERT INTO player (name) "
+        "SELECT player_turn FROM status_message WHERE player_turn IS NOT NULL "
+        "UNION SELECT wingspan_name FROM subscription "
+        "UNION SELECT player_name FROM score "
+        "UNION SELECT player_name FROM global_player_rollup "
+        "UNION SELECT player_name FROM channel_player_rollup")
+
+    for table, name_column, nullable in NAME_COLUMNS:
+        op.add_column(table, sa.Column('player_id', sa.Integer(), nullable=True))
+        op.execute(f"UPDATE {table} SET player_id = (SELECT id FROM player WHERE player.name = {table}.{name_column})")
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('player_id', existing_type=sa.Integer(), nullable=nullable)
+            batch_op.create_foreign_key(f'fk_{table}_player_id_player', 'player', ['player_id'], ['id'])
+            batch_op.drop_column(name_column)
+
+    for table, key, columns in KEYED_TABLES:
+        replace_table(
+            table,
+            [*map(key_column, key), sa.Column('player_id', sa.Integer(), sa.ForeignKey('player.id'), nullable=False),
+             *map(value_column, columns)],
+            [*key, 'player_id'],
+            f"SELECT {', '.join(f'old.{column}' for column in key)}{', ' if key else ''}player.id, "
+            f"{', '.join(f'old.{column}' for column in columns)} "
+            f"FROM {table} old JOIN player ON player.name = old.player_name")
+
+
+def downgrade() -> None:
+    # players who have been renamed get their history under their latest name
+    for table, key, columns in KEYED_TABLES:
+        replace_table(
+            table,
+            [*map(key_column, key), sa.Column('player_name', sa.String(), nullable=False), *map(value_column, columns)],
+            [*key, 'player_name'],
+            f"SELECT {', '.join(f'new.{column}' for column in key)}{', ' if key else ''}player.name, "
+            f"{', '.join(f'new.{column}' for column in columns)} "
+            f"FROM {table} new JOIN player ON player.id = new.player_id")
+
+    for table, name_column, nullable in NAME_COLUMNS:
+        op.add_column(table, sa.Column(name_column, sa.String(), nullable=True))
+        op.execute(f"UPDATE {table} SET {name_column} = (SELECT name FROM player WHERE player.id = {table}.player_id)")
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(name_column, existing_type=sa.String(), nullable=nullable)
+            batch_op.drop_constraint(f'fk_{table}_player_id_player', type_='foreignkey')
+            batch_op.drop_column('player_id')
+
+    op.drop_index(op.f('ix_player_name'), table_name='player')
+    op.drop_table('player')
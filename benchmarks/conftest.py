@@ -0,0 +1,29 @@
+from collections.abc import Generator
+from pathlib import Path
+
+import pytest
+
+from benchmarks.helpers import SimpleBenchmark
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.data.models import Base
+
+try:
+    import pytest_benchmark  # noqa: F401
+except ImportError:
+    @pytest.fixture
+    def benchmark(request: pytest.FixtureRequest) -> Generator[SimpleBenchmark, None, None]:
+        simple_benchmark = SimpleBenchmark(request.node.name)
+        yield simple_benchmark
+        print(f"\n{simple_benchmark.report()}")
+
+
+@pytest.fixture
+def db_path(tmp_path: Path) -> Path:
+    return tmp_path / "benchmark.db"
+
+
+@pytest.fixture
+def db(db_path: Path) -> DBConnection:
+    db = DBConnection(f"sqlite:///{db_path}")
+    Base.metadata.create_all(db.engine)
+    return db
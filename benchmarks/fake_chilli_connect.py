@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+from urllib.parse import parse_qs
+
+TEMPLATE_PATH = Path(__file__).parent.parent / "tests" / "data" / "game_in_progress.json"
+SECONDS_PER_TURN = 48 * 60 * 60
+
+
+@dataclass
+class SimulatedMatch:
+    match_id: str
+    players: list[tuple[str, str]]  # (ChilliConnectID, UserName)
+    turn: int = 0
+    completed: bool = False
+    scores: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def current_player_id(self) -> str:
+        return self.players[self.turn % len(self.players)][0]
+
+    def to_dict(self, template: dict[str, Any]) -> dict[str, Any]:
+        """ The match as returned from the match/get endpoint, using `template` for the fields the bot ignores """
+        match = dict(template["Match"])
+        state_data = dict(match["StateData"])
+        state_data["CurrentPlayerID"] = self.current_player_id
+        state_data["TurnNumber"] = self.turn
+        state_data["Scores"] = json.dumps({"V": [
+            {"ID": player_id, "Score": score, "BirdPoints": score // 2, "BonusCardPoints": score // 8,
+             "GoalsPoints": score // 10, "EggsPoints": score // 6, "CachedFoodPoints": score // 20,
+             "TuckedCardsPoints": score // 12, "FoodTokens": self.turn % 5}
+            for player_id, score in self.scores.items()]})
+        match.update({
+            "MatchID": self.match_id,
+            "State": "COMPLETED" if self.completed else "IN_PROGRESS",
+            "StateData": state_data,
+            "OutcomeData": {"Winner": max(self.scores, key=self.scores.__getitem__)} if self.completed else None,
+            "TurnTimeout": None if self.completed else {
+                "SecondsRemaining": SECONDS_PER_TURN, "Expires": "2022-04-24T05:33:52"},
+            "WaitingTimeout": None,
+            "TurnNumber": self.turn,
+            "Players": [{"ChilliConnectID": player_id, "UserName": name, "DisplayName": None}
+                        for player_id, name in self.players],
+        })
+        return {"Match": match}
+
+
+class FakeChilliConnect:
+    """
+    Local HTTP server imitating the ChilliConnect endpoints Wapi uses, serving generated matches modeled on the
+    recorded test data. Matches only change when `advance` is called, so repeated ticks see unchanged payloads
+    like in production.
+    """
+    def __init__(
+            self,
+            num_matches: int,
+            num_players: int = 50,
+            completed_fraction: float = 0.2,
+            latency: float = 0,
+            seed: int = 0) -> None:
+        self.latency = latency
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        with TEMPLATE_PATH.open("r") as f:
+            self._template = json.load(f)
+
+        players = [(f"player{i}_id", f"player{i}") for i in range(num_players)]
+        self.matches: dict[str, SimulatedMatch] = {}
+        for i in range(num_matches):
+            match_players = self._rng.sample(players, self._rng.randint(2, min(5, num_players)))
+            match = SimulatedMatch(
+                match_id=f"match{i}",
+                players=match_players,
+                turn=self._rng.randint(0, 100),
+                completed=self._rng.random() < completed_fraction,
+                scores={player_id: self._rng.randint(0, 120) for player_id, _ in match_players})
+            self.matches[match.match_id] = match
+        self._payloads = {match_id: self._encode(match) for match_id, match in self.matches.items()}
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-chilli-connect", daemon=True)
+
+    @property
+    def host(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def _encode(self, match: SimulatedMatch) -> bytes:
+        return json.dumps(match.to_dict(self._template)).encode()
+
+    def advance(self, fraction: float = 0.1) -> list[str]:
+        """ Moves a random `fraction` of the in progress matches on to the next turn, returning their ids """
+        with self._lock:
+            in_progress = [match for match in self.matches.values() if not match.completed]
+            advanced = self._rng.sample(in_progress, round(len(in_progress) * fraction))
+            for match in advanced:
+                match.turn += 1
+                match.scores[match.current_player_id] += self._rng.randint(0, 5)
+                self._payloads[match.match_id] = self._encode(match)
+        return [match.match_id for match in advanced]
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                with fake._lock:
+                    fake.requests += 1
+                if fake.latency > 0:
+                    time.sleep(fake.latency)
+                length = int(self.headers.get("Content-Length", 0))
+                data = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+                if self.path == "/1.0/multiplayer/async/match/get":
+                    body = fake._payloads.get(data.get("MatchID", ""))
+                    if body is None:
+                        self._reply(404, b'{"Code": 404, "Message": "Match not found"}')
+                    else:
+                        self._reply(200, body)
+                elif self.path == "/1.0/multiplayer/async/match/player/get":
+                    self._reply(200, json.dumps({"Matches": []}).encode())
+                else:
+                    self._reply(404, b'{"Code": 404}')
+
+            def _reply(self, status: int, body: bytes) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return Handler
+
+    def __enter__(self) -> FakeChilliConnect:
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,111 @@
+"""
+Shared by the benchmarks, for serving matches from a fake ChilliConnect and running turn checks against them
+"""
+import asyncio
+import os
+import statistics
+import time
+from collections.abc import Callable
+from typing import Any
+
+import pytest
+
+from benchmarks.fake_chilli_connect import FakeChilliConnect
+from wingspan_api.resilience import RateLimiter
+from wingspan_api.wapi import Match, Wapi
+from wingspan_bot.data.data_controller import DataController
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.pipeline import TurnCheckPipeline
+
+MATCH_COUNTS = (10, 100, 1000, 10000)
+# larger runs take minutes, so they're opt in
+MAX_MATCHES = int(os.environ.get("WINGSPAN_BENCHMARK_MAX_MATCHES", 1000))
+LATENCY = float(os.environ.get("WINGSPAN_BENCHMARK_LATENCY", 0))
+MATCHES_PER_CHANNEL = 10
+
+
+class SimpleBenchmark:
+    """
+    Stand-in for pytest-benchmark's fixture when it isn't installed, supporting the subset of its interface
+    the benchmarks use and printing a summary of each
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.extra_info: dict[str, Any] = {}
+        self.timings: list[float] = []
+
+    def __call__(self, target: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        return self.pedantic(target, args=args, kwargs=kwargs, rounds=5)
+
+    def pedantic(
+            self,
+            target: Callable[..., Any],
+            args: tuple[Any, ...] = (),
+            kwargs: dict[str, Any] | None = None,
+            setup: Callable[[], Any] | None = None,
+            rounds: int = 1,
+            warmup_rounds: int = 0,
+            iterations: int = 1) -> Any:
+        result = None
+        for i in range(warmup_rounds + rounds):
+            call_args, call_kwargs = args, kwargs
+            if setup is not None:
+                # as with pytest-benchmark, a setup that returns something returns the target's arguments
+                setup_result = setup()
+                if setup_result is not None:
+                    call_args, call_kwargs = setup_result
+            start = time.perf_counter()
+            for _ in range(iterations):
+                result = target(*call_args, **(call_kwargs or {}))
+            if i >= warmup_rounds:
+                self.timings.append((time.perf_counter() - start) / iterations)
+        return result
+
+    def report(self) -> str:
+        if len(self.timings) == 0:
+            return f"{self.name}: not run"
+        return (f"{self.name}: min {min(self.timings):.4f}s, mean {statistics.mean(self.timings):.4f}s, "
+                f"max {max(self.timings):.4f}s over {len(self.timings)} rounds {self.extra_info}")
+
+
+def skip_large(num_matches: int) -> None:
+    if num_matches > MAX_MATCHES:
+        pytest.skip(f"Set WINGSPAN_BENCHMARK_MAX_MATCHES to run with {num_matches} matches")
+
+
+def fake_server(num_matches: int) -> FakeChilliConnect:
+    return FakeChilliConnect(num_matches=num_matches, latency=LATENCY)
+
+
+def monitor_all(server: FakeChilliConnect, db: DBConnection) -> None:
+    """ Monitors every match on the server, spread over channels """
+    for i, match_id in enumerate(server.matches):
+        db.add_match(channel=i // MATCHES_PER_CHANNEL, match_id=match_id)
+
+
+def data_controller(server: FakeChilliConnect, db: DBConnection) -> DataController:
+    """ A data controller with nothing cached, talking to the fake server without rate limiting """
+    wapi = Wapi("benchmark-token", rate_limiter=RateLimiter(rate=1e9, burst=10 ** 6), host=server.host)
+    return DataController(db_connection=db, wapi=wapi)
+
+
+async def check_turns(dc: DataController) -> int:
+    """ Runs a turn check the way Bot.check_turns does, minus discord, returning how many messages were sent """
+    sent = 0
+
+    async def notify(channel_id: int, match: Match | str) -> None:
+        nonlocal sent
+        if dc.should_send_message(channel_id, match):
+            player = None if isinstance(match, str) else match.current_player_name
+            dc.get_subscriptions(channel_id)
+            dc.add_message(match, channel_id, player, dc.get_message_type(match))
+            sent += 1
+
+    with dc.unit_of_work():
+        await TurnCheckPipeline(dc, notify).run()
+    return sent
+
+
+def tick(dc: DataController) -> int:
+    """ check_turns in an event loop of its own, for timing with the benchmark fixture """
+    return asyncio.run(check_turns(dc))
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from benchmarks.helpers import MATCH_COUNTS, fake_server, skip_large
+from wingspan_api.recorder import ArchiveWriter
+from wingspan_api.resilience import RateLimiter
+from wingspan_api.wapi import Wapi
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.data.models import Base
+from wingspan_bot.replay import ReplayMessage, ReplayReport, replay_archive
+
+POLLS = 24  # two hours of polls every five minutes
+START = datetime(2022, 4, 22, 12, tzinfo=timezone.utc)
+
+
+def record(num_matches: int, path: Path) -> None:
+    """ Records the fake server's matches every five minutes, with a tenth of them moving on a turn each time """
+    with fake_server(num_matches) as server:
+        wapi = Wapi("benchmark-token", rate_limiter=RateLimiter(rate=1e9, burst=10 ** 6), host=server.host)
+        with ArchiveWriter(path) as writer:
+            for poll in range(POLLS):
+                for match_id in server.matches:
+                    writer.write(wapi.get_game_info(match_id), START + poll * timedelta(minutes=5))
+                server.advance()
+
+
+@pytest.mark.parametrize("num_matches", MATCH_COUNTS)
+def test_replay(benchmark: Any, tmp_path: Path, num_matches: int) -> None:
+    """ Replaying a recording into a new database, which has to send the same messages every time """
+    skip_large(num_matches)
+    archive = tmp_path / "matches.jsonl.gz"
+    record(num_matches, archive)
+    expected: list[ReplayMessage] = []
+    reports: list[ReplayReport] = []
+
+    def run() -> None:
+        db = DBConnection(f"sqlite:///{tmp_path / f'replay{len(reports)}.db'}")
+        Base.metadata.create_all(db.engine)
+        report = replay_archive(archive, db)
+        if expected:
+            report.verify(expected)
+        else:
+            expected.extend(report.messages)
+        reports.append(report)
+
+    benchmark.pedantic(run, rounds=3)
+
+    assert len(expected) > num_matches
+    benchmark.extra_info["matches"] = num_matches
+    benchmark.extra_info["archive_bytes"] = archive.stat().st_size
+    benchmark.extra_info["report"] = str(reports[-1])
@@ -0,0 +1,103 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+ROOT = Path(__file__).parent.parent
+
+# mode: (arguments, what to patch so it runs without Steam, ChilliConnect or discord, modules it mustn't import)
+MODES: dict[str, tuple[list[str], list[str], list[str]]] = {
+    "help": (["-h"], [], ["wingspan_api.wapi", "nextcord", "sqlalchemy"]),
+    "list": ([], ["wingspan_api.wapi.Wapi"], ["nextcord", "sqlalchemy"]),
+    "info": (["-i", "match-id"], ["wingspan_api.wapi.Wapi"], ["nextcord", "sqlalchemy"]),
+    "save": (["-s", "match-id", "match.json"], ["wingspan_api.wapi.Wapi"], ["nextcord", "sqlalchemy"]),
+    "save_many": (["-s", *(f"match-{i}" for i in range(100)), "matches.json"], ["wingspan_api.wapi.Wapi"],
+                  ["nextcord", "sqlalchemy"]),
+    "record": (["--record", "match-id", "matches.jsonl.gz"],
+               ["wingspan_api.wapi.Wapi", "wingspan_api.recorder.record_matches"], ["nextcord", "sqlalchemy"]),
+    "leaderboard": (["--leaderboard", "wins"], ["wingspan_bot.data.db_connection.DBConnection"], ["nextcord"]),
+    "rebuild_leaderboards": (["--rebuild-leaderboards"], ["wingspan_bot.data.db_connection.DBConnection"],
+                             ["nextcord"]),
+    "bot": (["-b"], ["wingspan_api.wapi.Wapi", "wingspan_bot.bot.Bot"], []),
+}
+
+# runs main in a fresh interpreter, reporting which of the modules it imported. unittest.mock is imported by every
+# mode, so it adds the same to each
+SCRIPT = """
+import json, sys
+from contextlib import ExitStack
+from unittest import mock
+
+sys.argv = ["main.py", *{args!r}]
+with ExitStack() as stack:
+    stack.enter_context(mock.patch("builtins.input"))
+    for target in {patches!r}:
+        patched = stack.enter_context(mock.patch(target))
+        if target == "wingspan_api.wapi.Wapi":
+            from wingspan_api.wapi import Match
+            with open({match_file!r}) as f:
+                patched.return_value.get_game_info.return_value = Match.from_dict(json.load(f)["Match"])
+    import main
+    try:
+        main.main()
+    except SystemExit:
+        pass
+print(json.dumps([module for module in {modules!r} if module in sys.modules]))
+"""
+
+
+@pytest.fixture
+def configs_dir(tmp_path: Path) -> Path:
+    """ A working directory with the example configs, as main imports them """
+    shutil.copy(ROOT / "configs_example.py", tmp_path / "configs.py")
+    return tmp_path
+
+
+def run_mode(mode: str, cwd: Path) -> list[str]:
+    args, patches, forbidden = MODES[mode]
+    match_file = str(ROOT / "tests" / "data" / "game_in_progress.json")
+    script = SCRIPT.format(args=args, patches=patches, modules=forbidden, match_file=match_file)
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(ROOT), str(cwd)])}
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    imported: list[str] = json.loads(result.stdout.strip().splitlines()[-1])
+    return imported
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_startup(benchmark: Any, configs_dir: Path, mode: str) -> None:
+    """ Cold start of each command line mode, from launching Python to the mode finishing """
+    imported = benchmark.pedantic(lambda: run_mode(mode, configs_dir), rounds=5, warmup_rounds=1)
+    assert imported == [], f"--{mode} imported {', '.join(imported)}, which it doesn't use"
+
+
+def test_old_configs(configs_dir: Path) -> None:
+    """ A configs.py from before the optional settings were added still runs, with their defaults """
+    (configs_dir / "configs.py").write_text(
+        'BOT_SECRET_TOKEN = "token"\nDB_CONNECTION = "sqlite:///wingspan.db"\nADMIN_CHANNEL = 0\n')
+    assert run_mode("bot", configs_dir) == []
+
+
+def test_import_times(configs_dir: Path) -> None:
+    """ The slowest imports of `import main`, from `python -X importtime`, for finding what to defer next """
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(ROOT), str(configs_dir)])}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], cwd=configs_dir, env=env, capture_output=True,
+        text=True, check=True)
+    # lines of "import time: self [us] | cumulative | module", the module indented by its depth after its imports
+    timings = [line.removeprefix("import time:").split("|") for line in result.stderr.splitlines()[1:]]
+    modules = [(int(cumulative), module.rstrip()) for _, cumulative, module in timings]
+    top_level = [i for i, (_, module) in enumerate(modules) if not module.startswith("  ")]
+    main_index = next(i for i in top_level if modules[i][1].strip() == "main")
+    start = max([i + 1 for i in top_level if i < main_index], default=0)
+    imported_by_main = modules[start:main_index + 1]
+
+    print(f"\nSlowest imports of main, {modules[main_index][0] / 1000:.1f}ms in all:")
+    for microseconds, module in sorted(imported_by_main, reverse=True)[1:11]:
+        print(f"{microseconds / 1000:8.1f}ms {module.strip()}")
+    assert "nextcord" not in {module.strip() for _, module in imported_by_main}
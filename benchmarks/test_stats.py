@@ -0,0 +1,35 @@
+from collections.abc import Callable
+from typing import Any
+
+import pytest
+
+from benchmarks.helpers import skip_large
+from wingspan_api.wapi import Wapi
+from wingspan_bot.data.data_controller import DataController
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.data.history_generator import HistoryConfig, generate_history
+
+# matches per channel, across 10 channels, roughly 100 status messages each
+HISTORY_SIZES = (10, 100, 1000)
+CHANNELS = 10
+
+STATS: dict[str, Callable[[DataController, int], Any]] = {
+    "get_fastest_player": DataController.get_fastest_player,
+    "get_player_turn_timings": DataController.get_player_turn_timings,
+    "get_highest_scores": DataController.get_highest_scores,
+}
+
+
+@pytest.mark.parametrize("stat", STATS)
+@pytest.mark.parametrize("matches_per_channel", HISTORY_SIZES)
+def test_stats(benchmark: Any, db: DBConnection, matches_per_channel: int, stat: str) -> None:
+    """ Stats for one channel, with every channel holding `matches_per_channel` matches of history """
+    skip_large(matches_per_channel * CHANNELS)
+    summary = generate_history(db, HistoryConfig(channels=CHANNELS, matches_per_channel=matches_per_channel))
+    dc = DataController(db_connection=db, wapi=Wapi("benchmark-token"))
+
+    result = benchmark.pedantic(lambda: STATS[stat](dc, 1), rounds=3)
+
+    assert result is not None
+    benchmark.extra_info["status_messages"] = summary.status_messages
+    benchmark.extra_info["scores"] = summary.scores
@@ -0,0 +1,57 @@
+from pathlib import Path
+from typing import Any
+
+import pytest
+from sqlalchemy import delete, func, select
+
+from benchmarks.helpers import MATCH_COUNTS, data_controller, fake_server, monitor_all, skip_large, tick
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.data.models import StatusMessage
+
+
+def count_messages(db: DBConnection) -> int:
+    with db.Session() as session:
+        return int(session.execute(select(func.count(StatusMessage.id))).scalar_one())
+
+
+@pytest.mark.parametrize("num_matches", MATCH_COUNTS)
+def test_first_tick(benchmark: Any, db: DBConnection, num_matches: int) -> None:
+    """ A cold tick, where every match is new and gets a message """
+    skip_large(num_matches)
+    with fake_server(num_matches) as server:
+        monitor_all(server, db)
+        dcs = []
+
+        def setup() -> None:
+            with db.Session.begin() as session:
+                session.execute(delete(StatusMessage))
+            dcs.append(data_controller(server, db))
+
+        sent = benchmark.pedantic(lambda: tick(dcs[-1]), setup=setup, rounds=3)
+
+    assert sent == num_matches
+    benchmark.extra_info["matches"] = num_matches
+
+
+@pytest.mark.parametrize("num_matches", MATCH_COUNTS)
+def test_steady_state_tick(benchmark: Any, db: DBConnection, db_path: Path, num_matches: int) -> None:
+    """ Ticks where a tenth of the in progress matches have moved on to a new turn since the last one """
+    skip_large(num_matches)
+    with fake_server(num_matches) as server:
+        monitor_all(server, db)
+        dc = data_controller(server, db)
+        tick(dc)
+        messages_before = count_messages(db)
+        size_before = db_path.stat().st_size
+
+        def setup() -> None:
+            server.advance()
+
+        sent = benchmark.pedantic(lambda: tick(dc), setup=setup, rounds=5)
+        requests = server.requests
+
+    assert sent > 0
+    benchmark.extra_info["matches"] = num_matches
+    benchmark.extra_info["requests"] = requests
+    benchmark.extra_info["message_rows_added"] = count_messages(db) - messages_before
+    benchmark.extra_info["db_bytes_added"] = db_path.stat().st_size - size_before
@@ -1,19 +1,29 @@
 import argparse
+import json
 import logging
 import os
 import sys
+from contextlib import nullcontext
+from datetime import timedelta
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 
-from wingspan_api.wapi import Wapi
-from wingspan_bot.bot import Bot
-from wingspan_bot.data.db_connection import DBConnection
-from wingspan_bot.data.data_controller import DataController
+import configs_example
+from wingspan_bot.data.categories import LEADERBOARD_TITLES
 
 if TYPE_CHECKING:
-    from configs_example import ADMIN_CHANNEL, BOT_SECRET_TOKEN, DB_CONNECTION
+    configs = configs_example
 else:
-    from configs import ADMIN_CHANNEL, BOT_SECRET_TOKEN, DB_CONNECTION
+    import configs
+
+ADMIN_CHANNEL = configs.ADMIN_CHANNEL
+BOT_SECRET_TOKEN = configs.BOT_SECRET_TOKEN
+DB_CONNECTION = configs.DB_CONNECTION
+
+
+def optional_config(name: str) -> Any:
+    """ The option from configs.py, or its default from configs_example.py if configs.py predates the option """
+    return getattr(configs, name, getattr(configs_example, name))
 
 
 def main() -> None:
@@ -23,19 +33,60 @@ def main() -> None:
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-l", "--list", help="Print active games", action="store_true")
     group.add_argument(
-        "-i", "--info", help="Print game info for a given match id", type=str, metavar="MATCHID"
+        "-i",
+        "--info",
+        help="Print whose turn it is in the matches as NDJSON, a line per match as it's fetched. "
+             "Use 'all' for every active game",
+        nargs="+",
+        type=str,
+        metavar="MATCHID"
     )
     group.add_argument(
         "-s",
         "--save",
-        help="Save game info for a given match id and file name",
-        nargs=2,
+        help="MATCHID [MATCHID ...] FILENAME: save the full game info of the matches to the file, or - for stdout, "
+             "as NDJSON. Use 'all' for every active game",
+        nargs="+",
+        type=str,
+        metavar="ARG"
+    )
+    group.add_argument(
+        "--record",
+        help="MATCHID [MATCHID ...] FILENAME: poll the matches until they're complete or Ctrl+C, adding each new "
+             "state to the compressed archive. Use 'all' for every active game",
+        nargs="+",
         type=str,
-        metavar=("MATCHID, FILENAME")
+        metavar="ARG"
     )
     group.add_argument("-b", "--bot", help="Run discord bot", action="store_true")
+    group.add_argument(
+        "--leaderboard",
+        help=f"Print the leaderboard across all channels for a category: {', '.join(LEADERBOARD_TITLES)}",
+        choices=LEADERBOARD_TITLES,
+        metavar="CATEGORY"
+    )
+    group.add_argument(
+        "--rebuild-leaderboards",
+        help="Recompute the leaderboards from all stored scores, e.g. after upgrading",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--workers", help="How many matches --info, --save and --record fetch at once, 8 by default", type=int
+    )
+    parser.add_argument(
+        "--interval", help="Minutes between polls for --record, 5 by default", type=float, default=5.0
+    )
     args = parser.parse_args()
-
+    if args.save is not None and len(args.save) < 2:
+        parser.error("--save needs at least one match id and a file name")
+    if args.record is not None and len(args.record) < 2:
+        parser.error("--record needs at least one match id and a file name")
+    if args.interval <= 0:
+        parser.error("--interval must be more than 0")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    launch_dir = Path.cwd()  # for files the user names in configs.py, as the .exe's temp directory is deleted at exit
     try:
         # If it succeeds we're running from a pyinstaller .exe file, so use it's temp directory
         os.chdir(sys._MEIPASS)  # type: ignore[attr-defined]
@@ -43,17 +94,26 @@ def main() -> None:
         pass
 
     if args.info is not None:
-        print_game_info(args.info)
+        print_game_info(args.info, args.workers)
     elif args.save is not None:
-        save_game_info(args.save[0], args.save[1])
+        save_game_info(args.save[:-1], args.save[-1], args.workers)
+    elif args.record is not None:
+        record_game_info(args.record[:-1], args.record[-1], timedelta(minutes=args.interval), args.workers)
     elif args.bot:
-        run_bot()
+        run_bot(launch_dir)
+    elif args.leaderboard is not None:
+        print_leaderboard(args.leaderboard)
+    elif args.rebuild_leaderboards:
+        rebuild_leaderboards()
     else:
         print_games()
     input("Press Enter to finish...")
 
 
+# each mode imports only what it uses, so e.g. --info doesn't wait on importing discord and SQLAlchemy
 def print_games() -> None:
+    from wingspan_api.wapi import Wapi
+
     wapi = Wapi()
     matches = wapi.get_games()
     print("Current games in progress:")
@@ -65,28 +125,96 @@ def print_games() -> None:
         print("No Wingspan games in progress")
 
 
-def print_game_info(match_id: str) -> None:
+def print_game_info(match_ids: list[str], workers: int | None) -> None:
+    from wingspan_api.bulk import fetch_matches, resolve_match_ids, summary, write_ndjson
+    from wingspan_api.wapi import Wapi
+
     wapi = Wapi()
-    game_info = wapi.get_game_info(match_id)
-    if game_info.current_player is not None:
-        print(game_info.current_player.UserName)
-        print(game_info.hours_remaining)
-    else:
-        print(game_info.State)
+    results = fetch_matches(wapi, resolve_match_ids(wapi, match_ids), workers)
+    errors = write_ndjson(results, sys.stdout, lambda match: json.dumps(summary(match)))
+    if errors > 0:
+        print(f"Failed to get {errors} matches", file=sys.stderr)
 
 
-def save_game_info(match_id: str, file_name: str) -> None:
+def save_game_info(match_ids: list[str], file_name: str, workers: int | None) -> None:
+    from wingspan_api.bulk import fetch_matches, resolve_match_ids, write_ndjson
+    from wingspan_api.wapi import Wapi
+
     wapi = Wapi()
-    game_info = wapi.get_game_info(match_id)
-    with Path(file_name).open("w") as f:
-        f.write(game_info.to_json())
+    results = fetch_matches(wapi, resolve_match_ids(wapi, match_ids), workers)
+    with nullcontext(sys.stdout) if file_name == "-" else Path(file_name).open("w") as f:
+        errors = write_ndjson(results, f, lambda match: match.to_json())
+    if errors > 0:
+        print(f"Failed to get {errors} matches", file=sys.stderr)
+
 
+def record_game_info(match_ids: list[str], file_name: str, interval: timedelta, workers: int | None) -> None:
+    from wingspan_api.recorder import ArchiveWriter, record_matches
+    from wingspan_api.wapi import Wapi
 
-def run_bot() -> None:
     wapi = Wapi()
-    db_conn = DBConnection(DB_CONNECTION)
+    with ArchiveWriter(Path(file_name)) as writer:
+        try:
+            recorded = record_matches(wapi, writer, match_ids, interval=interval, workers=workers)
+        except KeyboardInterrupt:
+            print("Stopped recording")
+            return
+    print(f"Recorded {recorded} states to {file_name}")
+
+
+def print_leaderboard(category: str) -> None:
+    from wingspan_bot.data.data_objects import Leaderboard
+    from wingspan_bot.data.db_connection import DBConnection
+
+    rows = DBConnection(DB_CONNECTION).get_leaderboard(category)
+    print(Leaderboard.from_rows(LEADERBOARD_TITLES[category], rows))
+
+
+def rebuild_leaderboards() -> None:
+    from wingspan_bot.data.db_connection import DBConnection
+
+    matches = DBConnection(DB_CONNECTION).rebuild_rollups()
+    print(f"Rebuilt the leaderboards from {matches} completed matches")
+
+
+def run_bot(launch_dir: Path) -> None:
+    from wingspan_api.wapi import Wapi
+    from wingspan_bot.bot import Bot
+    from wingspan_bot.data.data_controller import DataController
+    from wingspan_bot.data.db_connection import DBConnection
+    from wingspan_bot.metrics import MetricsServer, observe_request_attempt
+    from wingspan_bot.pipeline import PipelineConfig
+    from wingspan_bot.snapshot import load_snapshot
+    from wingspan_bot.tracing import TRACER, FileSpanExporter
+
+    metrics_port = optional_config("METRICS_PORT")
+    if metrics_port is not None:
+        MetricsServer(port=metrics_port).start()
+    trace_file = optional_config("TRACE_FILE")
+    if trace_file is not None:
+        TRACER.exporters.append(FileSpanExporter(trace_file))
+    snapshot_file = optional_config("SNAPSHOT_FILE")
+    snapshot_path = None if snapshot_file is None else launch_dir / snapshot_file
+    snapshot = None if snapshot_path is None else load_snapshot(snapshot_path)
+    # reuse the access token from before a restart, if it's expired a new one is generated when it's first used
+    wapi = Wapi(access_token=None if snapshot is None else snapshot.access_token)
+    wapi.attempt_listeners.append(observe_request_attempt)
+    db_conn = DBConnection(
+        DB_CONNECTION, pool_size=optional_config("DB_POOL_SIZE"), max_overflow=optional_config("DB_MAX_OVERFLOW"),
+        sqlite_tuning=optional_config("SQLITE_TUNING"))
     data_controller = DataController(db_connection=db_conn, wapi=wapi)
-    bot = Bot(admin_channel=ADMIN_CHANNEL, data_controller=data_controller, command_prefix="!")
+    retention_days = optional_config("MESSAGE_RETENTION_DAYS")
+    message_retention = None if retention_days is None else timedelta(days=retention_days)
+    bot = Bot(
+        admin_channel=ADMIN_CHANNEL,
+        data_controller=data_controller,
+        message_retention=message_retention,
+        pipeline_config=PipelineConfig(
+            workers=optional_config("PIPELINE_WORKERS"), queue_size=optional_config("PIPELINE_QUEUE_SIZE")),
+        snapshot_path=snapshot_path,
+        command_prefix="!")
+    if snapshot is not None:
+        bot.restore_snapshot(snapshot)
     bot.run(BOT_SECRET_TOKEN)
 
 
@@ -0,0 +1,72 @@
+import io
+import json
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from wingspan_api.bulk import ALL_MATCHES, MatchResult, fetch_matches, resolve_match_ids, summary, write_ndjson
+from wingspan_api.wapi import Match, Matches
+
+
+class TestBulk:
+    @pytest.fixture
+    def wapi(self, game_in_progress_obj: Match) -> MagicMock:
+        wapi = MagicMock()
+        wapi.get_game_info.side_effect = lambda match_id: game_in_progress_obj
+        return wapi
+
+    def test_resolve_match_ids(self, wapi: MagicMock, games: str) -> None:
+        wapi.get_games.return_value = Matches.from_json(games)
+        all_ids = [match.MatchID for match in wapi.get_games.return_value.Matches]
+        assert resolve_match_ids(wapi, ["b", "a", "b"]) == ["b", "a"]
+        assert resolve_match_ids(wapi, ["x", ALL_MATCHES]) == ["x", *all_ids]
+
+    def test_fetch_matches(self, wapi: MagicMock, game_in_progress_obj: Match) -> None:
+        results = list(fetch_matches(wapi, ["a", "b", "c"]))
+        assert sorted(result.match_id for result in results) == ["a", "b", "c"]
+        assert all(result.match is game_in_progress_obj for result in results)
+
+    def test_fetch_matches_error(self, wapi: MagicMock) -> None:
+        error = ValueError("test error")
+        wapi.get_game_info.side_effect = error
+        assert list(fetch_matches(wapi, ["a"])) == [MatchResult("a", error=error)]
+
+    def test_fetch_matches_bounded(self, wapi: MagicMock) -> None:
+        lock = threading.Lock()
+        running = [0]
+        most_running = [0]
+
+        def get_game_info(match_id: str) -> str:
+            with lock:
+                running[0] += 1
+                most_running[0] = max(most_running[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return match_id
+
+        wapi.get_game_info.side_effect = get_game_info
+        assert len(list(fetch_matches(wapi, [str(i) for i in range(20)], workers=3))) == 20
+        assert 1 < most_running[0] <= 3
+
+    def test_fetch_matches_no_workers(self, wapi: MagicMock) -> None:
+        with pytest.raises(ValueError):
+            list(fetch_matches(wapi, ["a"], workers=0))
+
+    def test_write_ndjson(self, game_in_progress_obj: Match) -> None:
+        out = io.StringIO()
+        results = [MatchResult("in-progress-match-id", match=game_in_progress_obj),
+                   MatchResult("bad-id", error=ValueError("test error"))]
+        assert write_ndjson(results, out, lambda match: json.dumps(summary(match))) == 1
+        assert [json.loads(line) for line in out.getvalue().splitlines()] == [
+            {"match_id": "in-progress-match-id", "state": "IN_PROGRESS", "current_player": "victor",
+             "hours_remaining": 42.0},
+            {"match_id": "bad-id", "error": "ValueError('test error')"},
+        ]
+
+    def test_write_ndjson_full(self, game_in_progress_obj: Match) -> None:
+        out = io.StringIO()
+        write_ndjson([MatchResult("in-progress-match-id", match=game_in_progress_obj)], out, Match.to_json)
+        assert Match.from_json(out.getvalue()) == game_in_progress_obj
@@ -0,0 +1,104 @@
+import copy
+import dataclasses
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+from wingspan_api.recorder import (
+    ArchiveWriter, apply_delta, diff_state, index_path, read_archive, read_index, record_matches)
+from wingspan_api.wapi import Match, Timeout
+
+START = datetime(2022, 4, 22, 12, tzinfo=timezone.utc)
+
+
+def with_seconds_remaining(match: Match, seconds: int) -> Match:
+    """ A copy of the match as if it were polled later, with less time left on the turn """
+    assert match.TurnTimeout is not None
+    return dataclasses.replace(match, TurnTimeout=Timeout(SecondsRemaining=seconds, Expires=match.TurnTimeout.Expires))
+
+
+class TestRecorder:
+    @pytest.fixture
+    def path(self, tmp_path: Path) -> Path:
+        return tmp_path / "matches.jsonl.gz"
+
+    @pytest.fixture
+    def history(self, game_in_progress_obj: Match) -> list[Match]:
+        return [with_seconds_remaining(game_in_progress_obj, seconds) for seconds in range(1000, 0, -100)]
+
+    def test_diff_apply(self) -> None:
+        old = {"a": 1, "b": {"c": [1, 2], "d": None}, "e": "x"}
+        new = {"a": 1, "b": {"c": [1, 2, 3], "d": None}, "e": "y", "f": True}
+        delta = diff_state(old, new)
+        assert delta == {"b": {"c": [1, 2, 3]}, "e": "y", "f": True}
+        assert apply_delta(old, delta) == new
+        assert old == {"a": 1, "b": {"c": [1, 2], "d": None}, "e": "x"}
+
+    def test_diff_removed(self) -> None:
+        assert diff_state({"a": {"b": 1}}, {"a": {}}) is None
+
+    def test_write_read(self, path: Path, history: list[Match]) -> None:
+        with ArchiveWriter(path, chunk_records=4) as writer:
+            for i, match in enumerate(history):
+                assert writer.write(match, START + timedelta(minutes=i))
+                assert not writer.write(copy.deepcopy(match), START + timedelta(minutes=i, seconds=30))
+
+        records = list(read_archive(path))
+        assert [record.match for record in records] == history
+        assert [record.time for record in records] == [START + timedelta(minutes=i) for i in range(len(history))]
+        assert [chunk.records for chunk in read_index(path)] == [4, 4, 2]
+
+    def test_compressed(self, path: Path, history: list[Match]) -> None:
+        with ArchiveWriter(path) as writer:
+            for i, match in enumerate(history):
+                writer.write(match, START + timedelta(minutes=i))
+        # the full state is stored once and the deltas are tiny next to it, so all ten take less than one uncompressed
+        assert path.stat().st_size < len(history[0].to_json())
+
+    def test_read_filtered(self, path: Path, history: list[Match], game_completed_obj: Match) -> None:
+        with ArchiveWriter(path, chunk_records=2) as writer:
+            for i, match in enumerate(history[:4]):
+                writer.write(match, START + timedelta(minutes=i))
+            writer.write(game_completed_obj, START + timedelta(minutes=4))
+
+        completed = list(read_archive(path, match_ids=[game_completed_obj.MatchID]))
+        assert [record.match for record in completed] == [game_completed_obj]
+        in_range = list(read_archive(path, start=START + timedelta(minutes=1), end=START + timedelta(minutes=2)))
+        assert [record.match for record in in_range] == history[1:3]
+
+    def test_append(self, path: Path, history: list[Match]) -> None:
+        with ArchiveWriter(path) as writer:
+            writer.write(history[0], START)
+        # as if killed after writing a chunk but before indexing it
+        with path.open("ab") as f:
+            f.write(b"partial chunk")
+
+        with ArchiveWriter(path) as writer:
+            assert not writer.write(history[0], START + timedelta(minutes=1))
+            assert writer.write(history[1], START + timedelta(minutes=2))
+        assert [record.match for record in read_archive(path)] == history[:2]
+        assert len(index_path(path).read_text().splitlines()) == 2
+
+    def test_record_matches(self, path: Path, history: list[Match], game_completed_obj: Match) -> None:
+        polls = {"in-progress-match-id": iter([history[0], history[0], history[1]]),
+                 game_completed_obj.MatchID: iter([game_completed_obj])}
+        wapi = MagicMock()
+        wapi.get_game_info.side_effect = lambda match_id: next(polls[match_id])
+        sleep = MagicMock()
+
+        with ArchiveWriter(path) as writer:
+            recorded = record_matches(wapi, writer, ["in-progress-match-id", game_completed_obj.MatchID],
+                                      interval=timedelta(minutes=1), polls=3, sleep=sleep)
+        assert recorded == 3
+        assert sleep.call_count == 2
+        assert [record.match for record in read_archive(path, ["in-progress-match-id"])] == history[:2]
+
+    def test_record_until_completed(self, path: Path, game_completed_obj: Match) -> None:
+        wapi = MagicMock()
+        wapi.get_game_info.return_value = game_completed_obj
+        sleep = MagicMock()
+        with ArchiveWriter(path) as writer:
+            assert record_matches(wapi, writer, [game_completed_obj.MatchID], sleep=sleep) == 1
+        sleep.assert_not_called()
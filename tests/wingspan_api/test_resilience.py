@@ -0,0 +1,178 @@
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+from _pytest.monkeypatch import MonkeyPatch
+
+from wingspan_api.resilience import CircuitBreaker, CircuitOpenError, CircuitState, RateLimiter, RetryPolicy
+from wingspan_api.wapi import RequestAttempt, Wapi
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class TestRateLimiter:
+    def test_burst(self) -> None:
+        clock = FakeClock()
+        limiter = RateLimiter(rate=1, burst=3, clock=clock)
+        assert [limiter.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+    def test_refill(self) -> None:
+        clock = FakeClock()
+        limiter = RateLimiter(rate=2, burst=1, clock=clock)
+        assert limiter.try_acquire()
+        assert not limiter.try_acquire()
+        clock.now += 0.5
+        assert limiter.try_acquire()
+
+    def test_acquire_waits(self) -> None:
+        clock = FakeClock()
+        limiter = RateLimiter(rate=4, burst=1, clock=clock, sleep=clock.sleep)
+        for _ in range(5):
+            limiter.acquire()
+        assert clock.now == pytest.approx(1)
+
+    def test_invalid(self) -> None:
+        with pytest.raises(ValueError):
+            RateLimiter(rate=0)
+
+
+class TestRetryPolicy:
+    @pytest.mark.parametrize("attempt,cap", ((1, 0.5), (2, 1), (3, 2), (10, 8)))
+    def test_delay(self, attempt: int, cap: float) -> None:
+        policy = RetryPolicy(base_delay=0.5, max_delay=8)
+        delays = [policy.delay(attempt) for _ in range(50)]
+        assert all(0 <= delay <= cap for delay in delays)
+        assert max(delays) > cap / 2
+
+
+class TestCircuitBreaker:
+    @pytest.fixture
+    def clock(self) -> FakeClock:
+        return FakeClock()
+
+    @pytest.fixture
+    def breaker(self, clock: FakeClock) -> CircuitBreaker:
+        return CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+
+    def test_opens_after_consecutive_failures(self, breaker: CircuitBreaker) -> None:
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.before_request()
+        breaker.record_failure()
+        assert breaker.state == CircuitState.OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+
+    def test_half_open_probe_success(self, breaker: CircuitBreaker, clock: FakeClock) -> None:
+        breaker.record_failure()
+        breaker.record_failure()
+        clock.now += 10
+        assert breaker.state == CircuitState.HALF_OPEN
+        breaker.before_request()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()  # only one probe at a time
+        breaker.record_success()
+        for _ in range(2):
+            breaker.before_request()
+
+    def test_half_open_probe_failure(self, breaker: CircuitBreaker, clock: FakeClock) -> None:
+        breaker.record_failure()
+        breaker.record_failure()
+        clock.now += 10
+        breaker.before_request()
+        breaker.record_failure()
+        assert breaker.state == CircuitState.OPEN
+        clock.now += 9
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+
+
+class TestWapiResilience:
+    @pytest.fixture
+    def post(self, monkeypatch: MonkeyPatch) -> MagicMock:
+        post = MagicMock()
+        monkeypatch.setattr(requests, "post", post)
+        return post
+
+    @staticmethod
+    def response(status_code: int, content: bytes = b"{}") -> requests.Response:
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = content
+        return response
+
+    @pytest.fixture
+    def sleep(self) -> MagicMock:
+        return MagicMock()
+
+    @pytest.fixture
+    def wapi(self, sleep: MagicMock) -> Wapi:
+        return Wapi(
+            "test_token",
+            rate_limiter=RateLimiter(rate=1000, burst=1000),
+            circuit_breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60),
+            retry_policy=RetryPolicy(max_attempts=1),
+            sleep=sleep)
+
+    @pytest.fixture
+    def retrying_wapi(self, wapi: Wapi) -> Wapi:
+        wapi.retry_policy = RetryPolicy(max_attempts=3)
+        return wapi
+
+    def test_timeout_passed(self, wapi: Wapi, post: MagicMock) -> None:
+        post.return_value = self.response(200, b'{"Matches": []}')
+        wapi.timeout = (1, 2)
+        wapi.get_games()
+        assert post.call_args.kwargs["timeout"] == (1, 2)
+
+    def test_retry_server_error(self, retrying_wapi: Wapi, post: MagicMock, sleep: MagicMock) -> None:
+        post.side_effect = [self.response(503), requests.Timeout("test error"), self.response(200, b'{"Matches": []}')]
+        attempts: list[RequestAttempt] = []
+        retrying_wapi.attempt_listeners.append(attempts.append)
+
+        assert retrying_wapi.get_games().Matches == []
+        assert post.call_count == 3
+        assert sleep.call_count == 2
+        assert [(attempt.attempt, attempt.status_code, attempt.error) for attempt in attempts] == [
+            (1, 503, None), (2, None, "Timeout"), (3, 200, None)]
+        assert all(attempt.path == "1.0/multiplayer/async/match/player/get" for attempt in attempts)
+
+    def test_retry_exhausted(self, retrying_wapi: Wapi, post: MagicMock) -> None:
+        post.return_value = self.response(500)
+        with pytest.raises(requests.HTTPError):
+            retrying_wapi.get_games()
+        assert post.call_count == 3
+
+    def test_no_retry_client_error(self, retrying_wapi: Wapi, post: MagicMock, sleep: MagicMock) -> None:
+        post.return_value = self.response(404, b'{"Code": 404}')
+        with pytest.raises(requests.HTTPError):
+            retrying_wapi.get_games()
+        assert post.call_count == 1
+        sleep.assert_not_called()
+
+    def test_circuit_opens_on_connection_errors(self, wapi: Wapi, post: MagicMock) -> None:
+        post.side_effect = requests.ConnectionError("test error")
+        for _ in range(2):
+            with pytest.raises(requests.ConnectionError):
+                wapi.get_game_info("match-id")
+        with pytest.raises(CircuitOpenError):
+            wapi.get_game_info("match-id")
+        assert post.call_count == 2
+
+    def test_client_errors_dont_open_circuit(self, wapi: Wapi, post: MagicMock) -> None:
+        post.return_value = self.response(404, b'{"Code": 404}')
+        for _ in range(3):
+            with pytest.raises(requests.HTTPError):
+                wapi.get_game_info("match-id")
+        assert wapi.circuit_breaker.state == CircuitState.CLOSED
+        assert post.call_count == 3
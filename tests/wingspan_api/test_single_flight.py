@@ -0,0 +1,89 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from wingspan_api.single_flight import SingleFlight
+from wingspan_api.wapi import Wapi
+
+
+class TestSingleFlight:
+    def test_do(self) -> None:
+        assert SingleFlight[str, int]().do("key", lambda: 42) == 42
+
+    def test_do_concurrent_shares_result(self) -> None:
+        flight: SingleFlight[str, int] = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def func() -> int:
+            calls.append(1)
+            started.set()
+            release.wait(timeout=5)
+            return len(calls)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(flight.do, "key", func)]
+            started.wait(timeout=5)
+            futures += [executor.submit(flight.do, "key", func) for _ in range(3)]
+            time.sleep(0.1)  # give the followers time to start waiting on the leader
+            release.set()
+            results = [future.result(timeout=5) for future in futures]
+
+        assert results == [1, 1, 1, 1]
+        assert len(calls) == 1
+        assert flight.in_flight() == 0
+
+    def test_do_different_keys(self) -> None:
+        flight: SingleFlight[str, str] = SingleFlight()
+        assert flight.do("a", lambda: "a") == "a"
+        assert flight.do("b", lambda: "b") == "b"
+
+    def test_do_exception(self) -> None:
+        flight: SingleFlight[str, int] = SingleFlight()
+
+        def func() -> int:
+            raise ValueError("test error")
+
+        with pytest.raises(ValueError):
+            flight.do("key", func)
+        assert flight.in_flight() == 0
+        assert flight.do("key", lambda: 1) == 1
+
+
+class TestWapiSingleFlight:
+    def test_get_game_info_coalesced(self, monkeypatch: MonkeyPatch, game_in_progress: str) -> None:
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        class MockResponse:
+            status_code = 200
+            headers: dict[str, str] = {}
+            content = game_in_progress.encode()
+
+            def __init__(self, path: str, data: dict[str, str], headers: dict[str, str] | None = None) -> None:
+                calls.append(data["MatchID"])
+                started.set()
+                release.wait(timeout=5)
+
+            def json(self) -> Any:
+                return json.loads(game_in_progress)
+
+        monkeypatch.setattr(Wapi, "_get_info", MockResponse)
+        wapi = Wapi("test_token")
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(wapi.get_game_info, "in-progress-match-id")]
+            started.wait(timeout=5)
+            futures += [executor.submit(wapi.get_game_info, "in-progress-match-id") for _ in range(2)]
+            time.sleep(0.1)
+            release.set()
+            matches = [future.result(timeout=5) for future in futures]
+
+        assert calls == ["in-progress-match-id"]
+        assert all(match is matches[0] for match in matches)
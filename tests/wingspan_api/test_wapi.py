@@ -1,10 +1,19 @@
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
 from typing import Any
+from unittest.mock import MagicMock, patch
 
 import pytest
+import requests
+from freezegun import freeze_time
 from _pytest.monkeypatch import MonkeyPatch
 
-from wingspan_api.wapi import Player, Wapi
+from wingspan_api import wapi as wapi_module
+from wingspan_api.wapi import Match, Player, Wapi
 
 in_progress_players = [Player(UserName="jeff", ChilliConnectID="jeff_id"),
                        Player(UserName="shuai", ChilliConnectID="shuai_id"),
@@ -22,7 +31,10 @@ class TestWapi:
              game_forfeited: str,
              games: str) -> Wapi:
         class MockRequest:
-            def __init__(self, path: str, data: dict[str, str]) -> None:
+            status_code = 200
+            headers: dict[str, str] = {}
+
+            def __init__(self, path: str, data: dict[str, str], headers: dict[str, str] | None = None) -> None:
                 if len(data) == 0:
                     self.result = json.loads(games)
                 else:
@@ -41,6 +53,10 @@ class TestWapi:
             def json(self) -> Any:
                 return self.result
 
+            @property
+            def content(self) -> bytes:
+                return json.dumps(self.result).encode()
+
         monkeypatch.setattr(Wapi, "_get_info", MockRequest)
         wapi = Wapi("test_token")
         return wapi
@@ -56,6 +72,11 @@ class TestWapi:
         actual = wapi.get_game_info("in-progress-match-id").get_player(expected.ChilliConnectID)
         assert actual == expected
 
+    def test_get_player_id(self, wapi: Wapi) -> None:
+        match = wapi.get_game_info("in-progress-match-id")
+        assert match.get_player_id("steven") == "steven_id"
+        assert match.get_player_id("nobody") is None
+
     def test_current_player(self, wapi: Wapi) -> None:
         expected = Player(UserName="victor", ChilliConnectID="victor_id")
         actual = wapi.get_game_info("in-progress-match-id").current_player
@@ -87,3 +108,133 @@ class TestWapi:
         g_info = wapi.get_game_info(game_id)
         assert g_info.is_forfeit() == (expected is not None)
         assert g_info.forfeit_by == expected
+
+
+class TestWapiPayloadCache:
+    @pytest.fixture
+    def post(self, monkeypatch: MonkeyPatch) -> MagicMock:
+        post = MagicMock()
+        monkeypatch.setattr(requests, "post", post)
+        return post
+
+    @staticmethod
+    def response(content: str, status_code: int = 200, etag: str | None = None) -> requests.Response:
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = content.encode()
+        if etag is not None:
+            response.headers["ETag"] = etag
+        return response
+
+    def test_unchanged_payload_reuses_match(self, post: MagicMock, game_in_progress: str) -> None:
+        post.side_effect = [self.response(game_in_progress), self.response(game_in_progress)]
+        wapi = Wapi("test_token")
+        assert wapi.fingerprint("in-progress-match-id") is None
+
+        first = wapi.get_game_info("in-progress-match-id")
+        fingerprint = wapi.fingerprint("in-progress-match-id")
+        with patch.object(Match, "from_dict") as from_dict:
+            second = wapi.get_game_info("in-progress-match-id")
+        from_dict.assert_not_called()
+        assert second is first
+        assert wapi.fingerprint("in-progress-match-id") == fingerprint
+
+    def test_changed_payload(self, post: MagicMock, game_in_progress: str, game_completed: str) -> None:
+        post.side_effect = [self.response(game_in_progress), self.response(game_completed)]
+        wapi = Wapi("test_token")
+        first = wapi.get_game_info("match-id")
+        fingerprint = wapi.fingerprint("match-id")
+        second = wapi.get_game_info("match-id")
+        assert first != second
+        assert wapi.fingerprint("match-id") != fingerprint
+
+    def test_not_modified(self, post: MagicMock, game_in_progress: str) -> None:
+        post.side_effect = [self.response(game_in_progress, etag='"v1"'), self.response("", status_code=304)]
+        wapi = Wapi("test_token")
+        first = wapi.get_game_info("match-id")
+        assert wapi.get_game_info("match-id") is first
+        assert post.call_args.kwargs["headers"]["If-None-Match"] == '"v1"'
+
+    def test_fetch_then_decode(self, post: MagicMock, game_in_progress: str) -> None:
+        post.side_effect = [self.response(game_in_progress), self.response(game_in_progress)]
+        wapi = Wapi("test_token")
+        payload = wapi.fetch_game_payload("match-id")
+        assert payload.content is not None
+        assert wapi.fingerprint("match-id") is None  # not cached until it's decoded
+        match = wapi.decode_game_payload(payload)
+
+        unchanged = wapi.fetch_game_payload("match-id")
+        assert unchanged.content is None
+        assert unchanged.digest == payload.digest
+        assert wapi.decode_game_payload(unchanged) is match
+
+    def test_cached_game_info(self, post: MagicMock, game_in_progress: str) -> None:
+        post.side_effect = [self.response(game_in_progress), self.response(game_in_progress)]
+        wapi = Wapi("test_token")
+        assert wapi.cached_game_info("match-id") is None
+        with freeze_time("2020-01-01 01:00:00"):
+            match = wapi.get_game_info("match-id")
+        # an unchanged payload still counts as fresh
+        with freeze_time("2020-01-01 02:00:00"):
+            wapi.get_game_info("match-id")
+        cached = wapi.cached_game_info("match-id")
+        assert cached is not None and cached.match is match
+        assert cached.received == datetime(2020, 1, 1, 2, tzinfo=timezone.utc)
+        # but its time remaining is still from when it was first received
+        assert cached.unchanged_since == datetime(2020, 1, 1, 1, tzinfo=timezone.utc)
+
+    def test_expired_token_one_login(self, post: MagicMock, monkeypatch: MonkeyPatch, game_in_progress: str) -> None:
+        monkeypatch.setattr(wapi_module, "STEAMWORKS", MagicMock(), raising=False)
+        fetches = 4
+        expired = threading.Barrier(fetches, timeout=5)  # every fetch sees the expired token before any logs in
+        logins = []
+
+        def respond(url: str, data: dict[str, Any], headers: dict[str, str], timeout: Any) -> requests.Response:
+            if url.endswith("/login/steam"):
+                logins.append(url)
+                return self.response(json.dumps({"ConnectAccessToken": "new_token"}))
+            if headers["Connect-Access-Token"] == "expired_token":
+                expired.wait()
+                return self.response(json.dumps({"Code": 1003}), status_code=401)
+            return self.response(game_in_progress)
+
+        post.side_effect = respond
+        wapi = Wapi("expired_token")
+        with ThreadPoolExecutor(max_workers=fetches) as executor:
+            payloads = list(executor.map(wapi.fetch_game_payload, [f"match{i}" for i in range(fetches)]))
+        assert len(logins) == 1
+        assert wapi.access_token == "new_token"
+        assert all(payload.content is not None for payload in payloads)
+
+    def test_concurrent_fetches_share_request(self, post: MagicMock, game_in_progress: str) -> None:
+        fetches = 4
+        started = threading.Event()
+        release = threading.Event()
+
+        def respond(*args: Any, **kwargs: Any) -> requests.Response:
+            started.set()
+            release.wait(timeout=5)
+            return self.response(game_in_progress)
+
+        post.side_effect = respond
+        wapi = Wapi("test_token")
+        with ThreadPoolExecutor(max_workers=fetches) as executor:
+            futures = [executor.submit(wapi.fetch_game_payload, "match-id") for _ in range(fetches)]
+            started.wait(timeout=5)
+            time.sleep(0.05)  # the rest join the fetch in flight
+            release.set()
+            payloads = [future.result() for future in futures]
+            matches = list(executor.map(wapi.decode_game_payload, payloads))
+        assert post.call_count == 1
+        assert all(match is matches[0] for match in matches)
+
+    def test_older_payload_not_cached(self, post: MagicMock, game_in_progress: str, game_completed: str) -> None:
+        post.side_effect = [self.response(game_in_progress), self.response(game_completed)]
+        wapi = Wapi("test_token")
+        older = wapi.fetch_game_payload("match-id")
+        newer = replace(wapi.fetch_game_payload("match-id"), received=older.received + timedelta(seconds=1))
+        newer_match = wapi.decode_game_payload(newer)
+        # decoded late, e.g. by a slower thread, so the newer payload stays cached
+        wapi.decode_game_payload(older)
+        cached = wapi.cached_game_info("match-id")
+        assert cached is not None and cached.match is newer_match
@@ -0,0 +1,44 @@
+from collections.abc import Collection
+
+from wingspan_bot.data.batch_loader import BatchLoader
+
+
+class TestBatchLoader:
+    @staticmethod
+    def loader() -> tuple[BatchLoader[int, list[int]], list[set[int]]]:
+        calls: list[set[int]] = []
+
+        def load_many(keys: Collection[int]) -> dict[int, list[int]]:
+            calls.append(set(keys))
+            return {key: [key] for key in keys if key % 2 == 0}
+
+        return BatchLoader(load_many, list), calls
+
+    def test_primed_keys_loaded_together(self) -> None:
+        loader, calls = self.loader()
+        loader.prime([2, 3, 4])
+        assert loader.load(2) == [2]
+        assert loader.load(4) == [4]
+        assert calls == [{2, 3, 4}]
+        assert loader.batches == 1
+
+    def test_default(self) -> None:
+        loader, _ = self.loader()
+        assert loader.load(3) == []
+        assert loader.load(3) is loader.load(3)
+
+    def test_memoized(self) -> None:
+        loader, calls = self.loader()
+        loader.load(2)
+        loader.prime([2, 4])
+        loader.load(4)
+        assert calls == [{2}, {4}]
+
+    def test_clear(self) -> None:
+        loader, calls = self.loader()
+        loader.prime([2, 4])
+        loader.load(2)
+        loader.clear(2)
+        loader.load(4)
+        loader.load(2)
+        assert calls == [{2, 4}, {2}]
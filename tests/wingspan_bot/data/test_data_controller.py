@@ -1,11 +1,18 @@
-from unittest.mock import MagicMock, call
+import asyncio
+import dataclasses
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
 
 import pytest
 from freezegun import freeze_time
+from sqlalchemy import event
 
-from wingspan_bot.data.data_controller import DataController
+from wingspan_bot.data.data_controller import DataController, _turn_changes
+from wingspan_bot.data.history_generator import HistoryConfig, generate_history
 from wingspan_bot.data.data_objects import FastestPlayer, PlayerStat, PlayerTurnTimings, TurnTiming
 from wingspan_bot.data.models import MessageType
+from wingspan_api.resilience import CircuitOpenError
+from wingspan_api.wapi import Match
 from tests.conftest import MessageTestData
 
 
@@ -39,37 +46,40 @@ class TestDataController:
         dc_monitor_many.remove(1, "game1")
         assert dc_monitor_many.get_monitored_matches(channel, monitored) == expected
 
-    def test_get_all_matches(self, dc_monitor_many: DataController) -> None:
-        dc_monitor_many.wapi.get_game_info.side_effect = [  # type: ignore[attr-defined]
-            "game1", "game2", "game3", "game1", "game4"]
-        matches = set(dc_monitor_many.get_matches())
-        assert matches == {(1, "game1"), (1, "game2"), (1, "game3"), (2, "game1"), (2, "game4")}
-
-    def test_get_all_matches_empty(self, data_controller: DataController) -> None:
-        matches = list(data_controller.get_matches())
-        assert len(matches) == 0
-
-    def test_get_matches(self, dc_monitor_many: DataController) -> None:
-        dc_monitor_many.wapi.get_game_info.side_effect = ["game 1", "game 2", "game 3"]  # type: ignore[attr-defined]
-        dc_monitor_many.db.add_or_update_score = MagicMock()  # type: ignore[assignment]
-        matches = set(dc_monitor_many.get_matches(1))
-        assert matches == {(1, "game 1"), (1, "game 2"), (1, "game 3")}
-
-    def test_get_matches_updated_score(self, dc_monitor_many: DataController) -> None:
-        dc_monitor_many.wapi.get_game_info.side_effect = ["game 1", "game 2", "game 3"]  # type: ignore[attr-defined]
-        dc_monitor_many.db.add_or_update_score = MagicMock()  # type: ignore[assignment]
-        set(dc_monitor_many.get_matches(1))
-        dc_monitor_many.db.add_or_update_score.assert_has_calls([call("game 1"), call("game 2"), call("game 3")])
-        assert dc_monitor_many.db.add_or_update_score.call_count == 3
-
-    def test_get_matches_empty(self, dc_monitor_many: DataController) -> None:
-        matches = list(dc_monitor_many.get_matches(5))
-        assert len(matches) == 0
-
-    def test_get_matches_error(self, dc_monitor_many: DataController) -> None:
-        dc_monitor_many.wapi.get_game_info.side_effect = Exception("test error")  # type: ignore[attr-defined]
-        matches = set(dc_monitor_many.get_matches(1))
-        assert matches == {(1, "game1"), (1, "game2"), (1, "game3")}
+    def test_prepare_matches(self, dc_monitor_many: DataController) -> None:
+        assert dc_monitor_many.prepare_matches() == [
+            (1, "game1"), (1, "game2"), (1, "game3"), (2, "game1"), (2, "game4")]
+        assert dc_monitor_many.prepare_matches(2) == [(2, "game1"), (2, "game4")]
+        assert dc_monitor_many.prepare_matches(5) == []
+
+    def test_match_changed(self, data_controller: DataController) -> None:
+        assert data_controller.match_changed(1, "game1", "digest")
+        data_controller.match_processed(1, "game1", "digest")
+        assert not data_controller.match_changed(1, "game1", "digest")
+        assert data_controller.match_changed(1, "game1", "changed")
+        # each channel processes the payload separately
+        assert data_controller.match_changed(2, "game1", "digest")
+        assert data_controller.match_changed(1, "game1", None)
+
+    def test_match_changed_after_error(self, data_controller: DataController) -> None:
+        data_controller.match_processed(1, "game1", "digest")
+        data_controller.match_failed(1, "game1", Exception("test error"))
+        assert data_controller.match_changed(1, "game1", "digest")
+
+    def test_update_scores(self, data_controller: DataController, game_in_progress_obj: Match) -> None:
+        data_controller.db.add_or_update_score = MagicMock()  # type: ignore[assignment]
+        data_controller.update_scores("game1", game_in_progress_obj, "digest")
+        data_controller.update_scores("game1", game_in_progress_obj, "digest")
+        assert data_controller.db.add_or_update_score.call_count == 1  # type: ignore[attr-defined]
+        data_controller.update_scores("game1", game_in_progress_obj, "changed")
+        data_controller.update_scores("game1", game_in_progress_obj, None)
+        assert data_controller.db.add_or_update_score.call_count == 3  # type: ignore[attr-defined]
+
+    def test_match_failed_circuit_open(self, data_controller: DataController) -> None:
+        with patch("wingspan_bot.data.data_controller.logger") as logger:
+            data_controller.match_failed(1, "game1", CircuitOpenError("test error"))
+        logger.warning.assert_called_once()
+        logger.error.assert_not_called()
 
     def test_add_to_empty(self, data_controller: DataController) -> None:
         assert data_controller.add(1, "game1")
@@ -309,3 +319,180 @@ class TestDataController:
             data_controller.add_message(match="match1", channel=2, player="player2", message_type=MessageType.NEW_TURN)
             data_controller.add_message(match="match1", channel=1, player="player1", message_type=MessageType.REMINDER)
         assert data_controller.get_player_turn_timings(channel_id=1, match="match3") == PlayerTurnTimings()
+
+    def test_compact_history(self, data_controller: DataController) -> None:
+        with freeze_time("2022-1-1"):
+            data_controller.add_message("match-id", 1, "player1", MessageType.READY)
+            data_controller.add_message("match-id", 1, "player1", MessageType.REMINDER)
+        with freeze_time("2022-1-2"):
+            data_controller.add_message("match-id", 1, None, MessageType.ERROR)
+            data_controller.add_message("match-id", 1, "player2", MessageType.NEW_TURN)
+        with freeze_time("2022-1-3"):
+            data_controller.add_message("match-id", 1, None, MessageType.GAME_COMPLETE)
+        with freeze_time("2022-2-1"):
+            assert data_controller.compact_history(timedelta(days=7)) == 2
+        assert ([message.message_type for message in data_controller.db.get_messages(1)] ==
+                [MessageType.READY, MessageType.NEW_TURN, MessageType.GAME_COMPLETE])
+
+    def test_compact_history_keeps_last(self, data_controller: DataController) -> None:
+        with freeze_time("2022-1-1"):
+            data_controller.add_message("match-id", 1, "player1", MessageType.NEW_TURN)
+        with freeze_time("2022-1-2"):
+            data_controller.add_message("match-id", 1, "player1", MessageType.GAME_TIMEOUT)
+        with freeze_time("2022-2-1"):
+            assert data_controller.compact_history(timedelta(days=7)) == 0
+        assert len(data_controller.db.get_messages(1)) == 2
+
+    @pytest.mark.parametrize("last_message_type,now", (
+        (MessageType.REMINDER, "2022-2-1"),
+        (MessageType.GAME_COMPLETE, "2022-1-5"),
+    ))
+    def test_compact_history_skipped(
+            self, data_controller: DataController, last_message_type: MessageType, now: str) -> None:
+        with freeze_time("2022-1-1"):
+            data_controller.add_message("match-id", 1, "player1", MessageType.NEW_TURN)
+            data_controller.add_message("match-id", 1, "player1", MessageType.REMINDER)
+        with freeze_time("2022-1-2"):
+            data_controller.add_message("match-id", 1, "player1", last_message_type)
+        with freeze_time(now):
+            assert data_controller.compact_history(timedelta(days=7)) == 0
+        assert len(data_controller.db.get_messages(1)) == 3
+
+    def test_compact_history_stats_unchanged(self, data_controller: DataController) -> None:
+        generate_history(data_controller.db, HistoryConfig(channels=2, matches_per_channel=10, players=10,
+                                                           reminder_probability=0.5, error_probability=0.2))
+        channels = (1, 2)
+        stats_before = [(data_controller.get_fastest_player(channel), data_controller.get_player_turn_timings(channel))
+                        for channel in channels]
+        messages_before = sum(len(data_controller.db.get_messages(channel)) for channel in channels)
+
+        deleted = data_controller.compact_history(timedelta(days=30))
+
+        assert deleted > 0
+        assert sum(len(data_controller.db.get_messages(channel)) for channel in channels) == messages_before - deleted
+        assert [(data_controller.get_fastest_player(channel), data_controller.get_player_turn_timings(channel))
+                for channel in channels] == stats_before
+        assert data_controller.compact_history(timedelta(days=30)) == 0
+
+    def test_turns_match_messages(self, data_controller: DataController) -> None:
+        """ The turns found in SQL are the ones found by scanning through the messages """
+        generate_history(data_controller.db, HistoryConfig(channels=1, matches_per_channel=10, players=10,
+                                                           reminder_probability=0.5, error_probability=0.2))
+        expected = [(last_turn.player, last_turn.datetime, turn.datetime)
+                    for last_turn, turn in _turn_changes(data_controller.db.get_messages(1)) if last_turn is not None]
+        assert len(expected) > 0
+        assert [tuple(turn) for turn in data_controller.db.get_turns(1)] == expected
+
+    def test_unit_of_work(self, data_controller: DataController) -> None:
+        with data_controller.unit_of_work() as unit_of_work:
+            data_controller.add_message("match-id", 1, None, MessageType.ERROR)
+            with data_controller.unit_of_work() as nested:
+                assert nested is unit_of_work
+                data_controller.add_message("match-id", 2, "player1", MessageType.NEW_TURN)
+            assert unit_of_work.pending == 2
+            assert data_controller.db.get_messages(1) == []
+            assert not data_controller.should_send_message(1, "match-id")
+        assert len(data_controller.db.get_messages(1)) == 1
+        assert len(data_controller.db.get_messages(2)) == 1
+
+    async def test_unit_of_work_per_task(self, data_controller: DataController) -> None:
+        tick_waiting = asyncio.Event()
+        command_done = asyncio.Event()
+
+        async def tick() -> None:
+            with data_controller.unit_of_work() as unit_of_work:
+                # tasks the tick starts join its unit of work
+                await asyncio.create_task(asyncio.to_thread(
+                    data_controller.add_message, "match-id", 1, None, MessageType.ERROR))
+                tick_waiting.set()
+                await command_done.wait()  # e.g. sending to discord
+                assert unit_of_work.pending == 1
+
+        async def command() -> None:
+            await tick_waiting.wait()
+            # a command handled meanwhile writes straight away rather than joining the tick
+            data_controller.add_message("match-id", 2, None, MessageType.ERROR)
+            assert len(data_controller.db.get_messages(2)) == 1
+            assert data_controller.db.get_messages(1) == []
+            command_done.set()
+
+        await asyncio.gather(tick(), command())
+        assert len(data_controller.db.get_messages(1)) == 1
+
+    def test_update_scores_unit_of_work(self, data_controller: DataController, game_in_progress_obj: Match) -> None:
+        with data_controller.unit_of_work() as unit_of_work:
+            data_controller.update_scores("game1", game_in_progress_obj, "digest")
+            assert unit_of_work.pending == 1
+            assert data_controller.db.get_scores(game_in_progress_obj) == []
+        assert len(data_controller.db.get_scores(game_in_progress_obj)) > 0
+
+    def test_tick_lookups_batched(self, data_controller: DataController, game_in_progress_obj: Match) -> None:
+        for i in range(20):
+            data_controller.db.add_match(i % 2, f"match{i}")
+        data_controller.db.add_subscriptions(0, 100, "victor")
+        data_controller.db.add_message("match0", 0, "victor", MessageType.NEW_TURN)
+        statements: list[str] = []
+        event.listen(data_controller.db.engine, "before_cursor_execute",
+                     lambda connection, cursor, statement, *args: statements.append(statement))
+
+        sent = []
+        with data_controller.unit_of_work():
+            for channel, match_id in data_controller.prepare_matches():
+                match = dataclasses.replace(game_in_progress_obj, MatchID=match_id)
+                if data_controller.should_send_message(channel, match):
+                    sent.append((channel, str(match), data_controller.get_subscriptions(channel)))
+                    data_controller.add_message(match, channel, "victor", MessageType.NEW_TURN)
+
+        assert len(sent) == 19
+        assert (0, "match2", {"victor": [100]}) in sent
+        selects = [statement for statement in statements if statement.lstrip().startswith("SELECT")]
+        assert len([statement for statement in selects if "FROM status_message" in statement]) == 1
+        assert len([statement for statement in selects if "FROM subscription" in statement]) == 1
+
+    def test_tick_lookups_see_changes(self, data_controller: DataController) -> None:
+        with data_controller.unit_of_work():
+            assert data_controller.get_subscriptions(1) == {}
+            data_controller.subscribe(1, 100, "player1")
+            assert data_controller.get_subscriptions(1) == {"player1": [100]}
+            assert data_controller.should_send_message(1, "match-id")
+            data_controller.add_message("match-id", 1, None, MessageType.ERROR)
+            assert not data_controller.should_send_message(1, "match-id")
+
+    def test_get_stats(self, data_controller: DataController) -> None:
+        with freeze_time("2022-1-1"):
+            data_controller.add_message("match-id", 1, "player1", MessageType.NEW_TURN)
+        with freeze_time("2022-1-2"):
+            data_controller.add_message("match-id", 1, "player2", MessageType.NEW_TURN)
+        stats = data_controller.get_stats(1)
+        assert stats.fastest_player == FastestPlayer(PlayerStat(wingspan_names=["player1"], score=24))
+        assert data_controller.get_stats(1) is stats
+        assert data_controller.get_stats(1, "match-id") is not stats
+
+    def test_get_stats_invalidated_by_message(self, data_controller: DataController) -> None:
+        stats = data_controller.get_stats(1)
+        data_controller.add_message("match-id", 2, "player1", MessageType.NEW_TURN)
+        assert data_controller.get_stats(1) is stats
+        data_controller.add_message("match-id", 1, "player1", MessageType.NEW_TURN)
+        assert data_controller.get_stats(1) is not stats
+
+    def test_get_stats_invalidated_by_monitoring(self, dc_monitor_many: DataController) -> None:
+        dc_monitor_many.wapi.get_game_info = MagicMock()  # type: ignore[assignment]
+        stats = dc_monitor_many.get_stats(1)
+        assert stats.matches_monitored == 3
+        dc_monitor_many.add(1, "game5")
+        assert dc_monitor_many.get_stats(1).matches_monitored == 4
+        dc_monitor_many.remove(1, "game5")
+        assert dc_monitor_many.get_stats(1) is not stats
+
+    def test_get_stats_invalidated_by_score(self, dc_monitor_many: DataController, game_in_progress_obj: Match) -> None:
+        stats = {channel: dc_monitor_many.get_stats(channel) for channel in (1, 2)}
+        # game1 is monitored in both channels, so a score update for it from either invalidates both
+        dc_monitor_many.update_scores("game1", game_in_progress_obj, "digest")
+        assert dc_monitor_many.get_stats(1) is not stats[1]
+        assert dc_monitor_many.get_stats(2) is not stats[2]
+
+    def test_get_stats_unit_of_work(self, data_controller: DataController) -> None:
+        with data_controller.unit_of_work():
+            data_controller.add_message("match-id", 1, "player1", MessageType.NEW_TURN)
+            pending = data_controller.get_stats(1)
+        assert data_controller.get_stats(1) is not pending
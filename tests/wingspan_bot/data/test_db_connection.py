@@ -1,10 +1,14 @@
+import dataclasses
 import datetime
 from collections.abc import Iterable
-from typing import TypeVar
+from typing import Any, TypeVar
+from unittest.mock import MagicMock
 
 from freezegun import freeze_time
+from sqlalchemy import event
 
 from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.data.models import MessageType
 from tests.conftest import MessageTestData
 from wingspan_api.wapi import Match
 
@@ -18,6 +22,12 @@ def iterable_to_scalar(iterable: Iterable[T]) -> T:
     return vals[0]
 
 
+def rename(match: Match, old_name: str, new_name: str) -> Match:
+    players = [dataclasses.replace(player, UserName=new_name) if player.UserName == old_name else player
+               for player in match.Players]
+    return dataclasses.replace(match, Players=players)
+
+
 class TestDBConnection:
     def test_get_matches(self, db: DBConnection) -> None:
         db.add_match(channel=1, match_id="match1")
@@ -145,3 +155,133 @@ class TestDBConnection:
             db.add_match(1, "match4")
             db.add_match(1, "match3")
         assert db.get_data_start(1, "match2") == datetime.datetime(2022, 1, 2)
+
+    def test_scores_follow_rename(self, db: DBConnection, game_completed_obj: Match) -> None:
+        db.add_match(channel=1, match_id=str(game_completed_obj))
+        db.add_or_update_score(game_completed_obj)
+        num_scores = len(db.get_scores(game_completed_obj))
+        db.add_or_update_score(rename(game_completed_obj, "jeff", "jeffrey"))
+        assert len(db.get_scores(game_completed_obj)) == num_scores
+        assert iterable_to_scalar(db.get_highest_score(1)) == ("jeffrey", 96)
+
+    def test_messages_follow_rename(self, db: DBConnection, game_in_progress_obj: Match) -> None:
+        db.add_message(game_in_progress_obj, 1, "victor", MessageType.NEW_TURN)
+        renamed = rename(game_in_progress_obj, "victor", "vic")
+        db.add_message(renamed, 1, "vic", MessageType.REMINDER)
+        assert [message.player_turn for message in db.get_messages(1)] == ["vic", "vic"]
+
+    def test_get_turns(self, db: DBConnection) -> None:
+        messages = (
+            ("match1", None, MessageType.ERROR),  # before the first turn
+            ("match1", "player1", MessageType.READY),
+            ("match2", "player2", MessageType.NEW_TURN),
+            ("match1", "player1", MessageType.REMINDER),
+            ("match1", None, MessageType.ERROR),
+            ("match1", "player2", MessageType.NEW_TURN),
+            ("match2", "player3", MessageType.NEW_TURN),
+            ("match1", None, MessageType.GAME_COMPLETE),
+        )
+        for day, (match_id, player, message_type) in enumerate(messages, start=1):
+            with freeze_time(datetime.datetime(2022, 1, day)):
+                db.add_message(match_id, 1, player, message_type)
+        assert [(turn.player, turn.start.day, turn.end.day) for turn in db.get_turns(1)] == [
+            ("player1", 2, 6), ("player2", 3, 7), ("player2", 6, 8)]
+        assert [(turn.player, turn.start.day, turn.end.day) for turn in db.get_turns(1, "match2")] == [
+            ("player2", 3, 7)]
+        assert db.get_turns(2) == []
+
+    def test_get_previous_messages(self, db: DBConnection) -> None:
+        with freeze_time("2022-1-1"):
+            db.add_message("match1", 1, "player1", MessageType.NEW_TURN)
+            db.add_message("match1", 2, "player3", MessageType.NEW_TURN)
+        with freeze_time("2022-1-2"):
+            db.add_message("match1", 1, "player2", MessageType.REMINDER)
+        previous_messages = db.get_previous_messages([(1, "match1"), (2, "match1"), (1, "match2")])
+        assert {key: message.player_turn for key, message in previous_messages.items()} == {
+            (1, "match1"): "player2", (2, "match1"): "player3"}
+
+    def test_get_channels_subscriptions(self, db: DBConnection) -> None:
+        db.add_subscriptions(1, 100, "player1")
+        db.add_subscriptions(1, 101, "player2")
+        db.add_subscriptions(2, 100, "player1")
+        db.add_subscriptions(3, 100, "player1")
+        subscriptions = db.get_channels_subscriptions([1, 2, 4])
+        assert {channel: {subscription.discord_id for subscription in channel_subscriptions}
+                for channel, channel_subscriptions in subscriptions.items()} == {1: {100, 101}, 2: {100}}
+
+    def test_get_finished_matches(self, db: DBConnection) -> None:
+        with freeze_time("2022-1-1"):
+            db.add_message("complete", 1, None, MessageType.GAME_COMPLETE)
+            db.add_message("forfeit", 2, "player1", MessageType.GAME_FORFEIT)
+            db.add_message("in-progress", 1, "player1", MessageType.NEW_TURN)
+        with freeze_time("2022-1-3"):
+            db.add_message("recent", 1, None, MessageType.GAME_COMPLETE)
+        assert sorted(db.get_finished_matches(before=datetime.datetime(2022, 1, 2))) == [
+            (1, "complete"), (2, "forfeit")]
+
+    def test_delete_messages(self, db: DBConnection) -> None:
+        for i in range(3):
+            db.add_message("match-id", 1, f"player{i}", MessageType.NEW_TURN)
+        db.delete_messages([message.id for message in db.get_messages(1)[:2] if message.id is not None])
+        assert [message.player_turn for message in db.get_messages(1)] == ["player2"]
+
+
+class TestUnitOfWork:
+    @staticmethod
+    def count_commits(db: DBConnection) -> list[Any]:
+        commits: list[Any] = []
+        event.listen(db.engine, "commit", commits.append)
+        return commits
+
+    def test_single_commit(self, db: DBConnection, game_in_progress_obj: Match) -> None:
+        commits = self.count_commits(db)
+        with db.unit_of_work() as unit_of_work:
+            unit_of_work.add_or_update_score(game_in_progress_obj)
+            for i in range(5):
+                unit_of_work.add_message(f"match{i}", 1, "player1", MessageType.NEW_TURN)
+            assert db.get_messages(1) == []
+            assert unit_of_work.pending == 6
+        assert len(commits) == 1
+        assert len(db.get_messages(1)) == 5
+        assert len(db.get_scores(game_in_progress_obj)) > 0
+
+    def test_get_previous_message_pending(self, db: DBConnection) -> None:
+        db.add_message("match-id", 1, "player1", MessageType.NEW_TURN)
+        with db.unit_of_work() as unit_of_work:
+            unit_of_work.add_message("match-id", 1, "player2", MessageType.REMINDER)
+            previous_message = unit_of_work.get_previous_message(1, "match-id")
+            assert previous_message is not None
+            assert previous_message.player_turn == "player2"
+            other_channel = unit_of_work.get_previous_message(2, "match-id")
+            assert other_channel is None
+
+    def test_flush_early(self, db: DBConnection) -> None:
+        commits = self.count_commits(db)
+        with db.unit_of_work() as unit_of_work:
+            unit_of_work.max_pending = 3
+            for i in range(7):
+                unit_of_work.add_message(f"match{i}", 1, "player1", MessageType.NEW_TURN)
+            assert len(db.get_messages(1)) == 6
+        assert len(commits) == 3
+        assert len(db.get_messages(1)) == 7
+
+    def test_flush_on_error(self, db: DBConnection) -> None:
+        try:
+            with db.unit_of_work() as unit_of_work:
+                unit_of_work.add_message("match-id", 1, "player1", MessageType.NEW_TURN)
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        assert len(db.get_messages(1)) == 1
+
+    def test_fallback(self, db: DBConnection) -> None:
+        bad_match = MagicMock()
+        bad_match.StateData.scores = [MagicMock()]
+        bad_match.get_player_username.side_effect = RuntimeError("bad score")
+        commits = self.count_commits(db)
+        with db.unit_of_work() as unit_of_work:
+            unit_of_work.add_message("match1", 1, "player1", MessageType.NEW_TURN)
+            unit_of_work.add_or_update_score(bad_match)
+            unit_of_work.add_message("match2", 1, "player1", MessageType.NEW_TURN)
+        assert len(commits) == 2
+        assert [message.match_id for message in db.get_messages(1)] == ["match1", "match2"]
@@ -0,0 +1,54 @@
+from sqlalchemy import func, select
+
+from wingspan_bot.data.data_controller import DataController
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.data.history_generator import HistoryConfig, TURNS_PER_PLAYER, generate_history
+from wingspan_bot.data.models import Base, MessageType, Monitor, Score, StatusMessage
+
+CONFIG = HistoryConfig(channels=3, matches_per_channel=10, players=20, players_per_channel=5)
+
+
+def count(db: DBConnection, column: object) -> int:
+    with db.Session() as session:
+        return int(session.execute(select(func.count(column))).scalar_one())
+
+
+class TestHistoryGenerator:
+    def test_row_counts(self, db: DBConnection) -> None:
+        summary = generate_history(db, CONFIG)
+        assert summary.monitors == count(db, Monitor.id) == 30
+        assert summary.status_messages == count(db, StatusMessage.id)
+        assert summary.scores == count(db, Score.match_id)
+        # every completed match has a full game's worth of turns
+        assert summary.status_messages > 27 * 2 * TURNS_PER_PLAYER
+
+    def test_deterministic(self, db: DBConnection) -> None:
+        other = DBConnection("sqlite://")
+        Base.metadata.create_all(other.engine)
+        assert generate_history(db, CONFIG) == generate_history(other, CONFIG)
+        assert db.get_messages(2)[-1].datetime == other.get_messages(2)[-1].datetime
+
+    def test_completed_matches(self, db: DBConnection) -> None:
+        generate_history(db, CONFIG)
+        completed = {message.match_id for message in db.get_messages(1)
+                     if message.message_type == MessageType.GAME_COMPLETE}
+        assert len(completed) == 9
+        assert "channel1-match9" not in completed
+
+    def test_match_messages(self, db: DBConnection) -> None:
+        generate_history(db, CONFIG)
+        completed = db.get_messages(1, "channel1-match0")
+        assert completed[0].message_type == MessageType.READY
+        assert completed[-1].message_type == MessageType.GAME_COMPLETE
+        in_progress = db.get_messages(3, "channel3-match9")
+        assert in_progress[0].message_type == MessageType.READY
+        assert in_progress[-1].message_type != MessageType.GAME_COMPLETE
+
+    def test_stats(self, db: DBConnection, data_controller: DataController) -> None:
+        generate_history(db, CONFIG)
+        fastest = data_controller.get_fastest_player(1)
+        assert fastest is not None
+        assert len(fastest.fastest_player.wingspan_names) == 1
+        timings = data_controller.get_player_turn_timings(1)
+        assert len(timings.player_turn_timings) == CONFIG.players_per_channel
+        assert data_controller.get_highest_scores(2).highest_score.score > 0
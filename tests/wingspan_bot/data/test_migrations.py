@@ -0,0 +1,112 @@
+from collections.abc import Generator
+from pathlib import Path
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import BigInteger, inspect, select, text
+
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.data.models import Base, MessageType, Player
+from tests.conftest import TEST_DB_CONNECTION
+
+ROOT = Path(__file__).parents[3]
+SNOWFLAKE = 981234567890123456
+BEFORE_PLAYERS = "8f3a6d1e7b25"
+# tables replaced by migrations, left behind if one failed part way
+LEGACY_TABLES = ("score_new", "channel_player_rollup_new", "global_player_rollup_new")
+LEGACY_ROWS = (
+    "INSERT INTO status_message (match_id, channel, datetime, player_turn, message_type) "
+    "VALUES ('match-id', 1, '2022-01-01 00:00:00', 'player1', 'NEW_TURN')",
+    "INSERT INTO status_message (match_id, channel, datetime, player_turn, message_type) "
+    "VALUES ('match-id', 1, '2022-01-02 00:00:00', NULL, 'GAME_COMPLETE')",
+    "INSERT INTO subscription (channel, discord_id, wingspan_name) VALUES (1, 100, 'player2')",
+    "INSERT INTO score VALUES ('match-id', 'player1', '2022-01-02 00:00:00', 90, 50, 10, 10, 10, 5, 5, 2)",
+    "INSERT INTO global_player_rollup (player_name, games_played, wins, total_score, best_score, best_bird_points, "
+    "best_bonus_card_points, best_goals_points, best_eggs_points, best_cached_food_points, best_tucked_cards_points) "
+    "VALUES ('player1', 1, 1, 90, 90, 50, 10, 10, 10, 5, 5)",
+)
+
+
+def migrate(db: DBConnection, revision: str, downgrade: bool = False) -> None:
+    # no ini file, so alembic leaves the logging configuration alone
+    config = Config()
+    config.set_main_option("script_location", str(ROOT / "alembic"))
+    with db.engine.begin() as connection:
+        config.attributes["connection"] = connection
+        if downgrade:
+            command.downgrade(config, revision)
+        else:
+            command.upgrade(config, revision)
+
+
+@pytest.fixture
+def empty_db(tmp_path: Path) -> Generator[DBConnection, None, None]:
+    db_connection = f"sqlite:///{tmp_path / 'migrated.db'}" if TEST_DB_CONNECTION == "sqlite://" else TEST_DB_CONNECTION
+    db = DBConnection(db_connection)
+    Base.metadata.drop_all(db.engine)
+    with db.engine.begin() as connection:
+        for table in LEGACY_TABLES + ("alembic_version",):
+            connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+    yield db
+    db.engine.dispose()
+
+
+@pytest.fixture
+def migrated_db(empty_db: DBConnection) -> DBConnection:
+    """ A database created by running every migration, rather than from the models """
+    migrate(empty_db, "head")
+    return empty_db
+
+
+@pytest.fixture
+def legacy_db(empty_db: DBConnection) -> DBConnection:
+    """ A database from before the player table, with players only stored by name """
+    migrate(empty_db, BEFORE_PLAYERS)
+    with empty_db.engine.begin() as connection:
+        for row in LEGACY_ROWS:
+            connection.execute(text(row))
+    return empty_db
+
+
+class TestMigrations:
+    @pytest.mark.parametrize("table,column", (
+        ("match", "channel"),
+        ("status_message", "channel"),
+        ("subscription", "channel"),
+        ("subscription", "discord_id"),
+    ))
+    def test_discord_ids_bigint(self, migrated_db: DBConnection, table: str, column: str) -> None:
+        columns = {c["name"]: c["type"] for c in inspect(migrated_db.engine).get_columns(table)}
+        assert isinstance(columns[column], BigInteger)
+
+    def test_all_tables(self, migrated_db: DBConnection) -> None:
+        assert set(Base.metadata.tables) <= set(inspect(migrated_db.engine).get_table_names())
+
+    def test_snowflakes(self, migrated_db: DBConnection) -> None:
+        migrated_db.add_match(SNOWFLAKE, "match-id")
+        migrated_db.add_message("match-id", SNOWFLAKE, None, MessageType.GAME_FORFEIT)
+        migrated_db.add_subscriptions(SNOWFLAKE, SNOWFLAKE + 1, "player1")
+        assert migrated_db.get_matches()[0].channel == SNOWFLAKE
+        assert migrated_db.get_messages(SNOWFLAKE)[0].message_type == MessageType.GAME_FORFEIT
+        assert migrated_db.get_subscriptions(SNOWFLAKE)[0].discord_id == SNOWFLAKE + 1
+
+    def test_players_from_names(self, legacy_db: DBConnection) -> None:
+        migrate(legacy_db, "head")
+        with legacy_db.Session() as session:
+            assert sorted(session.execute(select(Player.name)).scalars()) == ["player1", "player2"]
+        assert [message.player_turn for message in legacy_db.get_messages(1)] == ["player1", None]
+        assert legacy_db.get_subscriptions(1)[0].wingspan_name == "player2"
+        assert [score.player.name for score in legacy_db.get_scores("match-id")] == ["player1"]
+        assert legacy_db.get_leaderboard("wins") == [("player1", 1)]
+
+    def test_players_downgrade(self, legacy_db: DBConnection) -> None:
+        migrate(legacy_db, "head")
+        migrate(legacy_db, BEFORE_PLAYERS, downgrade=True)
+
+        assert "player" not in inspect(legacy_db.engine).get_table_names()
+        with legacy_db.engine.connect() as connection:
+            assert connection.execute(text("SELECT player_turn FROM status_message ORDER BY datetime")).all() == [
+                ("player1",), (None,)]
+            assert connection.execute(text("SELECT wingspan_name FROM subscription")).scalar_one() == "player2"
+            assert connection.execute(text("SELECT player_name, score FROM score")).all() == [("player1", 90)]
@@ -0,0 +1,47 @@
+from sqlalchemy import select
+
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.data.models import Player
+from wingspan_bot.data.players import get_player
+
+
+def all_players(db: DBConnection) -> list[tuple[str | None, str]]:
+    with db.Session() as session:
+        return [(player.chilli_connect_id, player.name)
+                for player in session.execute(select(Player).order_by(Player.id)).scalars()]
+
+
+class TestGetPlayer:
+    def test_added_once(self, db: DBConnection) -> None:
+        with db.Session.begin() as session:
+            first = get_player(session, "miguel", "miguel_id")
+            assert get_player(session, "miguel", "miguel_id") is first
+        assert all_players(db) == [("miguel_id", "miguel")]
+
+    def test_renamed(self, db: DBConnection) -> None:
+        with db.Session.begin() as session:
+            player_id = get_player(session, "miguel", "miguel_id").id
+            assert get_player(session, "miguel2", "miguel_id").id == player_id
+        assert all_players(db) == [("miguel_id", "miguel2")]
+
+    def test_takes_over_unidentified(self, db: DBConnection) -> None:
+        with db.Session.begin() as session:
+            player_id = get_player(session, "miguel").id
+            assert get_player(session, "miguel", "miguel_id").id == player_id
+        assert all_players(db) == [("miguel_id", "miguel")]
+
+    def test_by_name_prefers_identified(self, db: DBConnection) -> None:
+        with db.Session.begin() as session:
+            get_player(session, "miguel", "old_id")
+            get_player(session, "miguel2", "old_id")
+            player_id = get_player(session, "miguel", "new_id").id
+            get_player(session, "dan")
+            assert get_player(session, "miguel").id == player_id
+
+    def test_rename_takes_subscriptions(self, db: DBConnection) -> None:
+        db.add_subscriptions(1, 100, "miguel2")
+        with db.Session.begin() as session:
+            get_player(session, "miguel", "miguel_id")
+            get_player(session, "miguel2", "miguel_id")
+        subscriptions = db.get_subscriptions(1)
+        assert [subscription.player.chilli_connect_id for subscription in subscriptions] == ["miguel_id"]
@@ -0,0 +1,60 @@
+import dataclasses
+
+import pytest
+
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.data.models import MessageType
+from wingspan_api.wapi import Match, OutcomeData
+
+
+class TestRollups:
+    @pytest.fixture
+    def db_monitoring(self, db: DBConnection, game_completed_obj: Match) -> DBConnection:
+        db.add_match(1, game_completed_obj.MatchID)
+        db.add_match(2, game_completed_obj.MatchID)
+        db.add_match(3, "other-match")
+        return db
+
+    def test_completed_match(self, db_monitoring: DBConnection, game_completed_obj: Match) -> None:
+        db_monitoring.add_or_update_score(game_completed_obj)
+        # the winner in the test data isn't one of the players, so it falls back to the top scorer
+        assert db_monitoring.get_leaderboard("wins") == [("jeff", 1), ("dan", 0), ("miguel", 0)]
+        assert db_monitoring.get_leaderboard("score", channel=1) == [("jeff", 96), ("miguel", 94), ("dan", 85)]
+        assert db_monitoring.get_leaderboard("eggs", channel=2, limit=1) == [("miguel", 29)]
+        assert db_monitoring.get_leaderboard("games", channel=3) == []
+
+    def test_counted_once(self, db_monitoring: DBConnection, game_completed_obj: Match) -> None:
+        db_monitoring.add_or_update_score(game_completed_obj)
+        db_monitoring.add_or_update_score(game_completed_obj)
+        assert db_monitoring.get_leaderboard("games") == [("dan", 1), ("jeff", 1), ("miguel", 1)]
+
+    def test_in_progress_ignored(self, db_monitoring: DBConnection, game_in_progress_obj: Match) -> None:
+        db_monitoring.add_or_update_score(game_in_progress_obj)
+        assert db_monitoring.get_leaderboard("games") == []
+
+    def test_winner(self, db_monitoring: DBConnection, game_completed_obj: Match) -> None:
+        match = dataclasses.replace(game_completed_obj, OutcomeData=OutcomeData(Winner="dan_id"))
+        db_monitoring.add_or_update_score(match)
+        assert db_monitoring.get_leaderboard("wins", limit=1) == [("dan", 1)]
+
+    def test_rates_need_min_games(self, db_monitoring: DBConnection, game_completed_obj: Match) -> None:
+        for i in range(3):
+            db_monitoring.add_match(1, f"match{i}")
+            db_monitoring.add_or_update_score(dataclasses.replace(game_completed_obj, MatchID=f"match{i}"))
+        assert db_monitoring.get_leaderboard("winrate", channel=1) == [("jeff", 100), ("dan", 0), ("miguel", 0)]
+        assert db_monitoring.get_leaderboard("winrate", channel=2) == []
+        assert db_monitoring.get_leaderboard("average", limit=1) == [("jeff", 96)]
+
+    def test_unknown_category(self, db: DBConnection) -> None:
+        with pytest.raises(ValueError):
+            db.get_leaderboard("luck")
+
+    def test_rebuild(self, db_monitoring: DBConnection, game_completed_obj: Match, game_in_progress_obj: Match) -> None:
+        db_monitoring.add_or_update_score(game_completed_obj)
+        db_monitoring.add_or_update_score(game_in_progress_obj)
+        db_monitoring.add_message(game_completed_obj, 1, None, MessageType.GAME_COMPLETE)
+        expected = db_monitoring.get_leaderboard("wins", channel=2)
+
+        assert db_monitoring.rebuild_rollups() == 1
+        assert db_monitoring.get_leaderboard("wins", channel=2) == expected
+        assert db_monitoring.get_leaderboard("games") == [("dan", 1), ("jeff", 1), ("miguel", 1)]
@@ -0,0 +1,94 @@
+import threading
+from functools import partial
+from collections.abc import Generator
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.data.models import Base, MessageType, Player, Subscription
+
+
+@pytest.fixture
+def tuned_db(tmp_path: Path) -> Generator[DBConnection, None, None]:
+    db = DBConnection(f"sqlite:///{tmp_path / 'tuned.db'}", sqlite_tuning=True)
+    Base.metadata.create_all(db.engine)
+    yield db
+    db.close()
+
+
+class TestSQLiteTuning:
+    def test_pragmas(self, tuned_db: DBConnection) -> None:
+        with tuned_db.engine.connect() as connection:
+            assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert connection.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+            assert connection.execute(text("PRAGMA cache_size")).scalar() == -64 * 1024
+
+    def test_in_memory_not_tuned(self) -> None:
+        db = DBConnection("sqlite://", sqlite_tuning=True)
+        assert db.writer is None
+
+    def test_other_database_not_tuned(self, tmp_path: Path) -> None:
+        db = DBConnection(f"sqlite:///{tmp_path / 'untuned.db'}")
+        assert db.writer is None
+
+    def test_writes(self, tuned_db: DBConnection) -> None:
+        tuned_db.add_match(1, "match-id")
+        tuned_db.add_message("match-id", 1, "player1", MessageType.NEW_TURN)
+        tuned_db.remove_match(1, "match-id")
+        assert tuned_db.get_matches(currently_monitored=False)[0].removed is not None
+        previous_message = tuned_db.get_previous_message(1, "match-id")
+        assert previous_message is not None
+        assert previous_message.player_turn == "player1"
+
+    def test_concurrent_writes_batched(self, tuned_db: DBConnection) -> None:
+        assert tuned_db.writer is not None
+        release = threading.Event()
+        # hold up the writer so the following writes queue up behind it
+        blocked = tuned_db.writer.submit(lambda session: release.wait())
+        futures = [tuned_db.writer.submit(partial(Session.add, instance=Subscription(
+            channel=1, discord_id=i, player=Player(name=f"player{i}")))) for i in range(20)]
+        batches = tuned_db.writer.batches
+        release.set()
+        blocked.result()
+        for future in futures:
+            future.result()
+        assert len(tuned_db.get_subscriptions(1)) == 20
+        assert tuned_db.writer.batches - batches <= 2
+
+    def test_failed_write_isolated(self, tuned_db: DBConnection) -> None:
+        assert tuned_db.writer is not None
+        release = threading.Event()
+        blocked = tuned_db.writer.submit(lambda session: release.wait())
+
+        def fail(session: Session) -> None:
+            session.add(Subscription(channel=1, discord_id=1, player=Player(name="failed")))
+            raise RuntimeError("write failed")
+
+        failed = tuned_db.writer.submit(fail)
+        succeeded = tuned_db.writer.submit(
+            lambda session: session.add(Subscription(channel=1, discord_id=2, player=Player(name="succeeded"))))
+        release.set()
+        blocked.result()
+        succeeded.result()
+        with pytest.raises(RuntimeError):
+            failed.result()
+        assert [subscription.wingspan_name for subscription in tuned_db.get_subscriptions(1)] == ["succeeded"]
+
+    def test_failed_begin_raised(self, tuned_db: DBConnection) -> None:
+        assert tuned_db.writer is not None
+        tuned_db.writer.session_factory = MagicMock()
+        tuned_db.writer.session_factory.begin.side_effect = RuntimeError("begin failed")
+        future = tuned_db.writer.submit(lambda session: None)
+        with pytest.raises(RuntimeError, match="begin failed"):
+            future.result(timeout=5)
+
+    def test_write_error_raised(self, tuned_db: DBConnection) -> None:
+        tuned_db.engine.dispose()
+        with tuned_db.engine.begin() as connection:
+            connection.execute(text("DROP TABLE subscription"))
+        with pytest.raises(Exception):
+            tuned_db.add_subscriptions(1, 1, "player1")
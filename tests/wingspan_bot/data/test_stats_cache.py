@@ -0,0 +1,76 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from wingspan_bot.data.data_objects import PlayerStat, PlayerTurnTimings, ScoreStats, Stats
+from wingspan_bot.data.stats_cache import StatsCache
+
+
+def make_stats(matches_monitored: int = 1) -> Stats:
+    no_stat = PlayerStat(wingspan_names=[], score=0)
+    return Stats(
+        matches_monitored=matches_monitored,
+        data_start=None,
+        fastest_player=None,
+        highest_scores=ScoreStats(*[no_stat] * 7),
+        player_turn_timings=PlayerTurnTimings())
+
+
+class TestStatsCache:
+    @pytest.fixture
+    def compute(self) -> MagicMock:
+        return MagicMock(side_effect=lambda: (make_stats(), ["match1", "match2"]))
+
+    def test_hit(self, compute: MagicMock) -> None:
+        cache = StatsCache()
+        stats = cache.get(1, None, compute)
+        assert cache.get(1, None, compute) is stats
+        assert compute.call_count == 1
+
+    def test_keys(self, compute: MagicMock) -> None:
+        cache = StatsCache()
+        cache.get(1, None, compute)
+        cache.get(1, "match1", compute)
+        cache.get(2, None, compute)
+        assert compute.call_count == 3
+
+    def test_invalidate_channel(self, compute: MagicMock) -> None:
+        cache = StatsCache()
+        cache.get(1, None, compute)
+        cache.get(1, "match1", compute)
+        cache.get(2, None, compute)
+        cache.invalidate_channel(1)
+        cache.get(1, None, compute)
+        cache.get(1, "match1", compute)
+        cache.get(2, None, compute)
+        assert compute.call_count == 5
+
+    def test_invalidate_match(self) -> None:
+        cache = StatsCache()
+        cache.get(1, None, lambda: (make_stats(), ["match1"]))
+        cache.get(2, None, lambda: (make_stats(), ["match2"]))
+        cache.invalidate_match("match2")
+        compute = MagicMock(side_effect=lambda: (make_stats(), ["match2"]))
+        cache.get(1, None, compute)
+        cache.get(2, None, compute)
+        assert compute.call_count == 1
+
+    def test_invalidated_while_computing(self) -> None:
+        cache = StatsCache()
+
+        def compute() -> tuple[Stats, list[str]]:
+            cache.invalidate_match("match1")
+            return make_stats(), ["match1"]
+
+        first = cache.get(1, None, compute)
+        assert cache.get(1, None, lambda: (make_stats(), ["match1"])) is not first
+
+    def test_max_entries(self, compute: MagicMock) -> None:
+        cache = StatsCache(max_entries=2)
+        cache.get(1, None, compute)
+        cache.get(2, None, compute)
+        cache.get(1, None, compute)
+        cache.get(3, None, compute)  # evicts channel 2, the least recently used
+        cache.get(1, None, compute)
+        cache.get(2, None, compute)
+        assert compute.call_count == 4
@@ -1,12 +1,19 @@
+import asyncio
+import json
 from collections.abc import Generator
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
 from unittest import mock
 
 import pytest
+import requests
 from freezegun import freeze_time
 
-from wingspan_bot.bot import Bot, BotCommands
+from wingspan_bot.bot import Bot, BotCommands, _format_age
 from wingspan_bot.data.data_controller import DataController
+from wingspan_bot.deadlines import DEADLINE_RETRY
 from wingspan_bot.data.models import MessageType
+from wingspan_api.wapi import CachedPayload, GamePayload, Match
 
 
 class TestBot:
@@ -32,6 +39,74 @@ class TestBot:
             logger.info = mock.MagicMock()
             await self.channel_not_found_helper(bot, logger.info)
 
+    async def test_notify_match(self, bot: Bot, get_channel: mock.MagicMock) -> None:
+        await bot.notify_match(1, "game1")
+        get_channel().send.assert_called_once_with("Exception while checking game1 - check the logs")
+
+        # nothing new to say about the match
+        bot.dc.add_message("game1", 1, None, MessageType.ERROR)
+        await bot.notify_match(1, "game1")
+        get_channel().send.assert_called_once()
+
+    async def test_notify_match_schedules_deadline(
+            self, bot: Bot, get_channel: mock.MagicMock, game_in_progress_obj: Match) -> None:
+        await bot.notify_match(1, game_in_progress_obj)
+        deadline = bot.deadlines.next_deadline()
+        # 42 hours remaining, so the reminder is due in 18
+        assert deadline is not None
+        assert abs(deadline - datetime.now(timezone.utc) - timedelta(hours=18)) < timedelta(minutes=1)
+
+    async def test_notify_match_deadline_unchanged_payload(
+            self, bot: Bot, get_channel: mock.MagicMock, game_in_progress_obj: Match) -> None:
+        now = datetime.now(timezone.utc)
+        # polled again just now, but unchanged since 6 hours ago, so its 42 hours remaining were as of then
+        bot.dc.wapi._payloads[game_in_progress_obj.MatchID] = CachedPayload(
+            digest="digest", match=game_in_progress_obj, received=now, first_received=now - timedelta(hours=6))
+        await bot.notify_match(1, game_in_progress_obj)
+        deadline = bot.deadlines.next_deadline()
+        assert deadline is not None
+        assert abs(deadline - now - timedelta(hours=12)) < timedelta(minutes=1)
+
+    async def test_check_deadlines(self, bot: Bot, get_channel: mock.MagicMock) -> None:
+        bot.pipeline.run = mock.AsyncMock()  # type: ignore[method-assign]
+        bot.deadlines.schedule((1, "game1"), datetime.now(timezone.utc))
+        bot.deadlines.schedule((1, "game2"), datetime.now(timezone.utc))
+        bot.deadlines.schedule((2, "game4"), datetime.now(timezone.utc) + timedelta(hours=1))
+        await bot.check_deadlines.coro(bot)
+        bot.pipeline.run.assert_called_once_with(1, changed_only=False, match_ids=["game1", "game2"])
+
+    async def test_check_deadlines_retry(
+            self, bot: Bot, get_channel: mock.MagicMock, game_in_progress_obj: Match) -> None:
+        now = datetime.now(timezone.utc)
+        bot.deadlines.schedule((1, "game1"), now)
+        bot.deadlines.schedule((1, "game2"), now)
+
+        def fetch_game_payload(match_id: str) -> GamePayload:
+            if match_id == "game1":
+                raise requests.ConnectionError("test error")
+            return GamePayload(match_id, "digest", b"{}")
+
+        bot.dc.wapi.fetch_game_payload = fetch_game_payload  # type: ignore[method-assign]
+        bot.dc.wapi.decode_game_payload = (  # type: ignore[method-assign]
+            lambda payload: replace(game_in_progress_obj, MatchID=payload.match_id))
+        await bot.check_deadlines.coro(bot)
+
+        deadlines = bot.deadlines.deadlines()
+        # game1 couldn't be fetched, so it's checked again shortly
+        assert timedelta(0) < deadlines[(1, "game1")] - now <= DEADLINE_RETRY + timedelta(seconds=5)
+        assert deadlines[(1, "game2")] - now > timedelta(hours=17)
+
+    async def test_compact_history_opt_in(self, bot: Bot, dc_monitor_many: DataController) -> None:
+        assert not bot.compact_history.is_running()
+        compacting = Bot(admin_channel=0, data_controller=dc_monitor_many, message_retention=timedelta(days=90))
+        assert compacting.compact_history.is_running()
+        compacting.compact_history.cancel()
+
+    async def test_compact_history_waits_until_ready(self, bot: Bot) -> None:
+        with mock.patch.object(Bot, "wait_until_ready") as wait_until_ready:
+            await bot.compact_history._before_loop(bot)
+        wait_until_ready.assert_awaited_once()
+
     @staticmethod
     async def channel_not_found_helper(bot: Bot, log_func: mock.AsyncMock) -> None:
         channel_id = 2
@@ -84,6 +159,44 @@ class TestBotCommands:
             "```"
         )
 
+    async def test_leaderboard(self, bot_commands: BotCommands, game_completed_obj: Match) -> None:
+        bot_commands.dc.add(1, game_completed_obj.MatchID)
+        bot_commands.dc.db.add_or_update_score(game_completed_obj)
+        context = mock.AsyncMock()
+        context.channel.id = 1
+        await bot_commands.leaderboard.callback(bot_commands, context, "score")
+        context.reply.assert_called_with(
+            "```"
+            "Highest score:\n"
+            " 1.    96 - jeff\n"
+            " 2.    94 - miguel\n"
+            " 3.    85 - dan\n"
+            "```")
+
+        context.channel.id = 2
+        await bot_commands.leaderboard.callback(bot_commands, context, "wins")
+        context.reply.assert_called_with("```Most wins:\nNo completed games yet\n```")
+        await bot_commands.leaderboard.callback(bot_commands, context, "wins", "global")
+        context.reply.assert_called_with("```Most wins:\n 1.     1 - jeff\n 2.     0 - dan\n 3.     0 - miguel\n```")
+
+    async def test_leaderboard_unknown(self, bot_commands: BotCommands) -> None:
+        context = mock.AsyncMock()
+        await bot_commands.leaderboard.callback(bot_commands, context, "luck")
+        assert context.reply.call_args.args[0].startswith("Unknown leaderboard luck")
+
+    async def test_profile(self, bot_commands: BotCommands) -> None:
+        bot_commands.bot.admin_channel = 10
+        bot_commands.bot.next_tick_profiler = None
+        context = mock.AsyncMock()
+        context.channel.id = 1
+        await bot_commands.profile.callback(bot_commands, context)
+        assert bot_commands.bot.next_tick_profiler is None
+
+        context.channel.id = 10
+        await bot_commands.profile.callback(bot_commands, context)
+        assert bot_commands.bot.next_tick_profiler is not None
+        context.reply.assert_called_with("Profiling the next turn check with cprofile")
+
     async def test_stats_stop_watching(self, bot_commands: BotCommands) -> None:
         context = mock.AsyncMock()
         context.channel.id = 1
@@ -103,3 +216,133 @@ class TestBotCommands:
             "Most points from cached food:      None\n"
             "Most points from tucked cards:     None\n"
             "```")
+
+
+class TestTurn:
+    MATCH_ID = "in-progress-match-id"
+
+    @pytest.fixture
+    def post(self, monkeypatch: pytest.MonkeyPatch, game_in_progress: str) -> mock.MagicMock:
+        post = mock.MagicMock(side_effect=lambda *args, **kwargs: self.response(game_in_progress))
+        monkeypatch.setattr(requests, "post", post)
+        return post
+
+    @staticmethod
+    def response(content: str) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response._content = content.encode()
+        return response
+
+    @pytest.fixture
+    def bot_commands(self, data_controller: DataController, post: mock.MagicMock) -> BotCommands:
+        data_controller.add(1, self.MATCH_ID)
+        return BotCommands(bot=Bot(admin_channel=0, data_controller=data_controller), data_controller=data_controller)
+
+    @pytest.fixture
+    def context(self) -> mock.AsyncMock:
+        context = mock.AsyncMock()
+        context.channel.id = 1
+        context.reply.return_value = mock.AsyncMock()  # the sent message
+        return context
+
+    def fetch(self, bot_commands: BotCommands, age: timedelta) -> None:
+        """ Caches the match as if it was polled `age` ago """
+        wapi = bot_commands.dc.wapi
+        wapi.decode_game_payload(wapi.fetch_game_payload(self.MATCH_ID))
+        cached = wapi.cached_game_info(self.MATCH_ID)
+        assert cached is not None
+        wapi._payloads[self.MATCH_ID] = replace(cached, received=datetime.now(timezone.utc) - age)
+
+    @staticmethod
+    async def turn(bot_commands: BotCommands, context: mock.AsyncMock) -> None:
+        await bot_commands.turn.callback(bot_commands, context)
+        await asyncio.gather(*bot_commands.revalidations)
+
+    async def test_stale_then_edited(
+            self, bot_commands: BotCommands, context: mock.AsyncMock, post: mock.MagicMock, game_in_progress: str
+    ) -> None:
+        self.fetch(bot_commands, timedelta(minutes=10))
+        payload = json.loads(game_in_progress)
+        payload["Match"]["TurnTimeout"]["SecondsRemaining"] = 144000
+        post.side_effect = lambda *args, **kwargs: self.response(json.dumps(payload))
+
+        await self.turn(bot_commands, context)
+        context.reply.assert_called_once_with(
+            f"It's victor's turn with 42.00 hours remaining in match {self.MATCH_ID} (as of 10 minutes ago)")
+        context.reply.return_value.edit.assert_called_once_with(
+            content=f"It's victor's turn with 40.00 hours remaining in match {self.MATCH_ID}")
+
+    async def test_stale_unchanged(self, bot_commands: BotCommands, context: mock.AsyncMock) -> None:
+        self.fetch(bot_commands, timedelta(hours=2))
+        bot_commands.dc.add_message(self.MATCH_ID, 1, "victor", MessageType.NEW_TURN)
+
+        await self.turn(bot_commands, context)
+        context.reply.assert_called_once_with(
+            f"It's victor's turn with 42.00 hours remaining in match {self.MATCH_ID} (as of 2 hours ago)")
+        context.reply.return_value.edit.assert_not_called()
+
+    async def test_stale_not_yet_announced(self, bot_commands: BotCommands, context: mock.AsyncMock) -> None:
+        # the channel hasn't been told whose turn it is, so the reply is confirmed once it's up to date
+        self.fetch(bot_commands, timedelta(minutes=1))
+        await self.turn(bot_commands, context)
+        context.reply.return_value.edit.assert_called_once_with(
+            content=f"It's victor's turn with 42.00 hours remaining in match {self.MATCH_ID}")
+        cached = bot_commands.dc.wapi.cached_game_info(self.MATCH_ID)
+        assert cached is not None and not bot_commands.dc.should_send_message(1, cached.match)
+
+    async def test_not_fetched(self, bot_commands: BotCommands, context: mock.AsyncMock) -> None:
+        await self.turn(bot_commands, context)
+        context.reply.assert_called_once_with(
+            f"It's victor's turn with 42.00 hours remaining in match {self.MATCH_ID}")
+
+    async def test_not_fetched_error(
+            self, bot_commands: BotCommands, context: mock.AsyncMock, post: mock.MagicMock) -> None:
+        post.side_effect = requests.ConnectionError("test error")
+        await self.turn(bot_commands, context)
+        context.reply.assert_called_once_with(f"Exception while checking {self.MATCH_ID} - check the logs")
+        assert bot_commands.dc.db.get_messages(1) == []
+
+    async def test_waits_for_tick(
+            self, bot_commands: BotCommands, context: mock.AsyncMock, post: mock.MagicMock) -> None:
+        async with bot_commands.bot.check_lock:
+            await bot_commands.turn.callback(bot_commands, context)
+            await asyncio.sleep(0.01)
+            post.assert_not_called()
+            # a second !turn while the first is still refreshing is answered from the first's fetch
+            await bot_commands.turn.callback(bot_commands, context)
+        await asyncio.gather(*bot_commands.revalidations)
+        assert post.call_count == 1
+        assert context.reply.call_args_list == 2 * [
+            mock.call(f"It's victor's turn with 42.00 hours remaining in match {self.MATCH_ID}")]
+
+    async def test_stale_edited_after_earlier_refresh(
+            self, bot_commands: BotCommands, context: mock.AsyncMock, post: mock.MagicMock, game_in_progress: str
+    ) -> None:
+        self.fetch(bot_commands, timedelta(minutes=10))
+        payload = json.loads(game_in_progress)
+        payload["Match"]["TurnTimeout"]["SecondsRemaining"] = 144000
+        post.side_effect = lambda *args, **kwargs: self.response(json.dumps(payload))
+
+        async with bot_commands.bot.check_lock:
+            await bot_commands.turn.callback(bot_commands, context)
+            await bot_commands.turn.callback(bot_commands, context)
+        await asyncio.gather(*bot_commands.revalidations)
+        assert post.call_count == 2  # the earlier poll, and one refresh for both
+        assert context.reply.return_value.edit.call_args_list == 2 * [
+            mock.call(content=f"It's victor's turn with 40.00 hours remaining in match {self.MATCH_ID}")]
+
+    async def test_no_matches(self, bot_commands: BotCommands, context: mock.AsyncMock) -> None:
+        context.channel.id = 2
+        await self.turn(bot_commands, context)
+        context.reply.assert_called_once_with("No matches found for this channel")
+
+    @pytest.mark.parametrize("age,expected", (
+        (timedelta(seconds=30), "just now"),
+        (timedelta(minutes=1), "1 minute ago"),
+        (timedelta(minutes=59), "59 minutes ago"),
+        (timedelta(hours=1, minutes=30), "1 hour ago"),
+        (timedelta(hours=5), "5 hours ago"),
+    ))
+    def test_format_age(self, age: timedelta, expected: str) -> None:
+        assert _format_age(age) == expected
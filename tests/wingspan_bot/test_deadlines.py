@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from freezegun import freeze_time
+
+from wingspan_bot.deadlines import DEADLINE_SLACK, DeadlineScheduler, next_match_deadline
+from wingspan_api.wapi import Match
+
+NOW = datetime(2022, 4, 22, 12, tzinfo=timezone.utc)
+
+
+class TestDeadlineScheduler:
+    def test_pop_due(self) -> None:
+        scheduler: DeadlineScheduler[str] = DeadlineScheduler()
+        scheduler.schedule("b", NOW + timedelta(minutes=2))
+        scheduler.schedule("a", NOW + timedelta(minutes=1))
+        scheduler.schedule("c", NOW + timedelta(minutes=3))
+        assert scheduler.next_deadline() == NOW + timedelta(minutes=1)
+        assert scheduler.pop_due(NOW) == []
+        assert scheduler.pop_due(NOW + timedelta(minutes=2)) == ["a", "b"]
+        assert len(scheduler) == 1
+
+    def test_reschedule(self) -> None:
+        scheduler: DeadlineScheduler[str] = DeadlineScheduler()
+        scheduler.schedule("a", NOW + timedelta(minutes=1))
+        scheduler.schedule("b", NOW + timedelta(minutes=2))
+        scheduler.schedule("a", NOW + timedelta(minutes=3))
+        assert scheduler.next_deadline() == NOW + timedelta(minutes=2)
+        assert scheduler.pop_due(NOW + timedelta(minutes=5)) == ["b", "a"]
+        assert scheduler.next_deadline() is None
+
+    def test_cancel(self) -> None:
+        scheduler: DeadlineScheduler[str] = DeadlineScheduler()
+        scheduler.schedule("a", NOW)
+        scheduler.cancel("a")
+        scheduler.cancel("missing")
+        assert scheduler.pop_due(NOW) == []
+        assert len(scheduler) == 0
+
+    async def test_wait(self) -> None:
+        scheduler: DeadlineScheduler[str] = DeadlineScheduler()
+        now = datetime.now(timezone.utc)
+        scheduler.schedule("later", now + timedelta(hours=1))
+        waiting = asyncio.create_task(scheduler.wait())
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+
+        # an earlier deadline wakes the waiter up, rather than it sleeping until the later one
+        scheduler.schedule("soon", now + timedelta(milliseconds=50))
+        assert await asyncio.wait_for(waiting, 1) == ["soon"]
+        assert len(scheduler) == 1
+
+
+class TestNextMatchDeadline:
+    @pytest.mark.parametrize("hours_remaining,expected", (
+        (42, NOW + timedelta(hours=18)),  # the reminder
+        (12, NOW + timedelta(hours=12)),  # past the reminder, so the timeout
+    ))
+    def test_in_progress(self, game_in_progress_obj: Match, hours_remaining: float, expected: datetime) -> None:
+        assert game_in_progress_obj.TurnTimeout is not None
+        game_in_progress_obj.TurnTimeout.SecondsRemaining = int(hours_remaining * 60 * 60)
+        with freeze_time(NOW):
+            assert next_match_deadline(game_in_progress_obj, NOW) == expected + DEADLINE_SLACK
+
+    def test_received_earlier(self, game_in_progress_obj: Match) -> None:
+        # 42 hours remaining when it was fetched a day ago leaves 18, so the reminder has passed
+        with freeze_time(NOW):
+            assert next_match_deadline(game_in_progress_obj, NOW - timedelta(days=1)) == (
+                NOW + timedelta(hours=18) + DEADLINE_SLACK)
+            assert next_match_deadline(game_in_progress_obj, NOW - timedelta(days=2)) is None
+
+    def test_waiting(self, game_waiting_obj: Match) -> None:
+        hours_remaining = game_waiting_obj.hours_remaining
+        assert hours_remaining is not None
+        with freeze_time(NOW):
+            # no reminder while waiting for players
+            assert next_match_deadline(game_waiting_obj, NOW) == NOW + timedelta(hours=hours_remaining) + DEADLINE_SLACK
+
+    def test_completed(self, game_completed_obj: Match) -> None:
+        assert next_match_deadline(game_completed_obj, NOW) is None
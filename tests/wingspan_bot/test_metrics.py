@@ -0,0 +1,74 @@
+import urllib.error
+import urllib.request
+from collections.abc import Generator
+
+import pytest
+
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.metrics import DB_QUERY_SECONDS, MetricsServer, Registry
+
+
+class TestMetrics:
+    def test_counter(self) -> None:
+        registry = Registry()
+        counter = registry.counter("test_total", "Test counter", ("type",))
+        counter.inc(type="a")
+        counter.inc(2, type="a")
+        counter.inc(type='b"')
+        assert counter.value(type="a") == 3
+        assert registry.render() == (
+            "# HELP test_total Test counter\n"
+            "# TYPE test_total counter\n"
+            'test_total{type="a"} 3\n'
+            'test_total{type="b\\""} 1\n')
+
+    def test_counter_wrong_labels(self) -> None:
+        counter = Registry().counter("test_total", "Test counter", ("type",))
+        with pytest.raises(ValueError):
+            counter.inc(other="a")
+
+    def test_histogram(self) -> None:
+        registry = Registry()
+        histogram = registry.histogram("test_seconds", "Test histogram", buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        assert histogram.count() == 3
+        assert registry.render() == (
+            "# HELP test_seconds Test histogram\n"
+            "# TYPE test_seconds histogram\n"
+            'test_seconds_bucket{le="0.1"} 1\n'
+            'test_seconds_bucket{le="1"} 2\n'
+            'test_seconds_bucket{le="+Inf"} 3\n'
+            "test_seconds_sum 5.55\n"
+            "test_seconds_count 3\n")
+
+    def test_duplicate_metric(self) -> None:
+        registry = Registry()
+        registry.counter("test_total", "Test counter")
+        with pytest.raises(ValueError):
+            registry.histogram("test_total", "Test histogram")
+
+    def test_db_connection_timed(self, db: DBConnection) -> None:
+        before = DB_QUERY_SECONDS.count(method="get_matches")
+        db.get_matches()
+        assert DB_QUERY_SECONDS.count(method="get_matches") == before + 1
+
+
+class TestMetricsServer:
+    @pytest.fixture
+    def server(self) -> Generator[MetricsServer, None, None]:
+        registry = Registry()
+        registry.counter("test_total", "Test counter").inc()
+        server = MetricsServer(registry=registry).start()
+        yield server
+        server.stop()
+
+    def test_metrics(self, server: MetricsServer) -> None:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+            assert response.status == 200
+            assert response.read().decode().endswith("test_total 1\n")
+
+    def test_not_found(self, server: MetricsServer) -> None:
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"http://127.0.0.1:{server.port}/other")
@@ -0,0 +1,127 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, call
+
+import pytest
+
+from wingspan_bot.data.data_controller import DataController
+from wingspan_bot.pipeline import DEFAULT_WORKERS, PipelineConfig, PipelineError, STAGES, TurnCheckPipeline
+from wingspan_api.wapi import GamePayload, Match
+
+
+class TestTurnCheckPipeline:
+    @pytest.fixture
+    def dc(self, dc_monitor_many: DataController, game_in_progress_obj: Match) -> DataController:
+        digests = {"game1": "digest"}
+        dc_monitor_many.wapi.fetch_game_payload = MagicMock(  # type: ignore[assignment]
+            side_effect=lambda match_id: GamePayload(match_id, digests.get(match_id, "digest"), b"{}"))
+        dc_monitor_many.wapi.decode_game_payload = MagicMock(  # type: ignore[assignment]
+            return_value=game_in_progress_obj)
+        dc_monitor_many.db.add_or_update_score = MagicMock()  # type: ignore[assignment]
+        return dc_monitor_many
+
+    async def test_run(self, dc: DataController, game_in_progress_obj: Match) -> None:
+        notify = AsyncMock()
+        stats = await TurnCheckPipeline(dc, notify).run()
+
+        assert sorted(call.args[0] for call in notify.call_args_list) == [1, 1, 1, 2, 2]
+        assert all(call.args[1] is game_in_progress_obj for call in notify.call_args_list)
+        assert [stats[stage].matches for stage in stats] == [5, 5, 5, 5, 5]
+        # game1 is in both channels, but its scores are only saved once for the same payload
+        assert dc.db.add_or_update_score.call_count == 4  # type: ignore[attr-defined]
+
+    async def test_run_channel(self, dc: DataController) -> None:
+        notify = AsyncMock()
+        await TurnCheckPipeline(dc, notify).run(channel=2)
+        assert [call.args[0] for call in notify.call_args_list] == [2, 2]
+
+    async def test_run_match_ids(self, dc: DataController) -> None:
+        notify = AsyncMock()
+        await TurnCheckPipeline(dc, notify).run(channel=1, match_ids=["game1", "game4"])
+        assert dc.wapi.fetch_game_payload.call_args_list == [call("game1")]  # type: ignore[attr-defined]
+
+    async def test_run_changed_only(self, dc: DataController) -> None:
+        notify = AsyncMock()
+        pipeline = TurnCheckPipeline(dc, notify)
+        await pipeline.run()
+        notify.reset_mock()
+
+        stats = await pipeline.run()
+        notify.assert_not_called()
+        assert stats["persist"].matches == 0
+
+        await pipeline.run(changed_only=False)
+        assert notify.call_count == 5
+
+    async def test_run_changed_payload(self, dc: DataController) -> None:
+        notify = AsyncMock()
+        pipeline = TurnCheckPipeline(dc, notify)
+        await pipeline.run()
+        notify.reset_mock()
+
+        dc.wapi.fetch_game_payload.side_effect = (  # type: ignore[attr-defined]
+            lambda match_id: GamePayload(match_id, "changed" if match_id == "game2" else "digest", b"{}"))
+        await pipeline.run()
+        assert [call.args[0] for call in notify.call_args_list] == [1]
+        assert dc.db.add_or_update_score.call_count == 5  # type: ignore[attr-defined]
+
+    async def test_run_fetch_error(self, dc: DataController) -> None:
+        dc.wapi.fetch_game_payload.side_effect = Exception("test error")  # type: ignore[attr-defined]
+        notify = AsyncMock()
+        pipeline = TurnCheckPipeline(dc, notify)
+        await pipeline.run(channel=1)
+        assert sorted(call.args for call in notify.call_args_list) == [(1, "game1"), (1, "game2"), (1, "game3")]
+
+        # failed matches are notified again, as the error message may not have been sent
+        notify.reset_mock()
+        await pipeline.run(channel=1)
+        assert notify.call_count == 3
+
+    async def test_run_notify_error(self, dc: DataController) -> None:
+        notify = AsyncMock(side_effect=self.fail_channel_2)
+        pipeline = TurnCheckPipeline(dc, notify)
+        with pytest.raises(PipelineError, match="notify"):
+            await pipeline.run()
+        assert notify.call_count == 5
+
+        # the channel that wasn't notified gets its messages next time
+        notify.reset_mock(side_effect=True)
+        await pipeline.run()
+        assert [call.args[0] for call in notify.call_args_list] == [2, 2]
+
+    @staticmethod
+    async def fail_channel_2(channel: int, match: Match | str) -> None:
+        if channel == 2:
+            raise Exception("test error")
+
+    async def test_backpressure(self, dc: DataController) -> None:
+        release = asyncio.Event()
+
+        async def notify(channel: int, match: Match | str) -> None:
+            await release.wait()
+
+        for i in range(20):
+            dc.add(3, f"game{i + 5}")
+        pipeline = TurnCheckPipeline(dc, notify, PipelineConfig(workers=dict.fromkeys(STAGES, 1), queue_size=1))
+        run = asyncio.create_task(pipeline.run())
+        await asyncio.sleep(0.1)
+        # a match in each stage and each queue, the rest held up before being fetched
+        assert dc.wapi.fetch_game_payload.call_count < 11  # type: ignore[attr-defined]
+        release.set()
+        stats = await run
+        assert stats["notify"].matches == 25
+        assert stats["persist"].blocked_seconds > 0
+
+
+class TestPipelineConfig:
+    def test_defaults(self) -> None:
+        config = PipelineConfig(workers={"fetch": 16})
+        assert config.workers == {**DEFAULT_WORKERS, "fetch": 16}
+
+    @pytest.mark.parametrize("workers,queue_size", (
+        ({"parse": 1}, 1),
+        ({"fetch": 0}, 1),
+        ({}, 0),
+    ))
+    def test_invalid(self, workers: dict[str, int], queue_size: int) -> None:
+        with pytest.raises(ValueError):
+            PipelineConfig(workers=workers, queue_size=queue_size)
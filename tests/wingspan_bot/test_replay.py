@@ -0,0 +1,118 @@
+import dataclasses
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest.mock import AsyncMock
+
+import pytest
+
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.data.models import Base, MessageType
+from wingspan_bot.replay import (
+    Replay, ReplayConfig, ReplayMessage, ReplayMismatchError, ReplayWapi, load_messages, replay_archive,
+    save_messages)
+from wingspan_api.recorder import ArchiveWriter, read_archive
+from wingspan_api.wapi import Match, Timeout
+
+START = datetime(2022, 4, 22, 12, tzinfo=timezone.utc)
+
+
+def later(match: Match, hours_remaining: float, player_id: str | None = None) -> Match:
+    """ A copy of the in progress match with less time left, and on another player's turn if one's given """
+    assert match.TurnTimeout is not None and match.StateData is not None
+    state_data = match.StateData if player_id is None else dataclasses.replace(match.StateData,
+                                                                               CurrentPlayerID=player_id)
+    return dataclasses.replace(match, StateData=state_data, TurnTimeout=Timeout(
+        SecondsRemaining=int(hours_remaining * 60 * 60), Expires=match.TurnTimeout.Expires))
+
+
+def new_db() -> DBConnection:
+    db = DBConnection("sqlite://")
+    Base.metadata.create_all(db.engine)
+    return db
+
+
+class TestReplay:
+    @pytest.fixture
+    def archive(self, tmp_path: Path, game_in_progress_obj: Match, game_completed_obj: Match) -> Path:
+        path = tmp_path / "matches.jsonl.gz"
+        with ArchiveWriter(path) as writer:
+            writer.write(game_in_progress_obj, START)
+            writer.write(game_completed_obj, START + timedelta(minutes=7))
+            writer.write(later(game_in_progress_obj, 30), START + timedelta(minutes=12))
+            writer.write(later(game_in_progress_obj, 20), START + timedelta(minutes=21))
+            writer.write(later(game_in_progress_obj, 48, player_id="steven_id"), START + timedelta(minutes=34))
+        return path
+
+    @pytest.fixture
+    def expected(self, game_completed_obj: Match) -> list[ReplayMessage]:
+        return [
+            ReplayMessage(START, 0, "in-progress-match-id", "victor", MessageType.NEW_TURN),
+            ReplayMessage(START + timedelta(minutes=10), 0, game_completed_obj.MatchID,
+                          game_completed_obj.current_player_name, MessageType.GAME_COMPLETE),
+            ReplayMessage(START + timedelta(minutes=25), 0, "in-progress-match-id", "victor", MessageType.REMINDER),
+            ReplayMessage(START + timedelta(minutes=35), 0, "in-progress-match-id", "steven", MessageType.NEW_TURN),
+        ]
+
+    def test_replay(self, archive: Path, db: DBConnection, expected: list[ReplayMessage]) -> None:
+        report = replay_archive(archive, db)
+        assert report.messages == expected
+        assert report.ticks == 8
+        # each tick only checks the matches that changed since the last
+        assert report.matches == 5
+        assert len(report.tick_seconds) == 8
+        assert db.get_previous_message(0, "in-progress-match-id") is not None
+
+    def test_channels(self, archive: Path, db: DBConnection) -> None:
+        report = replay_archive(archive, db, ReplayConfig(matches_per_channel=1))
+        assert {(message.match_id, message.channel) for message in report.messages} == {
+            ("in-progress-match-id", 0), ("completed-match-id", 1)}
+
+    def test_verify(self, archive: Path, db: DBConnection, expected: list[ReplayMessage]) -> None:
+        report = replay_archive(archive, db)
+        replay_archive(archive, new_db()).verify(report.messages)
+
+        changed = [*expected[:2], dataclasses.replace(expected[2], message_type=MessageType.NEW_TURN), expected[3]]
+        with pytest.raises(ReplayMismatchError, match="Message 2"):
+            report.verify(changed)
+        with pytest.raises(ReplayMismatchError, match="Sent 4 messages, expected 3"):
+            report.verify(expected[:3])
+
+    async def test_speed(self, archive: Path, db: DBConnection) -> None:
+        sleep = AsyncMock()
+        await Replay(read_archive(archive), db, ReplayConfig(speed=60), sleep=sleep).run()
+        # a tick every 5 recorded minutes is every 5 seconds at 60 times the speed, less the time spent ticking
+        delays = [call.args[0] for call in sleep.call_args_list]
+        assert len(delays) == 7
+        assert all(5 * i - 1 < delay <= 5 * i for i, delay in enumerate(delays, start=1))
+
+    def test_save_load_messages(self, tmp_path: Path, expected: list[ReplayMessage]) -> None:
+        path = tmp_path / "messages.jsonl"
+        save_messages(path, expected)
+        assert load_messages(path) == expected
+
+    def test_empty(self, tmp_path: Path, db: DBConnection) -> None:
+        with ArchiveWriter(tmp_path / "empty.jsonl.gz"):
+            pass
+        report = replay_archive(tmp_path / "empty.jsonl.gz", db)
+        assert (report.ticks, report.messages) == (0, [])
+
+
+class TestReplayWapi:
+    def test_advance(self, tmp_path: Path, game_in_progress_obj: Match) -> None:
+        path = tmp_path / "matches.jsonl.gz"
+        with ArchiveWriter(path) as writer:
+            writer.write(game_in_progress_obj, START)
+            writer.write(later(game_in_progress_obj, 30), START + timedelta(minutes=5))
+        wapi = ReplayWapi(read_archive(path))
+
+        with pytest.raises(LookupError):
+            wapi.get_game_info("in-progress-match-id")
+        assert wapi.advance(START) == ["in-progress-match-id"]
+        assert wapi.get_game_info("in-progress-match-id") == game_in_progress_obj
+        fingerprint = wapi.fingerprint("in-progress-match-id")
+        assert wapi.advance(START + timedelta(minutes=4)) == []
+        assert wapi.fingerprint("in-progress-match-id") == fingerprint
+        assert wapi.advance(START + timedelta(minutes=5)) == []
+        assert wapi.get_game_info("in-progress-match-id").hours_remaining == 30
+        assert wapi.fingerprint("in-progress-match-id") != fingerprint
+        assert wapi.next_time is None
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+from wingspan_bot.bot import TICK_INTERVAL, Bot
+from wingspan_bot.data.data_controller import DataController, Fingerprints
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.deadlines import DeadlineScheduler
+from wingspan_bot.snapshot import Snapshot, load_snapshot, save_snapshot
+from wingspan_api.wapi import CachedPayload, Match, Wapi
+
+RECEIVED = datetime(2022, 4, 22, 12, tzinfo=timezone.utc)
+
+
+class TestSnapshot:
+    @pytest.fixture
+    def snapshot(self, game_in_progress_obj: Match) -> Snapshot:
+        return Snapshot(
+            access_token="saved-token",
+            payloads={"game1": CachedPayload(digest="digest1", match=game_in_progress_obj, etag='"v1"',
+                                             received=RECEIVED, first_received=RECEIVED - timedelta(hours=1))},
+            fingerprints=Fingerprints(processed={(1, "game1"): "digest1"}, scores={"game1": "digest1"}),
+            deadlines={(1, "game1"): RECEIVED + timedelta(hours=18)})
+
+    def test_save_load(self, snapshot: Snapshot, tmp_path: Path) -> None:
+        path = tmp_path / "snapshot.json"
+        save_snapshot(path, snapshot)
+        assert load_snapshot(path) == snapshot
+        assert [p.name for p in tmp_path.iterdir()] == ["snapshot.json"]
+
+    def test_take_restore(self, snapshot: Snapshot, db: DBConnection) -> None:
+        data_controller = DataController(db, Wapi("new-token"))
+        deadlines: DeadlineScheduler[tuple[int, str]] = DeadlineScheduler()
+        snapshot.restore(data_controller.wapi, data_controller, deadlines)
+
+        taken = Snapshot.take(data_controller.wapi, data_controller, deadlines)
+        assert taken.access_token == "new-token"
+        assert (taken.payloads, taken.fingerprints, taken.deadlines) == (
+            snapshot.payloads, snapshot.fingerprints, snapshot.deadlines)
+        # so the first tick after a restart skips the match
+        assert not data_controller.match_changed(1, "game1", "digest1")
+
+    def test_restore_keeps_newer(self, snapshot: Snapshot, db: DBConnection, game_completed_obj: Match) -> None:
+        wapi = Wapi("token")
+        newer = CachedPayload(digest="digest2", match=game_completed_obj, received=RECEIVED + timedelta(minutes=5))
+        wapi.restore_payloads({"game1": newer})
+        data_controller = DataController(db, wapi)
+        data_controller.match_processed(1, "game1", "digest2")
+        deadlines: DeadlineScheduler[tuple[int, str]] = DeadlineScheduler()
+        deadlines.schedule((1, "game1"), RECEIVED)
+
+        snapshot.restore(wapi, data_controller, deadlines)
+        assert wapi.cached_game_info("game1") == newer
+        assert data_controller.get_fingerprints().processed == {(1, "game1"): "digest2"}
+        assert deadlines.deadlines() == {(1, "game1"): RECEIVED}
+
+    def test_load_missing(self, tmp_path: Path) -> None:
+        assert load_snapshot(tmp_path / "snapshot.json") is None
+
+    @pytest.mark.parametrize("content", ("{not json", '{"version": 0}', '{"version": 1}', '{"version": 2}'))
+    def test_load_unreadable(self, tmp_path: Path, content: str) -> None:
+        path = tmp_path / "snapshot.json"
+        path.write_text(content)
+        assert load_snapshot(path) is None
+
+
+class TestBotSnapshot:
+    @pytest.fixture
+    def snapshot_path(self, tmp_path: Path) -> Path:
+        return tmp_path / "snapshot.json"
+
+    async def test_save_and_restore(self, data_controller: DataController, snapshot_path: Path) -> None:
+        bot = Bot(admin_channel=0, data_controller=data_controller, snapshot_path=snapshot_path)
+        bot.dc.match_processed(1, "game1", "digest1")
+        bot.save_snapshot()
+
+        snapshot = load_snapshot(snapshot_path)
+        assert snapshot is not None
+        restarted = Bot(admin_channel=0, data_controller=DataController(data_controller.db, Wapi("token")))
+        restarted.restore_snapshot(snapshot)
+        assert not restarted.dc.match_changed(1, "game1", "digest1")
+        assert restarted.resume_at == snapshot.saved + TICK_INTERVAL
+
+    async def test_save_error(self, data_controller: DataController, tmp_path: Path) -> None:
+        # logged rather than raised, so a full disk doesn't stop the turn checks
+        bot = Bot(admin_channel=0, data_controller=data_controller, snapshot_path=tmp_path / "missing" / "s.json")
+        bot.save_snapshot()
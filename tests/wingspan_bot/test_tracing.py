@@ -0,0 +1,77 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from wingspan_bot.profiling import TickProfiler
+from wingspan_bot.tracing import FileSpanExporter, Span, Tracer
+
+
+class TestTracer:
+    @pytest.fixture
+    def spans(self) -> list[Span]:
+        return []
+
+    @pytest.fixture
+    def tracer(self, spans: list[Span]) -> Tracer:
+        tracer = Tracer()
+        tracer.exporters.append(spans.append)
+        return tracer
+
+    def test_disabled(self) -> None:
+        with Tracer().span("tick") as span:
+            assert span is None
+
+    def test_nested_spans(self, tracer: Tracer, spans: list[Span]) -> None:
+        with tracer.span("tick"):
+            with tracer.span("get_game_info", match_id="match1"):
+                pass
+            with tracer.span("send_message"):
+                pass
+        with tracer.span("tick"):
+            pass
+
+        assert [span.name for span in spans] == ["get_game_info", "send_message", "tick", "tick"]
+        get_game_info, send_message, tick, other_tick = spans
+        assert tick.parent_span_id is None
+        assert get_game_info.parent_span_id == send_message.parent_span_id == tick.span_id
+        assert get_game_info.trace_id == send_message.trace_id == tick.trace_id != other_tick.trace_id
+        assert get_game_info.attributes == {"match_id": "match1"}
+        assert tick.duration >= get_game_info.duration
+
+    def test_error(self, tracer: Tracer, spans: list[Span]) -> None:
+        with pytest.raises(ValueError):
+            with tracer.span("tick"):
+                raise ValueError("test error")
+        assert spans[0].error == "ValueError: test error"
+        assert spans[0].to_otlp()["status"] == {"code": 2, "message": "ValueError: test error"}
+
+    def test_file_exporter(self, tracer: Tracer, tmp_path: Path) -> None:
+        path = tmp_path / "spans.jsonl"
+        tracer.exporters = [FileSpanExporter(path)]
+        with tracer.span("tick"):
+            with tracer.span("should_send_message", channel=1, changed=True):
+                pass
+
+        child, parent = [json.loads(line) for line in path.read_text().splitlines()]
+        assert parent["name"] == "tick"
+        assert "parentSpanId" not in parent
+        assert child["parentSpanId"] == parent["spanId"]
+        assert child["attributes"] == [
+            {"key": "channel", "value": {"intValue": "1"}}, {"key": "changed", "value": {"boolValue": True}}]
+        assert int(child["endTimeUnixNano"]) >= int(child["startTimeUnixNano"])
+
+
+class TestTickProfiler:
+    def test_cprofile(self, tmp_path: Path) -> None:
+        def profiled_function() -> int:
+            return sum(range(1000))
+
+        with TickProfiler(output_dir=tmp_path) as profiler:
+            profiled_function()
+        assert "profiled_function" in profiler.summary()
+        assert profiler.save().exists()
+
+    def test_unknown_profiler(self) -> None:
+        with pytest.raises(ValueError):
+            TickProfiler("unknown")
@@ -0,0 +1,83 @@
+"""
+Fetching the game info of many matches at once, for the command line. Requests run concurrently on a bounded pool of
+threads, still going through the Wapi's rate limiter, and results are written as they arrive, one JSON object per line
+(NDJSON), so output can be piped into other tools while the rest are still being fetched.
+"""
+from __future__ import annotations
+
+import json
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, TextIO
+
+from wingspan_api.wapi import Match, Wapi
+
+DEFAULT_WORKERS = 8
+ALL_MATCHES = "all"  # stands for every match from get_games
+
+
+@dataclass(frozen=True)
+class MatchResult:
+    match_id: str
+    match: Match | None = None
+    error: Exception | None = None
+
+
+def resolve_match_ids(wapi: Wapi, match_ids: Iterable[str]) -> list[str]:
+    """ The match IDs, with ALL_MATCHES expanded to the games in progress and duplicates dropped """
+    resolved: dict[str, None] = {}
+    for match_id in match_ids:
+        if match_id == ALL_MATCHES:
+            resolved.update(dict.fromkeys(match.MatchID for match in wapi.get_games().Matches))
+        else:
+            resolved[match_id] = None
+    return list(resolved)
+
+
+def fetch_matches(wapi: Wapi, match_ids: Iterable[str], workers: int | None = None) -> Iterator[MatchResult]:
+    """
+    Fetches the matches with up to `workers` requests at a time, DEFAULT_WORKERS if None, yielding each as soon as
+    it's fetched
+    """
+    workers = workers if workers is not None else DEFAULT_WORKERS
+    if workers < 1:
+        raise ValueError(f"Need at least one worker, got {workers}")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(wapi.get_game_info, match_id): match_id for match_id in match_ids}
+        try:
+            for future in as_completed(futures):
+                try:
+                    yield MatchResult(futures[future], match=future.result())
+                except Exception as e:
+                    yield MatchResult(futures[future], error=e)
+        finally:
+            # stop early, e.g. on Ctrl+C or a closed pipe, without waiting for the rest
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def summary(match: Match) -> dict[str, Any]:
+    """ Whose turn it is in the match, and how long they have """
+    return {
+        "match_id": match.MatchID,
+        "state": match.State.value,
+        "current_player": match.current_player_name,
+        "hours_remaining": match.hours_remaining,
+    }
+
+
+def write_ndjson(results: Iterable[MatchResult], out: TextIO, to_json: Callable[[Match], str]) -> int:
+    """
+    Writes a line for each result, `to_json` of the match or its error
+    :return: how many matches couldn't be fetched
+    """
+    errors = 0
+    for result in results:
+        if result.match is not None:
+            line = to_json(result.match)
+        else:
+            errors += 1
+            line = json.dumps({"match_id": result.match_id, "error": repr(result.error)})
+        out.write(line + "\n")
+        out.flush()
+    return errors
@@ -0,0 +1,249 @@
+"""
+Recording the game info of matches over time, for offline analysis. Each distinct state of a match is appended to a
+gzip compressed JSON lines archive, as a delta against the match's previous state, so a poll where nothing changed
+costs nothing and one where it did only stores what changed.
+
+The archive is written in chunks, each a separate gzip member that starts every match it holds with its full state,
+so a chunk can be read without the ones before it. An index alongside the archive has a line per chunk with where it
+is, its time range and the matches in it, so reading a few matches or a time range only decompresses the chunks
+needed.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import logging
+import time
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+
+from wingspan_api.bulk import ALL_MATCHES, fetch_matches, resolve_match_ids
+from wingspan_api.wapi import Match, MatchState, Wapi
+
+logger = logging.getLogger(__name__)
+
+CHUNK_RECORDS = 500  # records per chunk, more compress better but more are lost if the recorder is killed
+DEFAULT_INTERVAL = timedelta(minutes=5)
+INDEX_SUFFIX = ".idx"
+
+
+@dataclass(frozen=True)
+class ArchiveRecord:
+    time: datetime
+    match_id: str
+    match: Match
+    digest: str  # of the state, the same for identical states
+
+
+@dataclass
+class ChunkInfo:
+    offset: int  # in bytes, of the chunk's gzip member in the archive
+    length: int
+    records: int
+    start: datetime
+    end: datetime
+    matches: dict[str, str] = field(default_factory=dict)  # match id: digest of its last state in the chunk
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"offset": self.offset, "length": self.length, "records": self.records, "start": self.start.isoformat(),
+                "end": self.end.isoformat(), "matches": self.matches}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> ChunkInfo:
+        return cls(offset=data["offset"], length=data["length"], records=data["records"],
+                   start=datetime.fromisoformat(data["start"]), end=datetime.fromisoformat(data["end"]),
+                   matches=data["matches"])
+
+
+def index_path(path: Path) -> Path:
+    return path.with_name(path.name + INDEX_SUFFIX)
+
+
+def state_digest(state: dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(state, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def diff_state(old: dict[str, Any], new: dict[str, Any]) -> dict[str, Any] | None:
+    """
+    The fields of `new` that differ from `old`, recursing into nested objects, or None if a field was removed and
+    the state needs storing in full. Lists and other values are replaced as a whole
+    """
+    if not old.keys() <= new.keys():
+        return None
+    delta: dict[str, Any] = {}
+    for key, value in new.items():
+        if key not in old:
+            delta[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            nested = diff_state(old[key], value)
+            if nested is None:
+                return None
+            if nested:
+                delta[key] = nested
+        elif value != old[key]:
+            delta[key] = value
+    return delta
+
+
+def apply_delta(state: dict[str, Any], delta: dict[str, Any]) -> dict[str, Any]:
+    """ A copy of the state with the delta from diff_state applied """
+    applied = dict(state)
+    for key, value in delta.items():
+        if isinstance(value, dict) and isinstance(applied.get(key), dict):
+            applied[key] = apply_delta(applied[key], value)
+        else:
+            applied[key] = value
+    return applied
+
+
+def read_index(path: Path) -> list[ChunkInfo]:
+    """ The chunks in the archive at the path, in the order they were written """
+    try:
+        with index_path(path).open("r") as f:
+            return [ChunkInfo.from_dict(json.loads(line)) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+class ArchiveWriter:
+    """
+    Appends match states to the archive at the path, creating it if needed. States are buffered and written a chunk at
+    a time, so close the writer, or use it as a context manager, to write the last one.
+    """
+    def __init__(self, path: Path, chunk_records: int = CHUNK_RECORDS):
+        if chunk_records < 1:
+            raise ValueError(f"Chunks need at least one record, got {chunk_records}")
+        self.path = path
+        self.chunk_records = chunk_records
+        chunks = read_index(path)
+        self._size = chunks[-1].offset + chunks[-1].length if chunks else 0
+        # drop anything after the last indexed chunk, from being killed between writing a chunk and indexing it
+        with path.open("ab") as f:
+            f.truncate(self._size)
+        self._digests: dict[str, str] = {}  # match id: digest of its last recorded state, to skip repeats
+        for chunk in chunks:
+            self._digests.update(chunk.matches)
+        self._lines: list[str] = []
+        self._states: dict[str, dict[str, Any]] = {}  # match id: its last state in the current chunk
+        self._chunk: ChunkInfo | None = None
+
+    def __enter__(self) -> ArchiveWriter:
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc: BaseException | None,
+                 traceback: TracebackType | None) -> None:
+        self.close()
+
+    def write(self, match: Match, received: datetime) -> bool:
+        """
+        Records the match's state at the time, unless it's the same as the last one recorded
+        :return: whether it was recorded
+        """
+        state = match.to_dict(encode_json=True)
+        digest = state_digest(state)
+        if self._digests.get(match.MatchID) == digest:
+            return False
+
+        record: dict[str, Any] = {"time": received.isoformat(), "match_id": match.MatchID, "digest": digest}
+        previous = self._states.get(match.MatchID)
+        delta = None if previous is None else diff_state(previous, state)
+        if delta is None:
+            record["state"] = state
+        else:
+            record["delta"] = delta
+        self._lines.append(json.dumps(record, separators=(",", ":")))
+        self._states[match.MatchID] = state
+        self._digests[match.MatchID] = digest
+
+        if self._chunk is None:
+            self._chunk = ChunkInfo(offset=self._size, length=0, records=0, start=received, end=received)
+        self._chunk.records += 1
+        self._chunk.start = min(self._chunk.start, received)
+        self._chunk.end = max(self._chunk.end, received)
+        self._chunk.matches[match.MatchID] = digest
+        if self._chunk.records >= self.chunk_records:
+            self.flush()
+        return True
+
+    def flush(self) -> None:
+        """ Writes the buffered states as a chunk and indexes it """
+        if self._chunk is None:
+            return
+        data = gzip.compress(("\n".join(self._lines) + "\n").encode(), mtime=0)
+        with self.path.open("ab") as f:
+            f.write(data)
+        self._chunk.length = len(data)
+        with index_path(self.path).open("a") as f:
+            f.write(json.dumps(self._chunk.to_dict()) + "\n")
+        self._size += len(data)
+        self._lines = []
+        self._states = {}
+        self._chunk = None
+
+    def close(self) -> None:
+        self.flush()
+
+
+def read_archive(path: Path, match_ids: Iterable[str] | None = None, start: datetime | None = None,
+                 end: datetime | None = None) -> Iterator[ArchiveRecord]:
+    """
+    The recorded states of the matches, all of them if None, from `start` up to and including `end`, in the order
+    they were recorded
+    """
+    wanted = None if match_ids is None else set(match_ids)
+    with path.open("rb") as f:
+        for chunk in read_index(path):
+            if ((wanted is not None and wanted.isdisjoint(chunk.matches)) or
+                    (start is not None and chunk.end < start) or (end is not None and chunk.start > end)):
+                continue
+            f.seek(chunk.offset)
+            states: dict[str, dict[str, Any]] = {}
+            for line in gzip.decompress(f.read(chunk.length)).decode().splitlines():
+                record = json.loads(line)
+                match_id = record["match_id"]
+                if wanted is not None and match_id not in wanted:
+                    continue
+                if "state" in record:
+                    states[match_id] = record["state"]
+                else:
+                    states[match_id] = apply_delta(states[match_id], record["delta"])
+                received = datetime.fromisoformat(record["time"])
+                if (start is None or received >= start) and (end is None or received <= end):
+                    yield ArchiveRecord(time=received, match_id=match_id, match=Match.from_dict(states[match_id]),
+                                        digest=record["digest"])
+
+
+def record_matches(wapi: Wapi, writer: ArchiveWriter, match_ids: Iterable[str], interval: timedelta = DEFAULT_INTERVAL,
+                   polls: int | None = None, workers: int | None = None,
+                   sleep: Callable[[float], None] = time.sleep) -> int:
+    """
+    Polls the matches every `interval`, recording each new state, until there have been `polls` polls if it isn't
+    None. Completed matches are no longer polled, and unless ALL_MATCHES is one of the IDs, recording stops once
+    they're all completed.
+    :return: how many states were recorded
+    """
+    match_ids = list(match_ids)
+    completed: set[str] = set()
+    recorded = 0
+    poll = 0
+    while polls is None or poll < polls:
+        if ALL_MATCHES not in match_ids and completed.issuperset(match_ids):
+            break
+        if poll > 0:
+            sleep(interval.total_seconds())
+        poll += 1
+        to_poll = [match_id for match_id in resolve_match_ids(wapi, match_ids) if match_id not in completed]
+        for result in fetch_matches(wapi, to_poll, workers):
+            if result.match is None:
+                logger.warning(f"Failed to get {result.match_id}, will try again next poll: {result.error!r}")
+                continue
+            if writer.write(result.match, datetime.now(timezone.utc)):
+                recorded += 1
+            if result.match.State == MatchState.COMPLETED:
+                completed.add(result.match_id)
+    return recorded
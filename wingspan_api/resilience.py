@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """ Raised instead of making a request while the circuit breaker is open """
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """ Exponential backoff with full jitter between attempts """
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 8
+
+    def delay(self, attempt: int, rng: random.Random | None = None) -> float:
+        """ Seconds to wait after the given (1-based) attempt failed """
+        cap = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return (rng or random).uniform(0, cap)
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter. Tokens are added at `rate` per second up to `burst`, and each request consumes one,
+    blocking until a token is available
+    """
+    def __init__(
+            self,
+            rate: float,
+            burst: int = 1,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep) -> None:
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Invalid rate limit of {rate}/s with burst {burst}")
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"  # requests flow normally
+    OPEN = "open"  # requests fail immediately
+    HALF_OPEN = "half_open"  # a limited number of probe requests are let through
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures, failing requests immediately with a CircuitOpenError.
+    After `reset_timeout` seconds it lets up to `half_open_max_calls` probe requests through; a successful probe
+    closes the circuit again, and a failed one re-opens it.
+    """
+    def __init__(
+            self,
+            failure_threshold: int = 5,
+            reset_timeout: float = 60,
+            half_open_max_calls: int = 1,
+            clock: Callable[[], float] = time.monotonic) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            self._update_state()
+            return self._state
+
+    def _update_state(self) -> None:
+        if self._state == CircuitState.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            logger.info("Circuit half-open, probing upstream")
+            self._state = CircuitState.HALF_OPEN
+            self._probes = 0
+
+    def before_request(self) -> None:
+        """ Raises CircuitOpenError if the request shouldn't be made """
+        with self._lock:
+            self._update_state()
+            if self._state == CircuitState.OPEN:
+                retry_in = self.reset_timeout - (self._clock() - self._opened_at)
+                raise CircuitOpenError(f"Circuit open after {self._failures} consecutive failures, "
+                                       f"retrying in {retry_in:.0f}s")
+            if self._state == CircuitState.HALF_OPEN:
+                if self._probes >= self.half_open_max_calls:
+                    raise CircuitOpenError("Circuit half-open, waiting on probe requests")
+                self._probes += 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != CircuitState.CLOSED:
+                logger.info("Circuit closed")
+            self._state = CircuitState.CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == CircuitState.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != CircuitState.OPEN:
+                    logger.warning(f"Circuit opened after {self._failures} consecutive failures")
+                self._state = CircuitState.OPEN
+                self._opened_at = self._clock()
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import threading
+from collections.abc import Callable, Hashable
+from concurrent.futures import Future
+from typing import Generic, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class SingleFlight(Generic[K, V]):
+    """
+    Coalesces concurrent calls for the same key, so that only one call is in flight at a time and every caller
+    that arrives while it's running receives its result (or exception)
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._in_flight: dict[K, Future[V]] = {}
+
+    def do(self, key: K, func: Callable[[], V]) -> V:
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if future is None:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._in_flight)
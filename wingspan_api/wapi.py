@@ -1,9 +1,13 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import logging
-from dataclasses import dataclass
-from datetime import datetime
+import threading
+import time
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
 from enum import Enum
 from typing import Any
 
@@ -11,6 +15,9 @@ import requests
 from dataclasses_json import DataClassJsonMixin
 from requests import Response
 
+from wingspan_api.resilience import CircuitBreaker, RateLimiter, RetryPolicy
+from wingspan_api.single_flight import SingleFlight
+
 logger = logging.getLogger(__name__)
 
 try:
@@ -20,6 +27,8 @@ except ImportError:
     logger.warn("Failed to import steamworks")
 
 HOST = "https://connect.chilliconnect.com"
+DEFAULT_REQUESTS_PER_SECOND = 5
+DEFAULT_TIMEOUT = (5.0, 15.0)  # (connect, read) seconds
 
 
 class MatchState(Enum):
@@ -102,6 +111,12 @@ class Match(DataClassJsonMixin):
         player = self.get_player(player_id)
         return player.UserName if player is not None else None
 
+    def get_player_id(self, username: str) -> str | None:
+        for player in self.Players:
+            if player.UserName == username:
+                return player.ChilliConnectID
+        return None
+
     @property
     def current_player(self) -> Player | None:
         if self.StateData is None:
@@ -142,8 +157,79 @@ class Matches(DataClassJsonMixin):
     Matches: list[Match]
 
 
+@dataclass(frozen=True)
+class RequestAttempt:
+    """ A single HTTP request made to ChilliConnect, including ones that were retried """
+    path: str
+    attempt: int
+    seconds: float
+    status_code: int | None = None  # None if no response was received
+    error: str | None = None
+
+
+@dataclass(frozen=True)
+class CachedPayload:
+    """ The last game info payload received for a match, and the Match decoded from it """
+    digest: str
+    match: Match
+    etag: str | None = None
+    received: datetime = field(default_factory=lambda: datetime.now(timezone.utc))  # when it was last confirmed
+    first_received: datetime | None = None  # when it was first received, None if that was `received`
+
+    @property
+    def unchanged_since(self) -> datetime:
+        """ When the payload was first received, which the time remaining in its match counts down from """
+        return self.received if self.first_received is None else self.first_received
+
+
+@dataclass(frozen=True)
+class GamePayload:
+    """ A game info payload as received, before it's decoded """
+    match_id: str
+    digest: str
+    content: bytes | None  # None if it's the payload that was last decoded
+    etag: str | None = None
+    received: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+def _log_attempt(attempt: RequestAttempt) -> None:
+    logger.debug(f"POST {attempt.path} attempt {attempt.attempt}: {attempt.status_code or attempt.error} "
+                 f"in {attempt.seconds:.3f}s")
+
+
+def _is_upstream_failure(e: BaseException) -> bool:
+    """ Whether the exception means ChilliConnect is unhealthy, rather than that the request itself was bad """
+    if isinstance(e, requests.HTTPError):
+        return e.response is None or e.response.status_code >= 500
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+
 class Wapi:
-    def __init__(self, access_token: str | None = None):
+    def __init__(
+            self,
+            access_token: str | None = None,
+            rate_limiter: RateLimiter | None = None,
+            circuit_breaker: CircuitBreaker | None = None,
+            timeout: tuple[float, float] = DEFAULT_TIMEOUT,
+            retry_policy: RetryPolicy | None = None,
+            sleep: Callable[[float], None] = time.sleep,
+            host: str = HOST):
+        self.host = host
+        self.timeout = timeout
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self._sleep = sleep
+        # called with every request attempt made, e.g. to record latency metrics
+        self.attempt_listeners: list[Callable[[RequestAttempt], None]] = [_log_attempt]
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter(
+            rate=DEFAULT_REQUESTS_PER_SECOND, burst=DEFAULT_REQUESTS_PER_SECOND)
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+        # concurrent get_game_info calls for the same match share one request
+        self._game_info_flight: SingleFlight[str, Match] = SingleFlight()
+        self._payload_flight: SingleFlight[str, GamePayload] = SingleFlight()
+        self._payloads_lock = threading.Lock()
+        self._payloads: dict[str, CachedPayload] = {}
+        # concurrent requests that find the token expired share one login
+        self._token_lock = threading.Lock()
         if access_token is not None:
             self.access_token = access_token
         else:
@@ -157,9 +243,47 @@ class Wapi:
         resp = self.get_login(session_ticket)
         self.access_token = resp["ConnectAccessToken"]
 
+    def _refresh_access_token(self, expired_token: str) -> None:
+        """ Generates a new access token, unless another request already replaced the expired one """
+        with self._token_lock:
+            if self.access_token == expired_token:
+                logger.info("Access token expired, generating a new one")
+                self.generate_access_token()
+
+    def _post(self, url: str, data: dict[str, Any], headers: dict[str, str]) -> Response:
+        """
+        Posts the request, retrying connection errors, timeouts and 5xx responses with exponential backoff.
+        The last response is returned, or the last exception raised, once the attempts are used up.
+        """
+        path = url.removeprefix(f"{self.host}/")
+        attempt = 1
+        while True:
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                r = requests.post(url=url, data=data, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._notify_attempt(RequestAttempt(
+                    path=path, attempt=attempt, seconds=time.perf_counter() - start, error=type(e).__name__))
+                if attempt >= self.retry_policy.max_attempts:
+                    raise
+            else:
+                self._notify_attempt(RequestAttempt(
+                    path=path, attempt=attempt, seconds=time.perf_counter() - start, status_code=r.status_code))
+                if r.status_code < 500 or attempt >= self.retry_policy.max_attempts:
+                    return r
+            delay = self.retry_policy.delay(attempt)
+            logger.info(f"Retrying POST {path} in {delay:.2f}s after attempt {attempt} failed")
+            self._sleep(delay)
+            attempt += 1
+
+    def _notify_attempt(self, attempt: RequestAttempt) -> None:
+        for listener in self.attempt_listeners:
+            listener(attempt)
+
     def get_login(self, session_ticket: str) -> Any:
-        r = requests.post(
-            url=f"{HOST}/1.0/player/login/steam",
+        r = self._post(
+            url=f"{self.host}/1.0/player/login/steam",
             data={
                 "SessionTicket": session_ticket,
                 "CreatePlayer": True,
@@ -171,22 +295,31 @@ class Wapi:
         )
         return r.json()
 
-    def _get_info(self, path: str, data: dict[str, str]) -> Response:
-        r = requests.post(
-            url=f"{HOST}/{path}",
-            data=data,
-            headers={"Connect-Access-Token": self.access_token},
-        )
-        if r.status_code != 200 and r.json()["Code"] == 1003:
-            # expired connect access token
-            logging.info("Access token expired, generating a new one")
-            self.generate_access_token()
-            r = requests.post(
-                url=f"{HOST}/{path}",
+    def _get_info(self, path: str, data: dict[str, str], headers: dict[str, str] | None = None) -> Response:
+        self.circuit_breaker.before_request()  # fail fast while ChilliConnect is unhealthy
+        try:
+            sent_token = self.access_token
+            r = self._post(
+                url=f"{self.host}/{path}",
                 data=data,
-                headers={"Connect-Access-Token": self.access_token},
+                headers={"Connect-Access-Token": sent_token, **(headers or {})},
             )
-        r.raise_for_status()
+            if r.status_code >= 400 and r.status_code < 500 and r.json()["Code"] == 1003:
+                # expired connect access token
+                self._refresh_access_token(sent_token)
+                r = self._post(
+                    url=f"{self.host}/{path}",
+                    data=data,
+                    headers={"Connect-Access-Token": self.access_token, **(headers or {})},
+                )
+            r.raise_for_status()
+        except BaseException as e:
+            if _is_upstream_failure(e):
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+            raise
+        self.circuit_breaker.record_success()
         return r
 
     def get_games(self) -> Matches:
@@ -194,5 +327,74 @@ class Wapi:
         return Matches.from_dict(r.json())
 
     def get_game_info(self, match_id: str) -> Match:
-        r = self._get_info("1.0/multiplayer/async/match/get", {"MatchID": match_id})
-        return Match.from_dict(r.json()["Match"])
+        return self._game_info_flight.do(match_id, lambda: self._fetch_game_info(match_id))
+
+    def _fetch_game_info(self, match_id: str) -> Match:
+        return self.decode_game_payload(self.fetch_game_payload(match_id))
+
+    def fetch_game_payload(self, match_id: str) -> GamePayload:
+        """
+        Fetches the match's payload, leaving out its content if it's unchanged since it was last decoded.
+        If the endpoint honors conditional requests, a 304 response also counts as unchanged.
+        Concurrent fetches of the same match, e.g. for each channel monitoring it, share one request.
+        """
+        return self._payload_flight.do(match_id, lambda: self._fetch_game_payload(match_id))
+
+    def _fetch_game_payload(self, match_id: str) -> GamePayload:
+        with self._payloads_lock:
+            cached = self._payloads.get(match_id)
+        headers = {"If-None-Match": cached.etag} if cached is not None and cached.etag is not None else None
+        r = self._get_info("1.0/multiplayer/async/match/get", {"MatchID": match_id}, headers)
+        if cached is not None and r.status_code == 304:
+            return GamePayload(match_id=match_id, digest=cached.digest, content=None, etag=cached.etag)
+
+        digest = hashlib.sha256(r.content).hexdigest()
+        if cached is not None and cached.digest == digest:
+            return GamePayload(match_id=match_id, digest=digest, content=None, etag=cached.etag)
+        return GamePayload(match_id=match_id, digest=digest, content=r.content, etag=r.headers.get("ETag"))
+
+    def decode_game_payload(self, payload: GamePayload) -> Match:
+        """ The Match in the payload, reusing the last one decoded for the match if the payload is unchanged """
+        with self._payloads_lock:
+            cached = self._payloads.get(payload.match_id)
+        if payload.content is None or (cached is not None and cached.digest == payload.digest):
+            if cached is None:
+                raise ValueError(f"No decoded payload for match {payload.match_id} to reuse")
+            if payload.received > cached.received:
+                with self._payloads_lock:
+                    self._payloads[payload.match_id] = replace(
+                        cached, received=payload.received, first_received=cached.unchanged_since)
+            return cached.match
+        match = Match.from_dict(json.loads(payload.content)["Match"])
+        with self._payloads_lock:
+            cached = self._payloads.get(payload.match_id)
+            if cached is not None and cached.digest == payload.digest:
+                return cached.match  # decoded by a concurrent call meanwhile, so everyone shares its Match
+            if cached is None or payload.received >= cached.received:
+                self._payloads[payload.match_id] = CachedPayload(
+                    digest=payload.digest, match=match, etag=payload.etag, received=payload.received)
+        return match
+
+    def cached_game_info(self, match_id: str) -> CachedPayload | None:
+        """ The last payload received for the match, without fetching it, or None if it hasn't been fetched """
+        with self._payloads_lock:
+            return self._payloads.get(match_id)
+
+    def cached_payloads(self) -> dict[str, CachedPayload]:
+        """ The last payload received for every match, e.g. to save them for a restart """
+        with self._payloads_lock:
+            return dict(self._payloads)
+
+    def restore_payloads(self, payloads: Mapping[str, CachedPayload]) -> None:
+        """ Adds previously received payloads, e.g. from before a restart, keeping any received since """
+        with self._payloads_lock:
+            for match_id, payload in payloads.items():
+                cached = self._payloads.get(match_id)
+                if cached is None or cached.received < payload.received:
+                    self._payloads[match_id] = payload
+
+    def fingerprint(self, match_id: str) -> str | None:
+        """ Digest of the last payload received for the match, or None if it hasn't been fetched """
+        with self._payloads_lock:
+            cached = self._payloads.get(match_id)
+        return None if cached is None else cached.digest
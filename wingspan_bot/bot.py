@@ -1,7 +1,12 @@
+import asyncio
 import logging
 import sys
 import traceback
 from collections.abc import Callable, Coroutine
+from contextlib import nullcontext
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 from typing import Any
 
 from nextcord.ext import commands, tasks  # type: ignore[attr-defined]
@@ -9,22 +14,73 @@ from nextcord.ext.commands import Context
 
 from wingspan_bot.data.data_controller import DataController
 from wingspan_bot.data.models import MessageType
+from wingspan_bot.deadlines import DEADLINE_RETRY, DeadlineScheduler, next_match_deadline
+from wingspan_bot.metrics import DEADLINE_CHECKS, ERRORS, MESSAGES_SENT, TICK_SECONDS
+from wingspan_bot.pipeline import PipelineConfig, TurnCheckPipeline
+from wingspan_bot.profiling import PROFILERS, TickProfiler
+from wingspan_bot.snapshot import Snapshot, save_snapshot
+from wingspan_bot.tracing import TRACER
 from wingspan_api.wapi import Match
 
 logger = logging.getLogger(__name__)
 
-SEND_FUNC = Callable[[str], Coroutine[Any, Any, None]]
+SEND_FUNC = Callable[[str], Coroutine[Any, Any, Any]]
+TICK_INTERVAL = timedelta(minutes=5)
+
+
+@dataclass
+class StaleReply:
+    """ A !turn reply sent from the last fetched data for a match, before checking for newer """
+    digest: str
+    message: Any
 
 
 class Bot(commands.Bot):  # type: ignore[misc]
-    def __init__(self, admin_channel: int, data_controller: DataController, *args: Any, **kwargs: Any):
+    def __init__(
+            self,
+            admin_channel: int,
+            data_controller: DataController,
+            *args: Any,
+            message_retention: timedelta | None = None,
+            pipeline_config: PipelineConfig | None = None,
+            snapshot_path: Path | None = None,
+            **kwargs: Any):
         self.dc = data_controller
+        self.pipeline = TurnCheckPipeline(data_controller, self.notify_match, pipeline_config)
+        self.deadlines: DeadlineScheduler[tuple[int, str]] = DeadlineScheduler()  # (channel, match id)
+        self.check_lock = asyncio.Lock()  # so deadline checks don't interleave with a tick's unit of work
+        self.snapshot_path = snapshot_path  # to save the in-memory state to after each tick and on shutdown
+        self.resume_at: datetime | None = None  # when the first tick is due, if resuming from a snapshot
         self.admin_channel = admin_channel
+        self.message_retention = message_retention
         super().__init__(*args, **kwargs)
 
         self.check_turns.start()  # start the task to run in the background
+        self.check_deadlines.start()
+        if message_retention is not None:
+            self.compact_history.start()
         self.add_cog(BotCommands(self, data_controller))
         self.in_error_state = False
+        self.next_tick_profiler: TickProfiler | None = None  # set to profile the next check_turns run
+
+    def restore_snapshot(self, snapshot: Snapshot) -> None:
+        """ Resumes from the state saved before a restart, with the next tick when it would have been """
+        snapshot.restore(self.dc.wapi, self.dc, self.deadlines)
+        self.resume_at = snapshot.saved + TICK_INTERVAL
+
+    def save_snapshot(self) -> None:
+        if self.snapshot_path is None:
+            return
+        try:
+            with TRACER.span("save_snapshot"):
+                save_snapshot(self.snapshot_path, Snapshot.take(self.dc.wapi, self.dc, self.deadlines))
+        except Exception:
+            ERRORS.inc(stage="save_snapshot")
+            logger.exception(f"Exception while saving the snapshot to {self.snapshot_path}")
+
+    async def close(self) -> None:
+        self.save_snapshot()
+        await super().close()
 
     def get_admin_channel_send(self) -> Any:
         admin_channel = self.get_channel(self.admin_channel)
@@ -32,22 +88,84 @@ class Bot(commands.Bot):  # type: ignore[misc]
             return None
         return admin_channel.send
 
-    @tasks.loop(minutes=5)  # type: ignore[misc]
+    @tasks.loop(seconds=TICK_INTERVAL.total_seconds())  # type: ignore[misc]
     async def check_turns(self) -> None:
+        profiler, self.next_tick_profiler = self.next_tick_profiler, None
         try:
-            for channel_id, match in self.dc.get_matches():
-                channel = self.get_channel(channel_id)
-                if self.dc.should_send_message(channel_id, match):
-                    if channel is None:
-                        await self.channel_not_found(channel_id)
-                    else:
-                        await self.send_message(channel.send, channel_id, match)
+            # the tick's writes are committed together once it's done
+            async with self.check_lock:
+                with TICK_SECONDS.time(), TRACER.span("tick"), profiler or nullcontext(), self.dc.unit_of_work():
+                    await self.pipeline.run()
         except BaseException:
             admin_channel = self.get_admin_channel_send() if not self.in_error_state else None
             self.in_error_state = True
-            await _handle_error(admin_channel, "checking turns")
+            await _handle_error(admin_channel, "checking turns", stage="check_turns")
         else:
             self.in_error_state = False
+        self.save_snapshot()
+        if profiler is not None:
+            await self.report_profile(profiler)
+
+    @tasks.loop(seconds=0)  # type: ignore[misc]
+    async def check_deadlines(self) -> None:
+        """ Checks matches the moment their reminder or timeout is due, rather than at the next tick """
+        due = await self.deadlines.wait()
+        DEADLINE_CHECKS.inc(len(due))
+        channel_matches: dict[int, list[str]] = {}
+        retry = datetime.now(timezone.utc) + DEADLINE_RETRY
+        for channel_id, match_id in due:
+            channel_matches.setdefault(channel_id, []).append(match_id)
+            # replaced with the next deadline once the match is checked, so it's only kept if the check fails
+            self.deadlines.schedule((channel_id, match_id), retry)
+        try:
+            async with self.check_lock:
+                with TRACER.span("deadline_check"), self.dc.unit_of_work():
+                    for channel_id, match_ids in channel_matches.items():
+                        # the payload may be unchanged, but its time remaining has now passed the deadline
+                        await self.pipeline.run(channel_id, changed_only=False, match_ids=match_ids)
+        except BaseException:
+            await _handle_error(self.get_admin_channel_send(), "checking deadlines", stage="check_deadlines")
+
+    @tasks.loop(hours=24)  # type: ignore[misc]
+    async def compact_history(self) -> None:
+        if self.message_retention is None:
+            return
+        try:
+            self.dc.compact_history(self.message_retention)
+        except BaseException:
+            await _handle_error(self.get_admin_channel_send(), "compacting message history", stage="compact_history")
+
+    async def report_profile(self, profiler: TickProfiler) -> None:
+        path = profiler.save()
+        admin_send = self.get_admin_channel_send()
+        if admin_send is not None:
+            # keep within discord's message length limit
+            await admin_send(f"Tick profile saved to {path}\n```{profiler.summary()[:1800]}```")
+
+    async def notify_match(self, channel_id: int, match: Match | str) -> None:
+        """ Sends the message for the match to its channel, if there's anything new to say """
+        if not isinstance(match, str):
+            self.schedule_deadline(channel_id, match)
+        with TRACER.span("should_send_message", match_id=str(match), channel=channel_id):
+            should_send_message = self.dc.should_send_message(channel_id, match)
+        if not should_send_message:
+            return
+        channel = self.get_channel(channel_id)
+        if channel is None:
+            await self.channel_not_found(channel_id)
+        else:
+            await self.send_message(channel.send, channel_id, match)
+
+    def schedule_deadline(self, channel_id: int, match: Match) -> None:
+        """ Schedules a check of the match for when its reminder or timeout is next due """
+        cached = self.dc.wapi.cached_game_info(match.MatchID)
+        # not when it was last received, as an unchanged payload's time remaining is from when it first was
+        received = cached.unchanged_since if cached is not None else datetime.now(timezone.utc)
+        deadline = next_match_deadline(match, received)
+        if deadline is None:
+            self.deadlines.cancel((channel_id, match.MatchID))
+        else:
+            self.deadlines.schedule((channel_id, match.MatchID), deadline)
 
     async def channel_not_found(self, channel_id: int) -> None:
         log_func: SEND_FUNC = self.get_admin_channel_send()
@@ -62,8 +180,34 @@ class Bot(commands.Bot):  # type: ignore[misc]
     async def send_message(self,
                            send_func: SEND_FUNC,
                            channel: int,
-                           match: Match | str) -> None:
+                           match: Match | str,
+                           note: str = "",
+                           record: bool = True) -> Any:
+        """
+        Sends the status of the match
+        :param note: added to the end of the message
+        :param record: whether to record it as the channel's latest message for the match, False if it's from stale
+                       data
+        :return: the sent message, from `send_func`
+        """
+        with TRACER.span("send_message", match_id=str(match), channel=channel):
+            return await self._send_message(send_func, channel, match, note, record)
+
+    async def _send_message(self,
+                            send_func: SEND_FUNC,
+                            channel: int,
+                            match: Match | str,
+                            note: str,
+                            record: bool) -> Any:
         message_type = self.dc.get_message_type(match)
+        player = None if isinstance(match, str) else match.current_player_name
+        sent = await send_func(self.message_text(channel, match, message_type) + note)
+        if record:
+            MESSAGES_SENT.inc(type=message_type.name)
+            self.dc.add_message(match, channel, player, message_type)
+        return sent
+
+    def message_text(self, channel: int, match: Match | str, message_type: MessageType) -> str:
         hours_remaining = None if isinstance(match, str) else match.hours_remaining
         player = None if isinstance(match, str) else match.current_player_name
         subscriptions = self.dc.get_subscriptions(channel)
@@ -73,59 +217,114 @@ class Bot(commands.Bot):  # type: ignore[misc]
             else ""
         )
         if message_type == MessageType.ERROR:
-            await send_func(f"Exception while checking {match} - check the logs")
+            return f"Exception while checking {match} - check the logs"
         if message_type == MessageType.GAME_COMPLETE:
-            await send_func(f"Game {match} is Complete!")
+            return f"Game {match} is Complete!"
         if message_type == MessageType.GAME_FORFEIT:
-            await send_func(f"Game {match} forfeit by {self.dc.get_forfeit_by(match)}")
+            return f"Game {match} forfeit by {self.dc.get_forfeit_by(match)}"
         if message_type == MessageType.GAME_TIMEOUT:
-            await send_func(f"Game {match} timed out on {player}'s{tagged_users} turn :(")
+            return f"Game {match} timed out on {player}'s{tagged_users} turn :("
         if message_type == MessageType.WAITING:
-            await send_func(f"Game {match} is waiting to start. {player}'s{tagged_users} turn"
-                            if player is not None else
-                            f"Game {match} is waiting to start. Waiting for player to join.")
+            return (f"Game {match} is waiting to start. {player}'s{tagged_users} turn"
+                    if player is not None else
+                    f"Game {match} is waiting to start. Waiting for player to join.")
         if message_type == MessageType.READY:
-            await send_func(f"Game {match} is ready to start. {player}'s{tagged_users} turn"
-                            if player is not None else
-                            f"Game {match} is ready to start. Unknown player's turn.")
+            return (f"Game {match} is ready to start. {player}'s{tagged_users} turn"
+                    if player is not None else
+                    f"Game {match} is ready to start. Unknown player's turn.")
         if message_type == MessageType.NEW_TURN:
-            await send_func(
-                f"It's {player}'s{tagged_users} turn with {hours_remaining:.2f}"
-                f" hours remaining in match {match}"
-            )
-        if message_type == MessageType.REMINDER:
-            await send_func(
-                f":rotating_light: {player}{tagged_users} only has {hours_remaining:.2f} hours remaining "
-                f"in match {match} :rotating_light:"
-            )
-        self.dc.add_message(match, channel, player, message_type)
+            return f"It's {player}'s{tagged_users} turn with {hours_remaining:.2f} hours remaining in match {match}"
+        return (f":rotating_light: {player}{tagged_users} only has {hours_remaining:.2f} hours remaining "
+                f"in match {match} :rotating_light:")
 
     @check_turns.before_loop  # type: ignore[misc]
     async def before_my_task(self) -> None:
         await self.wait_until_ready()  # wait until the bot logs in
+        if self.resume_at is not None:
+            # the matches were checked just before the restart, so don't fetch them all again straight away
+            delay = (self.resume_at - datetime.now(timezone.utc)).total_seconds()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    @check_deadlines.before_loop  # type: ignore[misc]
+    async def before_deadlines(self) -> None:
+        await self.wait_until_ready()
+
+    @compact_history.before_loop  # type: ignore[misc]
+    async def before_compact_history(self) -> None:
+        await self.wait_until_ready()  # so errors can be reported to the admin channel
 
 
 class BotCommands(commands.Cog):  # type: ignore[misc]
     def __init__(self, bot: Bot, data_controller: DataController):
         self.bot = bot
         self.dc = data_controller
+        # the running refreshes after !turn, kept so they aren't garbage collected while running
+        self.revalidations: set[asyncio.Task[None]] = set()
 
     @commands.command()  # type: ignore[misc]
     async def turn(self, ctx: Context) -> None:
         """ Who's turn is it? """
-        matches_checked = 0
+        replies: dict[str, StaleReply] = {}
         try:
             channel = ctx.channel.id
-            for _, match in self.dc.get_matches(channel):
-                matches_checked += 1
-                if isinstance(match, str):
-                    await ctx.reply(f"Exception while checking {match} - check the logs")
-                    continue
-                await self.bot.send_message(ctx.reply, channel, match)
-            if matches_checked == 0:
+            match_ids = self.dc.get_monitored_matches(channel)
+            if len(match_ids) == 0:
                 await ctx.reply("No matches found for this channel")
+                return
+            # answer straight away from the last time each match was fetched, then check for anything newer
+            now = datetime.now(timezone.utc)
+            for match_id in match_ids:
+                cached = self.dc.wapi.cached_game_info(match_id)
+                if cached is not None:
+                    note = f" (as of {_format_age(now - cached.received)})"
+                    reply = await self.bot.send_message(ctx.reply, channel, cached.match, note=note, record=False)
+                    replies[match_id] = StaleReply(digest=cached.digest, message=reply)
         except BaseException:
             await _handle_error(ctx.reply, "checking turns")
+            return
+        task = asyncio.create_task(self.revalidate_turns(ctx, channel, replies, now))
+        self.revalidations.add(task)
+        task.add_done_callback(self.revalidations.discard)
+
+    async def revalidate_turns(
+            self, ctx: Context, channel: int, replies: dict[str, StaleReply], requested: datetime) -> None:
+        """
+        Fetches the channel's matches, editing the replies sent from stale data when there's something newer to say,
+        and replying for those that hadn't been fetched yet
+        :param requested: when !turn was sent, matches fetched since are up to date without fetching them again
+        """
+        async def notify(channel_id: int, match: Match | str) -> None:
+            stale = replies.get(str(match))
+            if stale is None:
+                # an error getting the match isn't recorded, as !turn is only asking
+                await self.bot.send_message(ctx.reply, channel_id, match, record=not isinstance(match, str))
+                return
+            if isinstance(match, str):
+                return  # the stale reply is still the latest known
+            cached = self.dc.wapi.cached_game_info(str(match))
+            changed = cached is None or cached.digest != stale.digest
+            if changed or self.dc.should_send_message(channel_id, match):
+                await self.bot.send_message(lambda text: stale.message.edit(content=text), channel_id, match)
+
+        try:
+            # in a unit of work of its own, rather than joining a tick's
+            async with self.bot.check_lock:
+                with self.dc.unit_of_work():
+                    # matches fetched while this waited for the lock, e.g. by a tick or the refresh for an earlier
+                    # !turn, are already up to date
+                    to_fetch = []
+                    for match_id in self.dc.get_monitored_matches(channel):
+                        cached = self.dc.wapi.cached_game_info(match_id)
+                        if cached is not None and cached.received >= requested:
+                            await notify(channel, cached.match)
+                        else:
+                            to_fetch.append(match_id)
+                    if len(to_fetch) > 0:
+                        await TurnCheckPipeline(self.dc, notify, self.bot.pipeline.config).run(
+                            channel, changed_only=False, match_ids=to_fetch)
+        except BaseException:
+            await _handle_error(ctx.reply, "refreshing turns")
 
     @commands.command()  # type: ignore[misc]
     async def add(self, ctx: Context, game_id: str) -> None:
@@ -183,28 +382,52 @@ class BotCommands(commands.Cog):  # type: ignore[misc]
         except BaseException:
             await _handle_error(ctx.reply, error_msg)
 
+    @commands.command()  # type: ignore[misc]
+    async def profile(self, ctx: Context, kind: str = "cprofile") -> None:
+        """ Profile the next turn check (admin channel only) """
+        if ctx.channel.id != self.bot.admin_channel:
+            await ctx.reply("Profiling can only be requested from the admin channel")
+            return
+        try:
+            self.bot.next_tick_profiler = TickProfiler(kind)
+        except ValueError as e:
+            await ctx.reply(f"{e}. Available profilers: {', '.join(PROFILERS)}")
+            return
+        await ctx.reply(f"Profiling the next turn check with {kind}")
+
+    @commands.command()  # type: ignore[misc]
+    async def leaderboard(self, ctx: Context, category: str = "wins", scope: str = "channel") -> None:
+        """ Top players of completed games in this channel, or "global", e.g. !leaderboard winrate global """
+        try:
+            channel_id = None if scope == "global" else ctx.channel.id
+            await ctx.reply(f"```{self.dc.get_leaderboard(category, channel_id)}```")
+        except ValueError as e:
+            await ctx.reply(str(e))
+        except BaseException:
+            await _handle_error(ctx.reply, f"getting the {category} leaderboard")
+
     @commands.command()  # type: ignore[misc]
     async def stats(self, ctx: Context, game_id: str | None) -> None:
         try:
+            stats = self.dc.get_stats(ctx.channel.id, game_id)
             if game_id is not None:
                 header = f"Stats for {game_id} "
             else:
                 header = (
                     "Global channel data:\n"
-                    f"{len(self.dc.get_monitored_matches(ctx.channel.id, currently_monitored=False))} "
+                    f"{stats.matches_monitored} "
                     "matches monitored "
 
                 )
-            header += f"since {self.dc.get_data_start(ctx.channel.id, game_id)}\n"
+            header += f"since {stats.data_start}\n"
             await ctx.reply(
                 header +
                 "```"
-                f"{self.dc.get_fastest_player(ctx.channel.id, game_id)}"
-                f"{self.dc.get_highest_scores(ctx.channel.id, game_id)}"
+                f"{stats.fastest_player}"
+                f"{stats.highest_scores}"
                 "```"
             )
-            for player, turn_timing in self.dc.get_player_turn_timings(
-                    ctx.channel.id, game_id).player_turn_timings.items():
+            for player, turn_timing in stats.player_turn_timings.player_turn_timings.items():
                 await ctx.reply(
                     f"Hours {player} often plays (in UTC){'' if game_id is None else f' in match {game_id}'}:\n"
                     "```"
@@ -215,8 +438,19 @@ class BotCommands(commands.Cog):  # type: ignore[misc]
             await _handle_error(ctx.reply, f"getting stats for match {game_id}")
 
 
+def _format_age(age: timedelta) -> str:
+    minutes = int(age.total_seconds() // 60)
+    if minutes < 1:
+        return "just now"
+    if minutes < 60:
+        return f"{minutes} minute{'s' if minutes != 1 else ''} ago"
+    hours = minutes // 60
+    return f"{hours} hour{'s' if hours != 1 else ''} ago"
+
+
 async def _handle_error(
-        send_func: SEND_FUNC | None, error_action: str) -> None:
+        send_func: SEND_FUNC | None, error_action: str, stage: str = "command") -> None:
+    ERRORS.inc(stage=stage)
     logger.error(f"Exception while {error_action}")
     exc_type, exc_value, exc_traceback = sys.exc_info()
     logger.error("".join(traceback.format_exception(exc_type, exc_value, exc_traceback)))
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from collections.abc import Callable, Collection, Hashable, Iterable, Mapping
+from typing import Generic, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class BatchLoader(Generic[K, V]):
+    """
+    Looks up values by key in batches, DataLoader style. Keys are queued, e.g. all the matches a tick will check, and
+    the first time one is needed every queued key is loaded with one call to `load_many`. Results are memoized, so
+    a loader should only live as long as the data can be assumed not to change, e.g. for one tick
+    """
+    def __init__(self, load_many: Callable[[Collection[K]], Mapping[K, V]], default: Callable[[], V]) -> None:
+        """
+        :param load_many: loads the values for the keys, leaving out those without one
+        :param default: makes the value for keys `load_many` leaves out
+        """
+        self.load_many = load_many
+        self.default = default
+        self.batches = 0
+        self._queued: set[K] = set()
+        self._loaded: dict[K, V] = {}
+
+    def prime(self, keys: Iterable[K]) -> None:
+        """ Queues the keys to be loaded in the next batch """
+        self._queued.update(key for key in keys if key not in self._loaded)
+
+    def load(self, key: K) -> V:
+        if key not in self._loaded:
+            self._queued.add(key)
+            self._dispatch()
+        return self._loaded[key]
+
+    def clear(self, key: K) -> None:
+        """ Forgets the value for the key, e.g. after it's been changed, so it's loaded again when next needed """
+        self._loaded.pop(key, None)
+
+    def _dispatch(self) -> None:
+        keys, self._queued = self._queued, set()
+        values = self.load_many(keys)
+        self.batches += 1
+        for key in keys:
+            self._loaded[key] = values[key] if key in values else self.default()
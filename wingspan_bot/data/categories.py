@@ -0,0 +1,19 @@
+"""
+The leaderboard categories and their titles, kept apart from the queries in rollups so the command line can list them
+without importing SQLAlchemy
+"""
+
+# leaderboard name: title
+LEADERBOARD_TITLES = {
+    "wins": "Most wins",
+    "winrate": "Highest win rate (%)",
+    "average": "Highest average score",
+    "games": "Most games played",
+    "score": "Highest score",
+    "birds": "Most points from birds",
+    "bonus": "Most points from bonus cards",
+    "goals": "Most points from goals",
+    "eggs": "Most points from eggs",
+    "food": "Most points from cached food",
+    "tucked": "Most points from tucked cards",
+}
@@ -1,43 +1,171 @@
 import logging
-import sys
 import traceback
-from collections.abc import Iterator
-from datetime import datetime
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 from statistics import mean
-from typing import overload, Callable
+from typing import overload, NamedTuple
 
-from wingspan_bot.data.data_objects import ScoreStats, PlayerStat, FastestPlayer, PlayerTurnTimings
-from wingspan_bot.data.db_connection import DBConnection
-from wingspan_bot.data.models import MessageType
+from wingspan_bot.data.batch_loader import BatchLoader
+from wingspan_bot.data.data_objects import (
+    ScoreStats, PlayerStat, FastestPlayer, PlayerTurnTimings, Stats, Leaderboard)
+from wingspan_bot.data.db_connection import DBConnection, UnitOfWork, current_utc_datetime
+from wingspan_bot.data.models import MessageType, StatusMessage, Subscription
+from wingspan_bot.data.rollups import LEADERBOARD_CATEGORIES
+from wingspan_bot.data.stats_cache import StatsCache
+from wingspan_bot.metrics import ERRORS, MATCH_PAYLOADS
+from wingspan_bot.tracing import TRACER
+from wingspan_api.resilience import CircuitOpenError
 from wingspan_api.wapi import Match, Wapi, MatchState
 
 logger = logging.getLogger(__name__)
 
+REMINDER_HOURS = 24  # players are reminded once their turn has this long left
+
+
+class Fingerprints(NamedTuple):
+    processed: dict[tuple[int, str], str]  # (channel, match id): digest of the payload the channel last handled
+    scores: dict[str, str]  # match id: digest of the payload its scores were last saved from
+
+
+class _Turn(NamedTuple):
+    message_id: int
+    player: str | None
+    datetime: datetime
+
+
+def _turn_changes(messages: Iterable[StatusMessage]) -> Iterator[tuple[_Turn | None, _Turn]]:
+    """
+    Yields the turns, in order, of each message where it became a new person's turn in their match, along with the
+    previous turn in the match, or None for the first turn of the match
+    """
+    match_to_last_turn: dict[str, _Turn] = {}
+    for message in messages:
+        if message.id is None or message.datetime is None or message.match_id is None:
+            raise ValueError(f"Unexpected None values in message history for match {message.match_id}.")
+        turn = _Turn(message.id, message.player_turn, message.datetime)
+        if message.match_id not in match_to_last_turn:
+            if message.player_turn is not None:
+                match_to_last_turn[message.match_id] = turn
+                yield None, turn
+            continue
+        if message.message_type != MessageType.GAME_COMPLETE and message.player_turn is None:
+            continue
+        last_turn = match_to_last_turn[message.match_id]
+        if message.player_turn == last_turn.player:
+            continue
+        yield last_turn, turn
+        match_to_last_turn[message.match_id] = turn
+
+
+@dataclass
+class _ActiveUnitOfWork:
+    unit_of_work: UnitOfWork
+    # batch the per match lookups during a unit of work, which are primed with every monitored match
+    previous_messages: BatchLoader[tuple[int, str], StatusMessage | None]
+    subscriptions: BatchLoader[int, list[Subscription]]
+    # what the unit of work changed, to invalidate again once its writes are committed
+    changed_channels: set[int] = field(default_factory=set)
+    changed_matches: set[str] = field(default_factory=set)
+
 
 class DataController:
     def __init__(self, db_connection: DBConnection, wapi: Wapi) -> None:
         self.db = db_connection
         self.wapi = wapi
+        # fingerprints of the match payloads that have already been handled, to skip unchanged matches
+        self._score_fingerprints: dict[str, str] = {}
+        self._processed_fingerprints: dict[tuple[int, str], str] = {}
+        self.stats_cache = StatsCache()
+        # the unit of work of the task that entered it, and the tasks and threads it starts. Other tasks, e.g.
+        # commands handled while a tick waits on discord, don't join it
+        self._active: ContextVar[_ActiveUnitOfWork | None] = ContextVar(f"unit_of_work_{id(self)}", default=None)
+
+    @contextmanager
+    def unit_of_work(self) -> Iterator[UnitOfWork]:
+        """
+        Batches the score and message writes made until exit into one transaction, e.g. for all the writes in a tick,
+        and the lookups of previous messages and subscriptions for the matches into a query each.
+        Nested calls join the outer unit of work
+        """
+        active = self._active.get()
+        if active is not None:
+            yield active.unit_of_work
+            return
+        active = None
+        try:
+            with self.db.unit_of_work() as unit_of_work:
+                active = _ActiveUnitOfWork(
+                    unit_of_work=unit_of_work,
+                    previous_messages=BatchLoader(self.db.get_previous_messages, lambda: None),
+                    subscriptions=BatchLoader(self.db.get_channels_subscriptions, list))
+                token = self._active.set(active)
+                try:
+                    yield unit_of_work
+                finally:
+                    self._active.reset(token)
+        finally:
+            if active is not None:
+                # stats may have been computed and cached from the database while the writes were pending
+                for channel in active.changed_channels:
+                    self.stats_cache.invalidate_channel(channel)
+                for match_id in active.changed_matches:
+                    self.stats_cache.invalidate_match(match_id)
+
+    def _channel_changed(self, channel: int) -> None:
+        self.stats_cache.invalidate_channel(channel)
+        active = self._active.get()
+        if active is not None:
+            active.changed_channels.add(channel)
+
+    def _match_changed(self, match_id: str) -> None:
+        self.stats_cache.invalidate_match(match_id)
+        active = self._active.get()
+        if active is not None:
+            active.changed_matches.add(match_id)
+
+    def _subscriptions_changed(self, channel: int) -> None:
+        active = self._active.get()
+        if active is not None:
+            active.subscriptions.clear(channel)
+
+    @property
+    def _writes(self) -> DBConnection | UnitOfWork:
+        active = self._active.get()
+        return self.db if active is None else active.unit_of_work
 
     def add_message(self, match: Match | str, channel: int, player: str | None, message_type: MessageType) -> None:
-        self.db.add_message(match, channel, player, message_type)
+        self._writes.add_message(match, channel, player, message_type)
+        active = self._active.get()
+        if active is not None:
+            active.previous_messages.clear((channel, str(match)))
+        self._channel_changed(channel)
 
     def get_subscriptions(self, channel_id: int) -> dict[str, list[int]]:
-        results = self.db.get_subscriptions(channel_id)
+        active = self._active.get()
+        if active is not None:
+            results = active.subscriptions.load(channel_id)
+        else:
+            results = self.db.get_subscriptions(channel_id)
 
         wingspan_name_to_subscribers: dict[str, list[int]] = {}
         for result in results:
-            if result.wingspan_name is None:
-                raise ValueError(f"wingspan_name in {result} unexpectedly None")
-            if result.wingspan_name is None:
-                raise ValueError(f"discord_id in {result} unexpectedly None")
             if result.discord_id is None:
                 raise ValueError(f"discord_id unexpected None in {result}")
             wingspan_name_to_subscribers.setdefault(result.wingspan_name, []).append(result.discord_id)
         return wingspan_name_to_subscribers
 
+    def _get_previous_message(self, channel_id: int, match: Match | str) -> StatusMessage | None:
+        active = self._active.get()
+        if active is None:
+            return self.db.get_previous_message(channel_id, match)
+        pending = active.unit_of_work.get_pending_message(channel_id, match)
+        return pending if pending is not None else active.previous_messages.load((channel_id, str(match)))
+
     def should_send_message(self, channel_id: int, match: Match | str) -> bool:
-        previous_message = self.db.get_previous_message(channel_id, match)
+        previous_message = self._get_previous_message(channel_id, match)
         if previous_message is None:
             return True
         if previous_message.message_type != self.get_message_type(match):
@@ -63,7 +191,7 @@ class DataController:
             return MessageType.GAME_COMPLETE
         if match.hours_remaining is None:
             raise ValueError("Unexpected None for hours_remaining")
-        if match.hours_remaining <= 24:
+        if match.hours_remaining <= REMINDER_HOURS:
             return MessageType.REMINDER
         return MessageType.NEW_TURN
 
@@ -95,22 +223,64 @@ class DataController:
             return channel_to_matches.get(channel_id, [])
         return channel_to_matches
 
-    def get_matches(self, channel: int | None = None) -> Iterator[tuple[int, Match | str]]:
+    def prepare_matches(self, channel: int | None = None) -> list[tuple[int, str]]:
+        """
+        The (channel, match id) of each monitored match, in the channel or all channels if None. In a unit of work,
+        their previous messages and subscriptions are then looked up together when the first is needed
+        """
         monitored_matches = self.get_monitored_matches()
         if channel is not None:
             monitored_matches = {channel: self.get_monitored_matches(channel)}
-        for channel, match_ids in monitored_matches.items():
-            for match_id in match_ids:
-                try:
-                    # TODO: cache get_game_info for match_id
-                    match = self.wapi.get_game_info(match_id)
-                    self.db.add_or_update_score(match)
-                    yield channel, match
-                except BaseException:
-                    logger.error(f"Exception while getting data for match {match_id} in channel {channel}")
-                    exc_type, exc_value, exc_traceback = sys.exc_info()
-                    logger.error("".join(traceback.format_exception(exc_type, exc_value, exc_traceback)))
-                    yield channel, match_id
+        keys = [(channel, match_id) for channel, match_ids in monitored_matches.items() for match_id in match_ids]
+        active = self._active.get()
+        if active is not None:
+            active.previous_messages.prime(keys)
+            active.subscriptions.prime(monitored_matches)
+        return keys
+
+    def match_changed(self, channel: int, match_id: str, fingerprint: str | None) -> bool:
+        """ Whether the match's payload differs from the last one fully processed for the channel """
+        if fingerprint is not None and self._processed_fingerprints.get((channel, match_id)) == fingerprint:
+            MATCH_PAYLOADS.inc(result="unchanged")
+            return False
+        MATCH_PAYLOADS.inc(result="changed")
+        return True
+
+    def update_scores(self, match_id: str, match: Match, fingerprint: str | None) -> None:
+        """ Saves the match's scores, unless they've already been saved from the same payload """
+        if fingerprint is not None and self._score_fingerprints.get(match_id) == fingerprint:
+            return
+        with TRACER.span("add_or_update_score", match_id=match_id):
+            self._writes.add_or_update_score(match)
+            self._match_changed(match_id)
+        if fingerprint is not None:
+            self._score_fingerprints[match_id] = fingerprint
+
+    def match_processed(self, channel: int, match_id: str, fingerprint: str | None) -> None:
+        """ Records that the channel has handled the payload, so it's skipped until it changes """
+        if fingerprint is not None:
+            self._processed_fingerprints[(channel, match_id)] = fingerprint
+
+    def get_fingerprints(self) -> Fingerprints:
+        return Fingerprints(processed=dict(self._processed_fingerprints), scores=dict(self._score_fingerprints))
+
+    def restore_fingerprints(self, fingerprints: Fingerprints) -> None:
+        """ Adds previously recorded fingerprints, e.g. from before a restart, keeping any recorded since """
+        self._processed_fingerprints = {**fingerprints.processed, **self._processed_fingerprints}
+        self._score_fingerprints = {**fingerprints.scores, **self._score_fingerprints}
+
+    def match_failed(self, channel: int, match_id: str, error: BaseException) -> None:
+        """ Logs an error getting the match's data, making sure it's processed again next time """
+        if isinstance(error, CircuitOpenError):
+            # upstream is known to be down, so there's nothing useful in the traceback
+            logger.warning(f"Skipped getting data for match {match_id} in channel {channel}: {error}")
+            ERRORS.inc(stage="circuit_open")
+        else:
+            logger.error(f"Exception while getting data for match {match_id} in channel {channel}")
+            ERRORS.inc(stage="get_matches")
+            logger.error("".join(traceback.format_exception(type(error), error, error.__traceback__)))
+        # an error message may be sent, so the match has to be reprocessed even if it's unchanged
+        self._processed_fingerprints.pop((channel, match_id), None)
 
     def add(self, channel: int, game_id: str) -> bool:
         matches = self.get_monitored_matches().get(channel, [])
@@ -119,6 +289,7 @@ class DataController:
         else:
             self.wapi.get_game_info(game_id)  # raises if there's no game
             self.db.add_match(channel, game_id)
+            self._channel_changed(channel)
             return True
 
     def remove(self, channel: int, game_id: str) -> bool:
@@ -127,6 +298,7 @@ class DataController:
             return False
         else:
             self.db.remove_match(channel, game_id)
+            self._channel_changed(channel)
             return True
 
     def subscribe(self, channel: int, subscriber_id: int, wingspan_name: str) -> bool:
@@ -135,6 +307,7 @@ class DataController:
             return False
         else:
             self.db.add_subscriptions(channel, subscriber_id, wingspan_name)
+            self._subscriptions_changed(channel)
             return True
 
     def unsubscribe(self, channel: int, subscriber_id: int, wingspan_name: str) -> bool:
@@ -143,8 +316,27 @@ class DataController:
             return False
         else:
             self.db.remove_subscription(channel, subscriber_id, wingspan_name)
+            self._subscriptions_changed(channel)
             return True
 
+    def get_stats(self, channel_id: int, match: str | None = None) -> Stats:
+        """ Everything shown by the stats command, cached until the data behind it changes """
+        def compute() -> tuple[Stats, list[str]]:
+            match_ids = self.get_monitored_matches(channel_id, currently_monitored=False)
+            return Stats(
+                matches_monitored=len(match_ids),
+                data_start=self.get_data_start(channel_id, match),
+                fastest_player=self.get_fastest_player(channel_id, match),
+                highest_scores=self.get_highest_scores(channel_id, match),
+                player_turn_timings=self.get_player_turn_timings(channel_id, match)), match_ids
+
+        return self.stats_cache.get(channel_id, match, compute)
+
+    def get_leaderboard(self, category: str, channel_id: int | None = None, limit: int = 10) -> Leaderboard:
+        """ Top players over completed matches in the channel, or across all channels if None """
+        rows = self.db.get_leaderboard(category, channel_id, limit)
+        return Leaderboard.from_rows(LEADERBOARD_CATEGORIES[category][0], rows)
+
     def get_highest_scores(self, channel_id: int, match: str | Match | None = None) -> ScoreStats:
         return ScoreStats(
             highest_score=PlayerStat.from_scores(self.db.get_highest_score(channel_id, match)),
@@ -158,45 +350,29 @@ class DataController:
                 self.db.get_highest_tucked_cards_points(channel_id, match))
         )
 
-    def _scan_turns(
-            self,
-            update_func: Callable[[tuple[str | None, datetime], tuple[str | None, datetime]], None],
-            channel_id: int,
-            match: str | Match | None = None) -> None:
+    def compact_history(self, retention: timedelta) -> int:
         """
-        Scans through messages in order, and calls `update_func` every time it's a new person's turn
-        :param update_func: Funciton to be called every time the messages show that it's a new player's turn.
-                            Called with the previous username and datetime, and the new username and datetime.
-        :param channel_id: discord channel to get messages from
-        :param match: match to get messages from. If None, get all messages from the channel
+        Deletes the messages of finished matches older than `retention` that don't affect the stats, keeping the
+        messages where the turn changed, and the last message which later messages are compared against
+        :return: the number of messages deleted
         """
-        match_to_last_player: dict[str, tuple[str | None, datetime]] = {}
-        for message in self.db.get_messages(channel_id, match):
-            if message.datetime is None or message.match_id is None:
-                raise ValueError("Unexpected None values when getting message history "
-                                 f"for channel {channel_id}, match {match}.")
-            if message.match_id not in match_to_last_player:
-                if message.player_turn is not None:
-                    match_to_last_player[message.match_id] = (message.player_turn, message.datetime)
-                continue
-            if message.message_type != MessageType.GAME_COMPLETE and message.player_turn is None:
-                continue
-            if message.player_turn == match_to_last_player[message.match_id][0]:
-                continue
-            update_func(match_to_last_player[message.match_id], (message.player_turn, message.datetime))
-            match_to_last_player[message.match_id] = (message.player_turn, message.datetime)
+        deleted = 0
+        for channel, match_id in self.db.get_finished_matches(before=current_utc_datetime() - retention):
+            messages = self.db.get_messages(channel, match_id)
+            keep = {turn.message_id for _, turn in _turn_changes(messages)} | {messages[-1].id}
+            redundant = [message.id for message in messages if message.id is not None and message.id not in keep]
+            if len(redundant) > 0:
+                self.db.delete_messages(redundant)
+                deleted += len(redundant)
+        logger.info(f"Compacted message history, deleting {deleted} messages")
+        return deleted
 
     def get_fastest_player(self, channel_id: int, match: str | Match | None = None) -> FastestPlayer | None:
         times_for_turn: dict[str, list[float]] = {}
-
-        def update_func(last_player: tuple[str | None, datetime], new_player: tuple[str | None, datetime]) -> None:
-            if last_player[0] is None:
-                raise ValueError("Unexpected None for last_player")
-            times_for_turn.setdefault(
-                last_player[0], []).append(
-                (new_player[1] - last_player[1]).total_seconds() / 60 / 60)
-
-        self._scan_turns(update_func, channel_id=channel_id, match=match)
+        for turn in self.db.get_turns(channel_id, match):
+            if turn.player is None:
+                raise ValueError("Unexpected None for the player of a turn")
+            times_for_turn.setdefault(turn.player, []).append((turn.end - turn.start).total_seconds() / 60 / 60)
 
         fastest_players: list[str] = []
         fastest_avg: float = 0
@@ -212,12 +388,8 @@ class DataController:
 
     def get_player_turn_timings(self, channel_id: int, match: str | Match | None = None) -> PlayerTurnTimings:
         player_turn_timings = PlayerTurnTimings()
-
-        def update_func(last_player: tuple[str | None, datetime], new_player: tuple[str | None, datetime]) -> None:
-            if last_player[0] is None:
-                raise ValueError("Unexpected None for last_player")
-            player_turn_timings.increment_timing(player=last_player[0], hour=new_player[1].hour)
-
-        self._scan_turns(update_func=update_func, channel_id=channel_id, match=match)
-
+        for turn in self.db.get_turns(channel_id, match):
+            if turn.player is None:
+                raise ValueError("Unexpected None for the player of a turn")
+            player_turn_timings.increment_timing(player=turn.player, hour=turn.end.hour)
         return player_turn_timings
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
+from datetime import datetime
 
 from sqlalchemy.engine import Row
 
@@ -91,3 +92,28 @@ class PlayerTurnTimings:
         out_str += ("\n".join([f"{player}:\n{player_turn_timing}"
                                for player, player_turn_timing in self.player_turn_timings.items()]))
         return out_str
+
+
+@dataclass
+class Leaderboard:
+    title: str
+    entries: list[PlayerStat]
+
+    def __str__(self) -> str:
+        if len(self.entries) == 0:
+            return f"{self.title}:\nNo completed games yet\n"
+        return f"{self.title}:\n" + "".join(f"{rank:2}. {entry}\n" for rank, entry in enumerate(self.entries, 1))
+
+    @staticmethod
+    def from_rows(title: str, rows: list[Row] | list[tuple[str, int | float]]) -> Leaderboard:
+        return Leaderboard(title=title, entries=[PlayerStat(wingspan_names=[row[0]], score=row[1]) for row in rows])
+
+
+@dataclass
+class Stats:
+    """ Everything shown by the stats command, for a channel or one of its matches """
+    matches_monitored: int
+    data_start: datetime | None
+    fastest_player: FastestPlayer | None
+    highest_scores: ScoreStats
+    player_turn_timings: PlayerTurnTimings
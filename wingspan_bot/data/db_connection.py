@@ -1,12 +1,34 @@
+from __future__ import annotations
+
+import logging
+from collections.abc import Callable, Collection, Iterator
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Type
+from typing import Any, Type, TypeVar
+
+from sqlalchemy import (
+    create_engine, select, delete, update, desc, func, and_, or_, tuple_, Column, DateTime, Integer)
+from sqlalchemy.engine import Row, make_url
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from wingspan_bot.data.models import (
+    Subscription, Monitor, StatusMessage, MessageType, Player, Score, ChannelPlayerRollup, GlobalPlayerRollup,
+    RolledUpMatch)
+from wingspan_bot.data.players import get_player
+from wingspan_bot.data.rollups import AI_PLAYER, get_winners, leaderboard_statement, roll_up_match
+from wingspan_bot.data.sqlite_tuning import SingleWriter, configure_engine
+from wingspan_bot.metrics import DB_QUERY_SECONDS, ERRORS, timed
+from wingspan_bot.tracing import TRACER
+from wingspan_api.wapi import Match, MatchState
+
+logger = logging.getLogger(__name__)
 
-from sqlalchemy import create_engine, select, delete, update, desc, func, Column, Integer
-from sqlalchemy.engine import Row
-from sqlalchemy.orm import sessionmaker
+T = TypeVar("T")
 
-from wingspan_bot.data.models import Subscription, Monitor, StatusMessage, MessageType, Score
-from wingspan_api.wapi import Match
+TERMINAL_MESSAGE_TYPES = (MessageType.GAME_COMPLETE, MessageType.GAME_TIMEOUT, MessageType.GAME_FORFEIT)
+IN_BATCH_SIZE = 500  # parameters in each IN (...), keeping within sqlite's limit on the number in a query
+MAX_PENDING_WRITES = 500  # flushed early beyond this, to bound what's lost if the process dies mid tick
 
 
 def current_utc_datetime() -> datetime:
@@ -14,21 +36,88 @@ def current_utc_datetime() -> datetime:
 
 
 class DBConnection:
-    def __init__(self, db_connection: str):
-        self.engine = create_engine(db_connection, future=True)
+    def __init__(
+            self,
+            db_connection: str,
+            pool_size: int = 5,
+            max_overflow: int = 10,
+            pool_recycle: int = 30 * 60,
+            sqlite_tuning: bool = False):
+        """
+        :param db_connection: SQLAlchemy database URL
+        :param pool_size: connections kept open to the database. Ignored for SQLite, unless tuned
+        :param max_overflow: connections that can be opened beyond `pool_size` under load
+        :param pool_recycle: seconds after which connections are replaced, before the server times them out
+        :param sqlite_tuning: for SQLite database files, use WAL and faster pragmas, and do all writes on one thread
+                              with batched commits, so reads can run concurrently with them
+        """
+        url = make_url(db_connection)
+        engine_options: dict[str, Any] = {}
+        tune_sqlite = sqlite_tuning and url.get_backend_name() == "sqlite"
+        if tune_sqlite and url.database in (None, "", ":memory:"):
+            logger.warning("Not tuning in-memory SQLite database, which can't be shared with a writer thread")
+            tune_sqlite = False
+        if tune_sqlite:
+            # keep connections open so their page caches are reused, sharing them between the writer and readers
+            engine_options = {"poolclass": QueuePool, "pool_size": pool_size, "max_overflow": max_overflow,
+                              "connect_args": {"check_same_thread": False}}
+        elif url.get_backend_name() != "sqlite":
+            # pre ping so connections dropped by the server (e.g. on restart) are replaced instead of failing a tick
+            engine_options = {"pool_size": pool_size, "max_overflow": max_overflow, "pool_recycle": pool_recycle,
+                              "pool_pre_ping": True}
+        self.engine = create_engine(db_connection, future=True, **engine_options)
         self.Session = sessionmaker(self.engine)
+        self.writer: SingleWriter | None = None
+        if tune_sqlite:
+            configure_engine(self.engine)
+            self.writer = SingleWriter(self.Session)
+
+    def close(self) -> None:
+        """ Waits for outstanding writes, then closes the database connections """
+        if self.writer is not None:
+            self.writer.stop()
+        self.engine.dispose()
+
+    def _run_write(self, func: Callable[[Session], T]) -> T:
+        """ Calls `func` with a session, committing afterwards, on the writer thread if there is one """
+        if self.writer is not None:
+            return self.writer.run(func)
+        with self.Session.begin() as session:
+            return func(session)
 
+    @contextmanager
+    def unit_of_work(self) -> Iterator[UnitOfWork]:
+        """ Collects the writes made through the unit of work, committing them together on exit """
+        unit_of_work = UnitOfWork(self)
+        try:
+            yield unit_of_work
+        finally:
+            unit_of_work.flush()
+
+    @timed(DB_QUERY_SECONDS)
     def add_or_update_score(self, match: Match) -> None:
+        self._run_write(self._score_write(match))
+
+    @staticmethod
+    def _score_write(match: Match) -> Callable[[Session], None]:
         if match.StateData is None:
             raise ValueError(f"StateData in match {match} is unexpectedly None")
-        with self.Session.begin() as session:
-            for score in match.StateData.scores:
-                player_name = match.get_player_username(score.ID)
-                player_name = "AI/Computer" if player_name is None else player_name
-                session.merge(Score(
+        state_data = match.StateData
+        updated = current_utc_datetime()
+
+        def write(session: Session) -> None:
+            scores = []
+            players: dict[str, Player] = {}
+            for score in state_data.scores:
+                match_player = match.get_player(score.ID)
+                # the AI players' IDs are only unique within the match, so they're all counted as the one player
+                player = get_player(session, AI_PLAYER) if match_player is None else \
+                    get_player(session, match_player.UserName, match_player.ChilliConnectID)
+                players[score.ID] = player
+                scores.append(session.merge(Score(
                     match_id=match.MatchID,
-                    updated=current_utc_datetime(),
-                    player_name=player_name,
+                    updated=updated,
+                    player_id=player.id,
                     score=score.Score,
                     bird_points=score.BirdPoints,
                     bonus_card_points=score.BonusCardPoints,
@@ -36,26 +125,40 @@ class DBConnection:
                     eggs_points=score.EggsPoints,
                     cached_food_points=score.CachedFoodPoints,
                     tucked_cards_points=score.TuckedCardsPoints,
-                    food_tokens=score.FoodTokens))
+                    food_tokens=score.FoodTokens)))
+            if match.State == MatchState.COMPLETED:
+                winner = None if match.OutcomeData is None or match.OutcomeData.Winner is None else \
+                    players.get(match.OutcomeData.Winner)
+                winners = get_winners(scores, None if winner is None else winner.id)
+                roll_up_match(session, match.MatchID, scores, winners)
+
+        return write
 
+    @timed(DB_QUERY_SECONDS)
     def get_highest_score(self, channel_id: int, match: Match | str | None = None) -> list[Row]:
         return self._get_highest_score(channel_id, match, Score.score)
 
+    @timed(DB_QUERY_SECONDS)
     def get_highest_bird_points(self, channel_id: int, match: Match | str | None = None) -> list[Row]:
         return self._get_highest_score(channel_id, match, Score.bird_points)
 
+    @timed(DB_QUERY_SECONDS)
     def get_highest_bonus_card_points(self, channel_id: int, match: Match | str | None = None) -> list[Row]:
         return self._get_highest_score(channel_id, match, Score.bonus_card_points)
 
+    @timed(DB_QUERY_SECONDS)
     def get_highest_goals_points(self, channel_id: int, match: Match | str | None = None) -> list[Row]:
         return self._get_highest_score(channel_id, match, Score.goals_points)
 
+    @timed(DB_QUERY_SECONDS)
     def get_highest_eggs_points(self, channel_id: int, match: Match | str | None = None) -> list[Row]:
         return self._get_highest_score(channel_id, match, Score.eggs_points)
 
+    @timed(DB_QUERY_SECONDS)
     def get_highest_cached_food_points(self, channel_id: int, match: Match | str | None = None) -> list[Row]:
         return self._get_highest_score(channel_id, match, Score.cached_food_points)
 
+    @timed(DB_QUERY_SECONDS)
     def get_highest_tucked_cards_points(self, channel_id: int, match: Match | str | None = None) -> list[Row]:
         return self._get_highest_score(channel_id, match, Score.tucked_cards_points)
 
@@ -63,7 +166,7 @@ class DBConnection:
             self, channel_id: int, match: Match | str | None, score_type: Type[Column[Integer]]) -> list[Row]:
         with self.Session() as session:
             max_score = select(func.max(score_type))
-            statement = select(Score.player_name, score_type)
+            statement = select(Player.name, score_type).join(Player, Score.player_id == Player.id)
             matches_in_channel = select(Monitor.match_id).filter(Monitor.channel == channel_id)
             statement = statement.filter(Score.match_id.in_(matches_in_channel.scalar_subquery()))
             max_score = max_score.filter(Score.match_id.in_(matches_in_channel.scalar_subquery()))
@@ -73,10 +176,39 @@ class DBConnection:
             statement = statement.filter(score_type == max_score.scalar_subquery())
             return session.execute(statement).all()
 
+    @timed(DB_QUERY_SECONDS)
+    def get_leaderboard(self, category: str, channel: int | None = None, limit: int = 10) -> list[Row]:
+        """ The (player name, value) of the top players for the category, in the channel or across all channels """
+        with self.Session() as session:
+            return session.execute(leaderboard_statement(category, channel, limit)).all()
+
+    @timed(DB_QUERY_SECONDS)
+    def rebuild_rollups(self) -> int:
+        """
+        Recomputes the rollups from the stored scores of matches with a message saying they're over, e.g. to include
+        matches that completed before the rollups existed. The winners of these are taken to be the top scorers
+        :return: the number of matches rolled up
+        """
+        def write(session: Session) -> int:
+            for model in (ChannelPlayerRollup, GlobalPlayerRollup, RolledUpMatch):
+                session.execute(delete(model))
+            finished = select(StatusMessage.match_id).filter(
+                StatusMessage.message_type.in_(TERMINAL_MESSAGE_TYPES)).distinct()
+            scores_by_match: dict[str, list[Score]] = {}
+            for score in session.execute(select(Score).filter(Score.match_id.in_(finished))).scalars():
+                scores_by_match.setdefault(score.match_id, []).append(score)
+            for match_id, scores in scores_by_match.items():
+                roll_up_match(session, match_id, scores, get_winners(scores))
+            return len(scores_by_match)
+
+        return self._run_write(write)
+
+    @timed(DB_QUERY_SECONDS)
     def get_scores(self, match: Match | str) -> list[Score]:
         with self.Session() as session:
             return session.execute(select(Score).filter_by(match_id=str(match))).scalars().all()
 
+    @timed(DB_QUERY_SECONDS)
     def get_previous_message(self, channel: int, match: str | Match) -> StatusMessage | None:
         match_id = str(match)
         with self.Session() as session:
@@ -84,16 +216,57 @@ class DBConnection:
                 desc("datetime"))).scalars().first()
         return result
 
+    @timed(DB_QUERY_SECONDS)
+    def get_previous_messages(self, keys: Collection[tuple[int, str]]) -> dict[tuple[int, str], StatusMessage]:
+        """ The latest message for each (channel, match id), leaving out those without any """
+        keys = list(keys)
+        previous_messages: dict[tuple[int, str], StatusMessage] = {}
+        with self.Session() as session:
+            batch_size = IN_BATCH_SIZE // 2  # each key is two parameters
+            for i in range(0, len(keys), batch_size):
+                latest = select(StatusMessage.id, func.row_number().over(
+                    partition_by=(StatusMessage.channel, StatusMessage.match_id),
+                    order_by=(desc(StatusMessage.datetime), desc(StatusMessage.id))).label("position")).filter(
+                    tuple_(StatusMessage.channel, StatusMessage.match_id).in_(keys[i:i + batch_size])).subquery()
+                statement = select(StatusMessage).join(latest, StatusMessage.id == latest.c.id).filter(
+                    latest.c.position == 1)
+                for message in session.execute(statement).scalars():
+                    previous_messages[(int(message.channel), str(message.match_id))] = message
+        return previous_messages
+
+    @timed(DB_QUERY_SECONDS)
     def add_message(self, match: Match | str, channel: int, player: str | None, message_type: MessageType) -> None:
-        match_id = str(match)
-        with self.Session.begin() as session:
-            session.add(StatusMessage(
-                match_id=match_id,
-                channel=channel,
-                datetime=current_utc_datetime(),
-                player_turn=player,
-                message_type=message_type))
+        _, write = self._message_write(match, channel, player, message_type)
+        self._run_write(write)
 
+    @staticmethod
+    def _message_write(
+            match: Match | str,
+            channel: int,
+            player: str | None,
+            message_type: MessageType) -> tuple[StatusMessage, Callable[[Session], None]]:
+        """
+        :return: the message, with a stand in for the player that isn't saved, and the write adding it with the player
+                 looked up by their ChilliConnect ID when they're in the match, otherwise by name
+        """
+        chilli_connect_id = None
+        if isinstance(match, Match) and player is not None:
+            chilli_connect_id = match.get_player_id(player)
+        sent = current_utc_datetime()
+
+        def new_message(message_player: Player | None) -> StatusMessage:
+            message = StatusMessage(match_id=str(match), channel=channel, datetime=sent, message_type=message_type)
+            if message_player is not None:
+                message.player = message_player
+            return message
+
+        def write(session: Session) -> None:
+            session.add(new_message(None if player is None else get_player(session, player, chilli_connect_id)))
+
+        stand_in = None if player is None else Player(name=player, chilli_connect_id=chilli_connect_id)
+        return new_message(stand_in), write
+
+    @timed(DB_QUERY_SECONDS)
     def get_matches(self, currently_monitored: bool = True) -> list[Monitor]:
         with self.Session() as session:
             statement = select(Monitor)
@@ -101,6 +274,7 @@ class DBConnection:
                 statement = statement.filter(Monitor.removed.is_(None))
             return session.execute(statement).scalars().all()
 
+    @timed(DB_QUERY_SECONDS)
     def get_data_start(self, channel_id: int, match: str | Match | None = None) -> datetime | None:
         with self.Session() as session:
             statement = select(func.min(Monitor.added)).filter(Monitor.channel == channel_id)
@@ -108,31 +282,174 @@ class DBConnection:
                 statement = statement.filter(Monitor.match_id == str(match))
             return session.execute(statement).scalar()
 
+    @timed(DB_QUERY_SECONDS)
     def remove_match(self, channel: int, match_id: str) -> None:
-        with self.Session.begin() as session:
-            session.execute(update(Monitor).filter_by(channel=channel, match_id=match_id).values(
-                removed=current_utc_datetime()))
+        self._run_write(lambda session: session.execute(
+            update(Monitor).filter_by(channel=channel, match_id=match_id).values(removed=current_utc_datetime())))
 
+    @timed(DB_QUERY_SECONDS)
     def add_match(self, channel: int, match_id: str) -> None:
-        with self.Session.begin() as session:
-            session.add(Monitor(match_id=match_id, channel=channel, added=current_utc_datetime()))
+        monitor = Monitor(match_id=match_id, channel=channel, added=current_utc_datetime())
+        self._run_write(lambda session: session.add(monitor))
 
+    @timed(DB_QUERY_SECONDS)
     def get_subscriptions(self, channel: int) -> list[Subscription]:
         with self.Session() as session:
             return session.execute(select(Subscription).filter_by(channel=channel)).scalars().all()
 
+    @timed(DB_QUERY_SECONDS)
+    def get_channels_subscriptions(self, channels: Collection[int]) -> dict[int, list[Subscription]]:
+        """ The subscriptions in each of the channels, leaving out those without any """
+        channels = list(channels)
+        subscriptions: dict[int, list[Subscription]] = {}
+        with self.Session() as session:
+            for i in range(0, len(channels), IN_BATCH_SIZE):
+                statement = select(Subscription).filter(Subscription.channel.in_(channels[i:i + IN_BATCH_SIZE]))
+                for subscription in session.execute(statement).scalars():
+                    subscriptions.setdefault(int(subscription.channel), []).append(subscription)
+        return subscriptions
+
+    @timed(DB_QUERY_SECONDS)
     def remove_subscription(self, channel: int, discord_id: int, wingspan_name: str) -> None:
-        with self.Session.begin() as session:
-            session.execute(delete(Subscription).filter_by(
-                channel=channel, discord_id=discord_id, wingspan_name=wingspan_name))
+        players = select(Player.id).filter_by(name=wingspan_name)
+        self._run_write(lambda session: session.execute(delete(Subscription).filter_by(
+            channel=channel, discord_id=discord_id).filter(Subscription.player_id.in_(players.scalar_subquery())),
+            execution_options={"synchronize_session": False}))
 
+    @timed(DB_QUERY_SECONDS)
     def add_subscriptions(self, channel: int, discord_id: int, wingspan_name: str) -> None:
-        with self.Session.begin() as session:
-            session.add(Subscription(channel=channel, discord_id=discord_id, wingspan_name=wingspan_name))
+        self._run_write(lambda session: session.add(Subscription(
+            channel=channel, discord_id=discord_id, player=get_player(session, wingspan_name))))
 
+    @timed(DB_QUERY_SECONDS)
     def get_messages(self, channel: int, match: Match | str | None = None) -> list[StatusMessage]:
         with self.Session() as session:
             statement = select(StatusMessage).filter(StatusMessage.channel == channel).order_by(StatusMessage.datetime)
             if match is not None:
                 statement = statement.filter(StatusMessage.match_id == str(match))
             return session.execute(statement).scalars().all()
+
+    @timed(DB_QUERY_SECONDS)
+    def get_turns(self, channel: int, match: Match | str | None = None) -> list[Row]:
+        """
+        The (player, start, end) of each turn that's over, in the order they ended. A turn starts with the first message
+        for a new player in the match, and ends when the next one starts or the game completes. Other messages for no
+        one's turn are ignored, as are those before the first turn
+        """
+        with self.Session() as session:
+            # each message for someone's turn or the game completing, with the player of the one before it
+            messages = select(
+                StatusMessage.id,
+                StatusMessage.match_id,
+                StatusMessage.datetime,
+                StatusMessage.player_id,
+                func.lag(StatusMessage.player_id).over(
+                    partition_by=StatusMessage.match_id,
+                    order_by=(StatusMessage.datetime, StatusMessage.id)).label("previous_player_id")
+            ).filter(StatusMessage.channel == channel, or_(
+                StatusMessage.player_id.isnot(None), StatusMessage.message_type == MessageType.GAME_COMPLETE))
+            if match is not None:
+                messages = messages.filter(StatusMessage.match_id == str(match))
+            messages_subquery = messages.subquery()
+            # windows apply after the filter, so this pairs each turn change with the one before it in the match
+            order = (messages_subquery.c.datetime, messages_subquery.c.id)
+            changes = select(
+                messages_subquery.c.id,
+                messages_subquery.c.datetime.label("end"),
+                func.lag(messages_subquery.c.player_id).over(
+                    partition_by=messages_subquery.c.match_id, order_by=order).label("player_id"),
+                func.lag(messages_subquery.c.datetime, type_=DateTime).over(
+                    partition_by=messages_subquery.c.match_id, order_by=order).label("start"),
+            ).filter(messages_subquery.c.player_id.is_distinct_from(messages_subquery.c.previous_player_id)).subquery()
+            statement = select(Player.name.label("player"), changes.c.start, changes.c.end).outerjoin(
+                Player, Player.id == changes.c.player_id).filter(changes.c.start.isnot(None)).order_by(
+                changes.c.end, changes.c.id)
+            return session.execute(statement).all()
+
+    @timed(DB_QUERY_SECONDS)
+    def get_finished_matches(self, before: datetime) -> list[tuple[int, str]]:
+        """ The (channel, match id) of matches whose last message ended the game, and was sent before `before` """
+        with self.Session() as session:
+            last_messages = select(
+                StatusMessage.channel,
+                StatusMessage.match_id,
+                func.max(StatusMessage.datetime).label("last")
+            ).group_by(StatusMessage.channel, StatusMessage.match_id).having(
+                func.max(StatusMessage.datetime) < before).subquery()
+            statement = select(StatusMessage.channel, StatusMessage.match_id).join(last_messages, and_(
+                StatusMessage.channel == last_messages.c.channel,
+                StatusMessage.match_id == last_messages.c.match_id,
+                StatusMessage.datetime == last_messages.c.last
+            )).filter(StatusMessage.message_type.in_(TERMINAL_MESSAGE_TYPES)).distinct()
+            return [(row.channel, row.match_id) for row in session.execute(statement)]
+
+    @timed(DB_QUERY_SECONDS)
+    def delete_messages(self, message_ids: Collection[int]) -> None:
+        ids = list(message_ids)
+
+        def write(session: Session) -> None:
+            for i in range(0, len(ids), IN_BATCH_SIZE):
+                session.execute(delete(StatusMessage).filter(StatusMessage.id.in_(ids[i:i + IN_BATCH_SIZE])))
+
+        self._run_write(write)
+
+
+class UnitOfWork:
+    """
+    Queues score and message writes to commit them in one transaction, instead of one each. If that transaction fails
+    the writes are retried one at a time, so a single bad write doesn't lose the rest
+    """
+    def __init__(self, db: DBConnection, max_pending: int = MAX_PENDING_WRITES) -> None:
+        self.db = db
+        self.max_pending = max_pending
+        self._writes: list[Callable[[Session], None]] = []
+        # the latest queued message for each (channel, match id), which readers need to see before it's committed
+        self._messages: dict[tuple[int, str], StatusMessage] = {}
+
+    @property
+    def pending(self) -> int:
+        return len(self._writes)
+
+    def add_or_update_score(self, match: Match) -> None:
+        self._queue(self.db._score_write(match))
+
+    def add_message(self, match: Match | str, channel: int, player: str | None, message_type: MessageType) -> None:
+        message, write = self.db._message_write(match, channel, player, message_type)
+        self._messages[(channel, str(match))] = message
+        self._queue(write)
+
+    def get_previous_message(self, channel: int, match: str | Match) -> StatusMessage | None:
+        message = self.get_pending_message(channel, match)
+        return message if message is not None else self.db.get_previous_message(channel, match)
+
+    def get_pending_message(self, channel: int, match: str | Match) -> StatusMessage | None:
+        """ The latest message queued for the match, if there's one that hasn't been flushed yet """
+        return self._messages.get((channel, str(match)))
+
+    def flush(self) -> None:
+        writes, self._writes = self._writes, []
+        self._messages = {}
+        if len(writes) == 0:
+            return
+        with TRACER.span("flush_writes", writes=len(writes)):
+            try:
+                self.db._run_write(lambda session: self._write_all(session, writes))
+                return
+            except BaseException:
+                logger.exception(f"Failed to commit {len(writes)} writes together, retrying them one at a time")
+            for write in writes:
+                try:
+                    self.db._run_write(write)
+                except BaseException:
+                    logger.exception("Failed to commit write")
+                    ERRORS.inc(stage="flush_writes")
+
+    def _queue(self, write: Callable[[Session], None]) -> None:
+        self._writes.append(write)
+        if len(self._writes) >= self.max_pending:
+            self.flush()
+
+    @staticmethod
+    def _write_all(session: Session, writes: list[Callable[[Session], None]]) -> None:
+        for write in writes:
+            write(session)
@@ -0,0 +1,196 @@
+"""
+Populates a database with a synthetic, but plausible, history of monitored matches for load testing the stats.
+Run with `python -m wingspan_bot.data.history_generator -h`
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import random
+from collections.abc import Generator, Iterator
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy import func, insert, select
+
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.data.models import Base, MessageType, Monitor, Player, Score, StatusMessage
+
+logger = logging.getLogger(__name__)
+
+TURNS_PER_PLAYER = 26  # 8 + 7 + 6 + 5 turns over the four rounds
+BATCH_SIZE = 10000
+
+
+@dataclass
+class HistoryConfig:
+    channels: int = 10
+    matches_per_channel: int = 50
+    players: int = 200  # total across all channels
+    players_per_channel: int = 8
+    in_progress_fraction: float = 0.1  # of each channel's matches, the most recent ones
+    mean_turn_hours: float = 6
+    reminder_probability: float = 0.1
+    error_probability: float = 0.02
+    start: datetime = datetime(2022, 1, 1)
+    seed: int = 0
+
+
+@dataclass
+class HistorySummary:
+    monitors: int = 0
+    status_messages: int = 0
+    scores: int = 0
+
+
+class HistoryGenerator:
+    def __init__(self, config: HistoryConfig) -> None:
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.player_names = [f"player{i}" for i in range(config.players)]
+        self.player_ids: dict[str, int] = {}
+        self.summary = HistorySummary()
+
+    def generate(self, db: DBConnection) -> HistorySummary:
+        """ Bulk inserts the generated rows in batches, in a single transaction """
+        monitors: list[dict[str, Any]] = []
+        messages: list[dict[str, Any]] = []
+        scores: list[dict[str, Any]] = []
+        with db.Session.begin() as session:
+            # ids are given explicitly so the rows referencing the players can be bulk inserted too
+            first_id = (session.execute(select(func.max(Player.id))).scalar() or 0) + 1
+            self.player_ids = {name: first_id + i for i, name in enumerate(self.player_names)}
+            session.execute(insert(Player), [{"id": player_id, "chilli_connect_id": f"chilli-{name}", "name": name}
+                                             for name, player_id in self.player_ids.items()])
+            for row_type, row in self._rows():
+                if row_type is Monitor:
+                    monitors.append(row)
+                elif row_type is StatusMessage:
+                    messages.append(row)
+                else:
+                    scores.append(row)
+                for rows, model in ((monitors, Monitor), (messages, StatusMessage), (scores, Score)):
+                    if len(rows) >= BATCH_SIZE:
+                        session.execute(insert(model), rows)
+                        rows.clear()
+                        logger.info(f"Inserted {BATCH_SIZE} more {model.__tablename__} rows")
+            for rows, model in ((monitors, Monitor), (messages, StatusMessage), (scores, Score)):
+                if len(rows) > 0:
+                    session.execute(insert(model), rows)
+        return self.summary
+
+    def _rows(self) -> Iterator[tuple[type[Base], dict[str, Any]]]:
+        for channel in range(1, self.config.channels + 1):
+            channel_players = self.rng.sample(
+                self.player_names, min(self.config.players_per_channel, self.config.players))
+            # each player has a preferred hour of the day to take their turns, so the turn timings aren't uniform
+            preferred_hours = {player: self.rng.randint(0, 23) for player in channel_players}
+            match_start = self.config.start + timedelta(hours=self.rng.uniform(0, 24 * 7))
+            num_in_progress = round(self.config.matches_per_channel * self.config.in_progress_fraction)
+            for match_number in range(self.config.matches_per_channel):
+                match_id = f"channel{channel}-match{match_number}"
+                players = self.rng.sample(channel_players, self.rng.randint(2, min(5, len(channel_players))))
+                completed = match_number < self.config.matches_per_channel - num_in_progress
+                self.summary.monitors += 1
+                yield Monitor, {"match_id": match_id, "channel": channel, "added": match_start, "removed": None}
+                end = yield from self._match_messages(channel, match_id, players, preferred_hours, match_start,
+                                                      completed)
+                yield from self._match_scores(match_id, players, end, completed)
+                # matches overlap, with a new one usually starting before the last one ended
+                match_start += (end - match_start) * self.rng.uniform(0.2, 1.2)
+
+    def _turn_duration(self, player: str, now: datetime, preferred_hour: int) -> timedelta:
+        hours = self.rng.expovariate(1 / self.config.mean_turn_hours)
+        end = now + timedelta(hours=hours)
+        # nudge the end of the turn towards the player's preferred hour
+        shift = (preferred_hour - end.hour) % 24
+        if shift <= 12 and self.rng.random() < 0.7:
+            end += timedelta(hours=shift)
+        return end - now
+
+    def _match_messages(
+            self,
+            channel: int,
+            match_id: str,
+            players: list[str],
+            preferred_hours: dict[str, int],
+            start: datetime,
+            completed: bool) -> Generator[tuple[type[Base], dict[str, Any]], None, datetime]:
+        """ Yields the messages the bot would have sent for the match, returning when it was last updated """
+        def message(when: datetime, player: str | None, message_type: MessageType) -> tuple[type[Base], dict[str, Any]]:
+            self.summary.status_messages += 1
+            return StatusMessage, {"match_id": match_id, "channel": channel, "datetime": when,
+                                   "player_id": None if player is None else self.player_ids[player],
+                                   "message_type": message_type}
+
+        now = start
+        yield message(now, players[0], MessageType.READY)
+        turns = TURNS_PER_PLAYER * len(players) if completed else self.rng.randint(1, TURNS_PER_PLAYER * len(players))
+        for turn in range(turns):
+            player = players[turn % len(players)]
+            if turn > 0:
+                yield message(now, player, MessageType.NEW_TURN)
+            duration = self._turn_duration(player, now, preferred_hours[player])
+            if self.rng.random() < self.config.reminder_probability:
+                yield message(now + duration * self.rng.uniform(0.5, 0.9), player, MessageType.REMINDER)
+            if self.rng.random() < self.config.error_probability:
+                yield message(now + duration * self.rng.uniform(0.1, 0.4), None, MessageType.ERROR)
+                yield message(now + duration * self.rng.uniform(0.4, 0.5), player, MessageType.NEW_TURN)
+            now += duration
+        if completed:
+            yield message(now, None, MessageType.GAME_COMPLETE)
+        return now
+
+    def _match_scores(
+            self,
+            match_id: str,
+            players: list[str],
+            updated: datetime,
+            completed: bool) -> Iterator[tuple[type[Base], dict[str, Any]]]:
+        progress = 1 if completed else self.rng.uniform(0.1, 0.9)
+        for player in players:
+            points = {
+                "bird_points": round(self.rng.randint(20, 60) * progress),
+                "bonus_card_points": round(self.rng.randint(0, 15) * progress),
+                "goals_points": round(self.rng.randint(0, 20) * progress),
+                "eggs_points": round(self.rng.randint(0, 30) * progress),
+                "cached_food_points": round(self.rng.randint(0, 10) * progress),
+                "tucked_cards_points": round(self.rng.randint(0, 15) * progress),
+            }
+            self.summary.scores += 1
+            yield Score, {"match_id": match_id, "player_id": self.player_ids[player], "updated": updated,
+                          "score": sum(points.values()), "food_tokens": self.rng.randint(0, 8), **points}
+
+
+def generate_history(db: DBConnection, config: HistoryConfig | None = None) -> HistorySummary:
+    return HistoryGenerator(config if config is not None else HistoryConfig()).generate(db)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    defaults = HistoryConfig()
+    parser = argparse.ArgumentParser(description="Populate a database with a synthetic match history")
+    parser.add_argument("db_connection", help="Database to populate, e.g. sqlite:///history.db")
+    parser.add_argument("--channels", type=int, default=defaults.channels)
+    parser.add_argument("--matches-per-channel", type=int, default=defaults.matches_per_channel)
+    parser.add_argument("--players", type=int, default=defaults.players, help="Total players across all channels")
+    parser.add_argument("--players-per-channel", type=int, default=defaults.players_per_channel)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--create-tables", action="store_true", help="Create the tables instead of using alembic")
+    args = parser.parse_args()
+
+    db = DBConnection(args.db_connection)
+    if args.create_tables:
+        Base.metadata.create_all(db.engine)
+    summary = generate_history(db, HistoryConfig(
+        channels=args.channels,
+        matches_per_channel=args.matches_per_channel,
+        players=args.players,
+        players_per_channel=args.players_per_channel,
+        seed=args.seed))
+    print(f"Added {summary.monitors} matches, {summary.status_messages} status messages and {summary.scores} scores")
+
+
+if __name__ == "__main__":
+    main()
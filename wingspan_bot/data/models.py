@@ -1,16 +1,25 @@
 import enum
 
-from sqlalchemy import Column, Integer, String, DateTime, Enum
-from sqlalchemy.orm import declarative_base
+from sqlalchemy import BigInteger, Column, ForeignKey, Integer, String, DateTime, Enum
+from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
 
 
+class Player(Base):
+    """ A Wingspan player, keyed by their ChilliConnect ID so their history follows them when they rename """
+    __tablename__ = "player"
+    id = Column(Integer, primary_key=True)
+    # None for players only known by name, e.g. subscribed to before being seen in a match, or the AI players
+    chilli_connect_id = Column(String, nullable=True, unique=True)
+    name = Column(String, nullable=False, index=True)  # their latest user name
+
+
 class Monitor(Base):
     __tablename__ = "match"
     id = Column(Integer, primary_key=True)
     match_id = Column(String, nullable=False)
-    channel = Column(Integer, nullable=False)
+    channel = Column(BigInteger, nullable=False)  # discord snowflakes need 64 bits
     added = Column(DateTime, nullable=False)
     removed = Column(DateTime, nullable=True)
 
@@ -30,24 +39,34 @@ class StatusMessage(Base):
     __tablename__ = "status_message"
     id = Column(Integer, primary_key=True)
     match_id = Column(String, nullable=False)
-    channel = Column(Integer, nullable=False)
+    channel = Column(BigInteger, nullable=False)
     datetime = Column(DateTime, nullable=False)
-    player_turn = Column(String, nullable=True)
+    player_id = Column(Integer, ForeignKey("player.id"), nullable=True)
     message_type = Column(Enum(MessageType), nullable=False)
+    player: Player = relationship(Player, lazy="joined")  # None if it was no one's turn
+
+    @property
+    def player_turn(self) -> str | None:
+        return None if self.player is None else self.player.name
 
 
 class Subscription(Base):
     __tablename__ = "subscription"
     id = Column(Integer, primary_key=True)
-    channel = Column(Integer, nullable=False)
-    discord_id = Column(Integer, nullable=False)
-    wingspan_name = Column(String, nullable=False)
+    channel = Column(BigInteger, nullable=False)
+    discord_id = Column(BigInteger, nullable=False)
+    player_id = Column(Integer, ForeignKey("player.id"), nullable=False)
+    player: Player = relationship(Player, lazy="joined")
+
+    @property
+    def wingspan_name(self) -> str:
+        return str(self.player.name)
 
 
 class Score(Base):
     __tablename__ = "score"
     match_id = Column(String, primary_key=True)
-    player_name = Column(String, primary_key=True)
+    player_id = Column(Integer, ForeignKey("player.id"), primary_key=True, autoincrement=False)
     updated = Column(DateTime, nullable=False)
     score = Column(Integer, nullable=False)
     bird_points = Column(Integer, nullable=False)
@@ -57,3 +76,36 @@ class Score(Base):
     cached_food_points = Column(Integer, nullable=False)
     tucked_cards_points = Column(Integer, nullable=False)
     food_tokens = Column(Integer, nullable=False)
+    player: Player = relationship(Player, lazy="joined")
+
+
+class PlayerRollupColumns:
+    """ Running totals over a player's completed matches, for leaderboards """
+    games_played = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    total_score = Column(Integer, nullable=False, default=0)
+    best_score = Column(Integer, nullable=False, default=0)
+    best_bird_points = Column(Integer, nullable=False, default=0)
+    best_bonus_card_points = Column(Integer, nullable=False, default=0)
+    best_goals_points = Column(Integer, nullable=False, default=0)
+    best_eggs_points = Column(Integer, nullable=False, default=0)
+    best_cached_food_points = Column(Integer, nullable=False, default=0)
+    best_tucked_cards_points = Column(Integer, nullable=False, default=0)
+
+
+class ChannelPlayerRollup(PlayerRollupColumns, Base):
+    __tablename__ = "channel_player_rollup"
+    channel = Column(BigInteger, primary_key=True, autoincrement=False)
+    player_id = Column(Integer, ForeignKey("player.id"), primary_key=True, autoincrement=False)
+
+
+class GlobalPlayerRollup(PlayerRollupColumns, Base):
+    __tablename__ = "global_player_rollup"
+    player_id = Column(Integer, ForeignKey("player.id"), primary_key=True, autoincrement=False)
+
+
+class RolledUpMatch(Base):
+    """ Completed matches already counted in the rollups """
+    __tablename__ = "rolled_up_match"
+    match_id = Column(String, primary_key=True)
+    rolled_up = Column(DateTime, nullable=False)
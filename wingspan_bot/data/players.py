@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from wingspan_bot.data.models import Player, Subscription
+
+
+def get_player(session: Session, name: str, chilli_connect_id: str | None = None) -> Player:
+    """
+    The player with the ChilliConnect ID, updating their name if they've renamed, or without an ID the player with the
+    name, preferring ones seen in a match. Players are added if they don't exist yet
+    """
+    if chilli_connect_id is None:
+        player = session.execute(select(Player).filter_by(name=name).order_by(
+            Player.chilli_connect_id.is_(None), Player.id.desc())).scalars().first()
+    else:
+        player = session.execute(select(Player).filter_by(chilli_connect_id=chilli_connect_id)).scalar_one_or_none()
+        if player is None:
+            # the first time they're seen in a match, so take over the player added by name, e.g. from a subscription
+            player = _get_unidentified(session, name)
+            if player is not None:
+                player.chilli_connect_id = chilli_connect_id
+        elif player.name != name:
+            _rename(session, player, name)
+    if player is None:
+        player = Player(chilli_connect_id=chilli_connect_id, name=name)
+        session.add(player)
+        session.flush()
+    return player
+
+
+def _get_unidentified(session: Session, name: str) -> Player | None:
+    return session.execute(select(Player).filter_by(name=name, chilli_connect_id=None)).scalars().first()
+
+
+def _rename(session: Session, player: Player, name: str) -> None:
+    player.name = name
+    # subscriptions made by the new name before they were seen with it are for this player
+    unidentified = _get_unidentified(session, name)
+    if unidentified is not None:
+        session.execute(update(Subscription).filter_by(player_id=unidentified.id).values(player_id=player.id))
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+from datetime import datetime, timezone
+from typing import Any, Union
+
+from sqlalchemy import Float, cast, desc, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from wingspan_bot.data.categories import LEADERBOARD_TITLES
+from wingspan_bot.data.models import ChannelPlayerRollup, GlobalPlayerRollup, Monitor, Player, RolledUpMatch, Score
+
+AI_PLAYER = "AI/Computer"
+MIN_GAMES_FOR_RATES = 3  # so one lucky game doesn't top the win rate and average leaderboards
+
+Rollup = Union[ChannelPlayerRollup, GlobalPlayerRollup]
+RollupModel = Union[type[ChannelPlayerRollup], type[GlobalPlayerRollup]]
+
+# the best score for each category in the rollups, from the matching score column
+BEST_COLUMNS = {
+    "best_score": "score",
+    "best_bird_points": "bird_points",
+    "best_bonus_card_points": "bonus_card_points",
+    "best_goals_points": "goals_points",
+    "best_eggs_points": "eggs_points",
+    "best_cached_food_points": "cached_food_points",
+    "best_tucked_cards_points": "tucked_cards_points",
+}
+
+
+def _ratio(numerator: Any, denominator: Any) -> Any:
+    return cast(numerator, Float) / denominator
+
+
+# leaderboard name: (column to rank by, whether it needs MIN_GAMES_FOR_RATES games)
+_LEADERBOARD_COLUMNS: dict[str, tuple[Callable[[RollupModel], Any], bool]] = {
+    "wins": (lambda model: model.wins, False),
+    "winrate": (lambda model: 100 * _ratio(model.wins, model.games_played), True),
+    "average": (lambda model: _ratio(model.total_score, model.games_played), True),
+    "games": (lambda model: model.games_played, False),
+    "score": (lambda model: model.best_score, False),
+    "birds": (lambda model: model.best_bird_points, False),
+    "bonus": (lambda model: model.best_bonus_card_points, False),
+    "goals": (lambda model: model.best_goals_points, False),
+    "eggs": (lambda model: model.best_eggs_points, False),
+    "food": (lambda model: model.best_cached_food_points, False),
+    "tucked": (lambda model: model.best_tucked_cards_points, False),
+}
+# leaderboard name: (title, column to rank by, whether it needs MIN_GAMES_FOR_RATES games)
+LEADERBOARD_CATEGORIES: dict[str, tuple[str, Callable[[RollupModel], Any], bool]] = {
+    name: (title, *_LEADERBOARD_COLUMNS[name]) for name, title in LEADERBOARD_TITLES.items()}
+
+
+def get_winners(scores: list[Score], winner: int | None = None) -> set[int]:
+    """
+    The player ID of the `winner` if known, otherwise of whoever has the highest score, which can be several players
+    on a tie
+    """
+    if winner is not None:
+        return {winner}
+    if len(scores) == 0:
+        return set()
+    best = max(score.score or 0 for score in scores)
+    return {int(score.player_id) for score in scores if score.score == best and score.player_id is not None}
+
+
+def roll_up_match(session: Session, match_id: str, scores: list[Score], winners: set[int]) -> bool:
+    """
+    Adds a completed match's final scores to the rollups for every channel it was monitored in, and the global ones.
+    Each match is only counted once
+    :return: whether the match was added, False if it was already counted
+    """
+    if session.get(RolledUpMatch, match_id) is not None:
+        return False
+    session.add(RolledUpMatch(match_id=match_id, rolled_up=datetime.now(timezone.utc)))
+    channels = session.execute(select(Monitor.channel).filter_by(match_id=match_id).distinct()).scalars().all()
+    for score in scores:
+        if score.player.name == AI_PLAYER:
+            continue
+        rollups = [_get_rollup(session, GlobalPlayerRollup, player_id=score.player_id)]
+        rollups += [_get_rollup(session, ChannelPlayerRollup, channel=channel, player_id=score.player_id)
+                    for channel in channels]
+        for rollup in rollups:
+            _add_score(rollup, score, won=score.player_id in winners)
+    return True
+
+
+def _get_rollup(session: Session, model: RollupModel, **key: Any) -> Rollup:
+    rollup = session.get(model, key)
+    if rollup is None:
+        columns: dict[str, Any] = {"games_played": 0, "wins": 0, "total_score": 0, **dict.fromkeys(BEST_COLUMNS, 0)}
+        rollup = model(**columns, **key)
+        session.add(rollup)
+    return rollup
+
+
+def _add_score(rollup: Any, score: Score, won: bool) -> None:
+    rollup.games_played += 1
+    rollup.wins += 1 if won else 0
+    rollup.total_score += score.score
+    for best_column, score_column in BEST_COLUMNS.items():
+        setattr(rollup, best_column, max(getattr(rollup, best_column), getattr(score, score_column)))
+
+
+def leaderboard_statement(category: str, channel: int | None = None, limit: int = 10) -> Select:
+    """ Selects the (player name, value) of the top players for the category, in the channel or globally if None """
+    if category not in LEADERBOARD_CATEGORIES:
+        raise ValueError(f"Unknown leaderboard {category}, expected one of {', '.join(LEADERBOARD_CATEGORIES)}")
+    _, column, needs_min_games = LEADERBOARD_CATEGORIES[category]
+    model: RollupModel = GlobalPlayerRollup if channel is None else ChannelPlayerRollup
+    value = column(model)
+    statement = select(Player.name, value).join(Player, model.player_id == Player.id).order_by(
+        desc(value), Player.name).limit(limit)
+    if channel is not None:
+        statement = statement.filter(ChannelPlayerRollup.channel == channel)
+    if needs_min_games:
+        statement = statement.filter(model.games_played >= MIN_GAMES_FOR_RATES)
+    return statement
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future
+from typing import Any, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+PRAGMAS: dict[str, str | int] = {
+    "journal_mode": "WAL",  # readers don't block the writer, or the writer readers
+    "synchronous": "NORMAL",  # safe with WAL, only fsyncs at checkpoints
+    "cache_size": -64 * 1024,  # negative is in KiB, so 64 MiB
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 5000,  # milliseconds to wait for the write lock, e.g. during alembic migrations
+}
+
+
+def configure_engine(engine: Engine, pragmas: dict[str, str | int] | None = None) -> None:
+    """
+    Sets the pragmas on every new connection, and makes pysqlite leave transactions to SQLAlchemy so savepoints work
+    """
+    pragmas = PRAGMAS if pragmas is None else pragmas
+
+    def on_connect(dbapi_connection: Any, connection_record: Any) -> None:
+        # stop pysqlite emitting its own BEGIN, which it doesn't do for SAVEPOINT
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    def on_begin(connection: Any) -> None:
+        connection.exec_driver_sql("BEGIN")
+
+    event.listen(engine, "connect", on_connect)
+    event.listen(engine, "begin", on_begin)
+
+
+class SingleWriter:
+    """
+    Runs every write on one dedicated thread, so writers never contend for SQLite's lock. Writes queued together are
+    committed in one transaction, each in its own savepoint so a failing write doesn't undo the others.
+    """
+    def __init__(self, session_factory: sessionmaker[Session], max_batch: int = 100) -> None:
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.batches = 0
+        self._queue: queue.Queue[tuple[Callable[[Session], Any], Future[Any]] | None] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, func: Callable[[Session], T]) -> Future[T]:
+        """ Queues `func` to be called with the writer's session """
+        future: Future[T] = Future()
+        self._queue.put((func, future))
+        return future
+
+    def run(self, func: Callable[[Session], T]) -> T:
+        """ Queues `func` and waits for its transaction to be committed, raising any exception from it """
+        return self.submit(func).result()
+
+    def stop(self) -> None:
+        """ Finishes the queued writes, then stops the thread """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            if stopping:
+                return
+
+    def _write(self, batch: list[tuple[Callable[[Session], Any], Future[Any]]]) -> None:
+        results: list[tuple[Future[Any], Any]] = []
+        try:
+            with self.session_factory.begin() as session:
+                for func, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        # the savepoint flushes on exit, which is where most database errors are raised
+                        with session.begin_nested():
+                            result = func(session)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        results.append((future, result))
+        except BaseException as e:
+            logger.exception("Failed to commit batch of writes")
+            # including those not yet run, if it failed to begin, so none of their callers wait forever
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        for future, result in results:
+            future.set_result(result)
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+
+from wingspan_bot.data.data_objects import Stats
+from wingspan_bot.metrics import STATS_CACHE
+
+StatsKey = tuple[int, str | None]  # (channel, match id or None for the whole channel)
+
+
+class StatsCache:
+    """
+    Least recently used cache of computed stats. Entries are invalidated by channel, or by match for changes like
+    score updates that apply to every channel the match was monitored in
+    """
+    def __init__(self, max_entries: int = 256) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[StatsKey, Stats] = OrderedDict()
+        # the matches each cached channel's stats were computed from
+        self._channel_matches: dict[int, set[str]] = {}
+        # bumped on any invalidation, so stats computed from data that changed part way through aren't cached
+        self._generation = 0
+
+    def get(
+            self,
+            channel: int,
+            match_id: str | None,
+            compute: Callable[[], tuple[Stats, Iterable[str]]]) -> Stats:
+        """
+        Gets the cached stats, or calls `compute` to get them along with the ids of the matches they cover
+        """
+        key = (channel, match_id)
+        with self._lock:
+            if key in self._entries:
+                STATS_CACHE.inc(result="hit")
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            generation = self._generation
+        STATS_CACHE.inc(result="miss")
+        stats, match_ids = compute()
+        with self._lock:
+            if self._generation != generation:
+                return stats
+            self._entries[key] = stats
+            self._channel_matches.setdefault(channel, set()).update(match_ids)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return stats
+
+    def invalidate_channel(self, channel: int) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == channel]:
+                del self._entries[key]
+            self._channel_matches.pop(channel, None)
+            self._generation += 1
+
+    def invalidate_match(self, match_id: str) -> None:
+        """ Invalidates every channel whose cached stats include the match """
+        with self._lock:
+            self._generation += 1
+            channels = [channel for channel, match_ids in self._channel_matches.items() if match_id in match_ids]
+        for channel in channels:
+            self.invalidate_channel(channel)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._channel_matches.clear()
+            self._generation += 1
@@ -0,0 +1,101 @@
+"""
+Precise checks for the moments a match's state is due to change without anyone playing: when the current turn has
+REMINDER_HOURS left, and when it times out. The five minute poll would otherwise only notice these up to a poll late.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+from collections.abc import Hashable
+from datetime import datetime, timedelta, timezone
+from typing import Generic, TypeVar
+
+from wingspan_bot.data.data_controller import REMINDER_HOURS
+from wingspan_api.wapi import Match, MatchState
+
+# checked a little after each deadline, so the turn is certainly past it despite clock skew and rounding
+DEADLINE_SLACK = timedelta(seconds=5)
+# a deadline check that couldn't get the match is tried again this much later, rather than waiting for its next change
+DEADLINE_RETRY = timedelta(minutes=1)
+
+K = TypeVar("K", bound=Hashable)
+
+
+class DeadlineScheduler(Generic[K]):
+    """
+    A min-heap of when each key is next due, with at most one deadline per key. Rescheduling or cancelling a key
+    leaves its old heap entry in place, skipped once it reaches the top, so both are O(log n)
+    """
+    def __init__(self) -> None:
+        self._heap: list[tuple[datetime, int, K]] = []
+        self._deadlines: dict[K, datetime] = {}
+        self._counter = itertools.count()  # breaks ties, as keys needn't be comparable
+        self._changed = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, key: K, when: datetime) -> None:
+        """ Sets when the key is due, replacing any earlier deadline for it """
+        if self._deadlines.get(key) == when:
+            return
+        self._deadlines[key] = when
+        heapq.heappush(self._heap, (when, next(self._counter), key))
+        self._changed.set()
+
+    def deadlines(self) -> dict[K, datetime]:
+        """ When each key is due """
+        return dict(self._deadlines)
+
+    def cancel(self, key: K) -> None:
+        self._deadlines.pop(key, None)
+
+    def next_deadline(self) -> datetime | None:
+        self._drop_stale()
+        return self._heap[0][0] if len(self._heap) > 0 else None
+
+    def pop_due(self, now: datetime | None = None) -> list[K]:
+        """ Removes and returns the keys whose deadlines have passed, soonest first """
+        now = now if now is not None else datetime.now(timezone.utc)
+        due = []
+        while (deadline := self.next_deadline()) is not None and deadline <= now:
+            _, _, key = heapq.heappop(self._heap)
+            del self._deadlines[key]
+            due.append(key)
+        return due
+
+    async def wait(self) -> list[K]:
+        """ Waits for the next deadline, or an earlier one scheduled while waiting, and returns the keys due """
+        while len(due := self.pop_due()) == 0:
+            self._changed.clear()
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else (deadline - datetime.now(timezone.utc)).total_seconds()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return due
+
+    def _drop_stale(self) -> None:
+        while len(self._heap) > 0:
+            deadline, _, key = self._heap[0]
+            if self._deadlines.get(key) == deadline:
+                return
+            heapq.heappop(self._heap)
+
+
+def next_match_deadline(match: Match, received: datetime) -> datetime | None:
+    """
+    When the match is next due to change on its own: its reminder, or else its timeout, from its time remaining when
+    `received`. None if it can't time out, or if both have passed
+    """
+    hours_remaining = match.hours_remaining
+    if hours_remaining is None:
+        return None
+    timeout = received + timedelta(hours=hours_remaining)
+    deadlines = [timeout]
+    if match.State == MatchState.IN_PROGRESS:
+        deadlines.insert(0, timeout - timedelta(hours=REMINDER_HOURS))
+    now = datetime.now(timezone.utc)
+    return next((deadline + DEADLINE_SLACK for deadline in deadlines if deadline + DEADLINE_SLACK > now), None)
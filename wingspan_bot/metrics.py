@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import abc
+import functools
+import logging
+import threading
+import time
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, TypeVar, cast
+
+from wingspan_api.wapi import RequestAttempt
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+LabelValues = tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if len(names) == 0:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(abc.ABC):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Expected labels {self.labelnames} for {self.name}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.type_name}\n"
+        return header + "".join(f"{line}\n" for line in self._samples())
+
+    @abc.abstractmethod
+    def _samples(self) -> Iterator[str]:
+        """ The metric's sample lines, without the HELP and TYPE header """
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only be incremented")
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, label_values)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    counts[i] += 1
+                    break
+            self._sums[key] = self._sums.get(key, 0) + value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            return sum(self._counts.get(self._label_values(labels), []))
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            counts = {key: list(value) for key, value in self._counts.items()}
+            sums = dict(self._sums)
+        for label_values, bucket_counts in sorted(counts.items()):
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames + ("le",), label_values + (_format_value(upper_bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(sums[label_values])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """ A set of Prometheus-style metrics, rendered in the text exposition format """
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self.register(metric)
+        return metric
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.register(metric)
+        return metric
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self._metrics.values())
+
+
+REGISTRY = Registry()
+
+TICK_SECONDS = REGISTRY.histogram("wingspan_tick_seconds", "Time taken by each check_turns tick")
+CHILLI_REQUEST_SECONDS = REGISTRY.histogram(
+    "wingspan_chilli_request_seconds", "Latency of each request attempt to ChilliConnect", ("path", "outcome"))
+DB_QUERY_SECONDS = REGISTRY.histogram("wingspan_db_query_seconds", "Time taken by DBConnection methods", ("method",))
+MATCH_PAYLOADS = REGISTRY.counter(
+    "wingspan_match_payloads_total", "Match payloads fetched, by whether they changed since last time", ("result",))
+MESSAGES_SENT = REGISTRY.counter("wingspan_messages_sent_total", "Status messages sent, by type", ("type",))
+ERRORS = REGISTRY.counter("wingspan_errors_total", "Errors handled, by where they happened", ("stage",))
+STATS_CACHE = REGISTRY.counter("wingspan_stats_cache_total", "Stats cache lookups, by hit or miss", ("result",))
+DEADLINE_CHECKS = REGISTRY.counter(
+    "wingspan_deadline_checks_total", "Matches checked at the moment their reminder or timeout was due")
+PIPELINE_STAGE_SECONDS = REGISTRY.histogram(
+    "wingspan_pipeline_stage_seconds", "Time each turn check pipeline stage spent on a match", ("stage",))
+PIPELINE_BLOCKED_SECONDS = REGISTRY.histogram(
+    "wingspan_pipeline_blocked_seconds", "Time each pipeline stage waited for room in the next stage's queue",
+    ("stage",))
+
+
+def timed(histogram: Histogram) -> Callable[[F], F]:
+    """ Decorator observing the duration of each call in `histogram`, labeled with the function's name """
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with histogram.time(method=func.__name__):
+                return func(*args, **kwargs)
+        return cast(F, wrapper)
+    return decorator
+
+
+def observe_request_attempt(attempt: RequestAttempt) -> None:
+    """ Wapi attempt listener recording request latency """
+    outcome = str(attempt.status_code) if attempt.status_code is not None else str(attempt.error)
+    CHILLI_REQUEST_SECONDS.observe(attempt.seconds, path=attempt.path, outcome=outcome)
+
+
+class MetricsServer:
+    """ Serves the registry's metrics at /metrics from a background thread """
+    def __init__(self, registry: Registry = REGISTRY, host: str = "127.0.0.1", port: int = 0) -> None:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logger.debug(format % args)
+
+        self.host = host
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+
+    @property
+    def port(self) -> int:
+        return int(self.server.server_address[1])
+
+    def start(self) -> MetricsServer:
+        self._thread.start()
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
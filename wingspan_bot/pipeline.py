@@ -0,0 +1,205 @@
+"""
+The turn check as a pipeline of stages, fetch → decode → diff → persist → notify, connected by bounded queues. Each
+stage has its own workers, so matches are fetched while others are being decoded or notified, and a slow stage fills
+its queue and holds up the stages feeding it rather than letting work pile up.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable, Collection
+from dataclasses import dataclass, field
+
+from wingspan_bot.data.data_controller import DataController
+from wingspan_bot.metrics import ERRORS, PIPELINE_BLOCKED_SECONDS, PIPELINE_STAGE_SECONDS
+from wingspan_bot.tracing import TRACER
+from wingspan_api.wapi import GamePayload, Match
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("fetch", "decode", "diff", "persist", "notify")
+# fetching waits on ChilliConnect, so it gets the most workers. The database stages run on the event loop, which
+# DataController's caches rely on, so more workers for them only help while they wait on the notify stage
+DEFAULT_WORKERS = {"fetch": 8, "decode": 2, "diff": 1, "persist": 1, "notify": 4}
+
+Notify = Callable[[int, Match | str], Awaitable[None]]
+
+
+class PipelineError(Exception):
+    """ Raised after a run in which a stage failed for some matches, once the rest have been through the pipeline """
+
+
+@dataclass
+class PipelineConfig:
+    workers: dict[str, int] = field(default_factory=dict)  # for each stage, defaulting to DEFAULT_WORKERS
+    queue_size: int = 32  # matches waiting before each stage
+
+    def __post_init__(self) -> None:
+        unknown = set(self.workers) - set(STAGES)
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown pipeline stages {', '.join(sorted(unknown))}, expected {', '.join(STAGES)}")
+        self.workers = {**DEFAULT_WORKERS, **self.workers}
+        if min(self.workers.values()) < 1 or self.queue_size < 1:
+            raise ValueError("Pipeline stages need at least one worker, and their queues room for one match")
+
+
+@dataclass
+class MatchItem:
+    channel: int
+    match_id: str
+    payload: GamePayload | None = None
+    match: Match | str | None = None  # the match id if getting its data failed
+    changed: bool = True
+
+    @property
+    def failed(self) -> bool:
+        return isinstance(self.match, str)
+
+
+@dataclass
+class StageStats:
+    matches: int = 0
+    seconds: float = 0  # spent on matches, summed over the workers
+    blocked_seconds: float = 0  # waiting for room in the next stage's queue
+    errors: int = 0
+
+
+class TurnCheckPipeline:
+    def __init__(self, data_controller: DataController, notify: Notify, config: PipelineConfig | None = None) -> None:
+        """
+        :param notify: called with each match that's changed, or the match id if getting it failed, to send any
+                       message for it
+        """
+        self.dc = data_controller
+        self.notify = notify
+        self.config = config if config is not None else PipelineConfig()
+
+    async def run(
+            self,
+            channel: int | None = None,
+            changed_only: bool = True,
+            match_ids: Collection[str] | None = None) -> dict[str, StageStats]:
+        """
+        Checks every monitored match, in the channel or all channels if None
+        :param changed_only: skip notifying for matches whose payload is unchanged since they were last processed
+        :param match_ids: only check these of the monitored matches
+        :return: how much work each stage did
+        """
+        stats = {stage: StageStats() for stage in STAGES}
+        funcs: dict[str, Callable[[MatchItem], Awaitable[MatchItem | None]]] = {
+            "fetch": self._fetch,
+            "decode": self._decode,
+            "diff": lambda item: self._diff(item, changed_only),
+            "persist": self._persist,
+            "notify": self._notify,
+        }
+        queues: list[asyncio.Queue[MatchItem | None]] = [
+            asyncio.Queue(maxsize=self.config.queue_size) for _ in STAGES]
+        tasks = [asyncio.create_task(self._feed(queues[0], channel, match_ids))]
+        for i, stage in enumerate(STAGES):
+            outbox = queues[i + 1] if i + 1 < len(STAGES) else None
+            next_workers = self.config.workers[STAGES[i + 1]] if outbox is not None else 0
+            tasks.append(asyncio.create_task(
+                self._run_stage(stage, funcs[stage], stats[stage], queues[i], outbox, next_workers)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        failed = {stage: stage_stats.errors for stage, stage_stats in stats.items() if stage_stats.errors > 0}
+        if len(failed) > 0:
+            raise PipelineError(f"Stages failed for some matches: {failed}")
+        return stats
+
+    async def _feed(
+            self, queue: asyncio.Queue[MatchItem | None], channel: int | None, match_ids: Collection[str] | None
+    ) -> None:
+        for channel_id, match_id in self.dc.prepare_matches(channel):
+            if match_ids is None or match_id in match_ids:
+                await queue.put(MatchItem(channel=channel_id, match_id=match_id))
+        for _ in range(self.config.workers[STAGES[0]]):
+            await queue.put(None)
+
+    async def _run_stage(
+            self,
+            stage: str,
+            func: Callable[[MatchItem], Awaitable[MatchItem | None]],
+            stats: StageStats,
+            inbox: asyncio.Queue[MatchItem | None],
+            outbox: asyncio.Queue[MatchItem | None] | None,
+            next_workers: int) -> None:
+        """ Runs the stage's workers until the stage before is done, then tells the next stage's workers to stop """
+        async def worker() -> None:
+            while True:
+                item = await inbox.get()
+                if item is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    result = await func(item)
+                except Exception:
+                    logger.exception(f"Exception in {stage} for match {item.match_id} in channel {item.channel}")
+                    ERRORS.inc(stage=f"pipeline_{stage}")
+                    stats.errors += 1
+                    result = None
+                seconds = time.perf_counter() - start
+                stats.matches += 1
+                stats.seconds += seconds
+                PIPELINE_STAGE_SECONDS.observe(seconds, stage=stage)
+                if result is not None and outbox is not None:
+                    start = time.perf_counter()
+                    await outbox.put(result)
+                    blocked = time.perf_counter() - start
+                    stats.blocked_seconds += blocked
+                    PIPELINE_BLOCKED_SECONDS.observe(blocked, stage=stage)
+
+        await asyncio.gather(*(worker() for _ in range(self.config.workers[stage])))
+        if outbox is not None:
+            for _ in range(next_workers):
+                await outbox.put(None)
+
+    async def _fetch(self, item: MatchItem) -> MatchItem:
+        try:
+            with TRACER.span("fetch", match_id=item.match_id, channel=item.channel):
+                item.payload = await asyncio.to_thread(self.dc.wapi.fetch_game_payload, item.match_id)
+        except Exception as e:
+            self._failed(item, e)
+        return item
+
+    async def _decode(self, item: MatchItem) -> MatchItem:
+        if item.failed or item.payload is None:
+            return item
+        try:
+            with TRACER.span("decode", match_id=item.match_id):
+                item.match = await asyncio.to_thread(self.dc.wapi.decode_game_payload, item.payload)
+        except Exception as e:
+            self._failed(item, e)
+        return item
+
+    async def _diff(self, item: MatchItem, changed_only: bool) -> MatchItem | None:
+        if item.failed or item.payload is None:
+            return item
+        item.changed = self.dc.match_changed(item.channel, item.match_id, item.payload.digest)
+        return item if item.changed or not changed_only else None
+
+    async def _persist(self, item: MatchItem) -> MatchItem:
+        if item.failed or not item.changed or not isinstance(item.match, Match) or item.payload is None:
+            return item
+        try:
+            self.dc.update_scores(item.match_id, item.match, item.payload.digest)
+        except Exception as e:
+            self._failed(item, e)
+        return item
+
+    async def _notify(self, item: MatchItem) -> None:
+        if item.match is None:
+            return
+        await self.notify(item.channel, item.match)
+        # only once notified, so a failure to send means the match is notified again next time
+        if not item.failed and item.changed and item.payload is not None:
+            self.dc.match_processed(item.channel, item.match_id, item.payload.digest)
+
+    def _failed(self, item: MatchItem, error: Exception) -> None:
+        self.dc.match_failed(item.channel, item.match_id, error)
+        item.match = item.match_id
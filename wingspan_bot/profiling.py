@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import cProfile
+import io
+import logging
+import pstats
+from datetime import datetime
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+try:
+    # optional, gives a more readable call tree than cProfile for async code
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:
+    PyinstrumentProfiler = None
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+class TickProfiler:
+    """ Profiles everything run while it's entered, to capture a single tick on request """
+    def __init__(self, kind: str = "cprofile", output_dir: str | Path = ".") -> None:
+        if kind not in PROFILERS:
+            raise ValueError(f"Unknown profiler {kind}, expected one of {', '.join(PROFILERS)}")
+        if kind == "pyinstrument" and PyinstrumentProfiler is None:
+            raise ValueError("pyinstrument isn't installed")
+        self.kind = kind
+        self.output_dir = Path(output_dir)
+        self._profiler: Any = cProfile.Profile() if kind == "cprofile" else PyinstrumentProfiler(async_mode="enabled")
+
+    def __enter__(self) -> TickProfiler:
+        if self.kind == "cprofile":
+            self._profiler.enable()
+        else:
+            self._profiler.start()
+        return self
+
+    def __exit__(
+            self,
+            exc_type: type[BaseException] | None,
+            exc_value: BaseException | None,
+            traceback: TracebackType | None) -> None:
+        if self.kind == "cprofile":
+            self._profiler.disable()
+        else:
+            self._profiler.stop()
+
+    def save(self) -> Path:
+        """ Saves the full profile, as a .prof file for cProfile or an .html file for pyinstrument """
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        if self.kind == "cprofile":
+            path = self.output_dir / f"tick-{timestamp}.prof"
+            self._profiler.dump_stats(path)
+        else:
+            path = self.output_dir / f"tick-{timestamp}.html"
+            path.write_text(self._profiler.output_html())
+        logger.info(f"Saved tick profile to {path}")
+        return path
+
+    def summary(self, limit: int = 15) -> str:
+        if self.kind == "cprofile":
+            out = io.StringIO()
+            pstats.Stats(self._profiler, stream=out).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+            return out.getvalue()
+        return str(self._profiler.output_text(unicode=False, color=False))
@@ -0,0 +1,244 @@
+"""
+Replays a recording of matches, from `main.py --record`, through a DataController and a real database, for
+reproducing production load locally. Turn checks run as the bot's would, every tick of the recording's clock, with
+the matches as they were recorded by then in place of ChilliConnect. The report has the messages sent, which should be
+the same for every replay of a recording, and how long the turn checks took.
+Run with `python -m wingspan_bot.replay -h`
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import sys
+import time
+from collections.abc import Awaitable, Callable, Iterable, Sequence
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+from wingspan_bot.data.data_controller import DataController
+from wingspan_bot.data.db_connection import DBConnection
+from wingspan_bot.data.models import Base, MessageType
+from wingspan_bot.pipeline import TurnCheckPipeline
+from wingspan_api.recorder import ArchiveRecord, read_archive
+from wingspan_api.wapi import GamePayload, Match, Wapi
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayMismatchError(Exception):
+    pass
+
+
+@dataclass
+class ReplayConfig:
+    tick_interval: timedelta = timedelta(minutes=5)  # as Bot.check_turns
+    speed: float | None = None  # how many times faster than recorded to replay, or None for as fast as possible
+    matches_per_channel: int = 10  # matches are monitored in channels of this many, in the order they're first seen
+
+
+@dataclass(frozen=True)
+class ReplayMessage:
+    time: datetime  # on the recording's clock
+    channel: int
+    match_id: str
+    player: str | None
+    message_type: MessageType
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"time": self.time.isoformat(), "channel": self.channel, "match_id": self.match_id,
+                "player": self.player, "message_type": self.message_type.name}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> ReplayMessage:
+        return cls(time=datetime.fromisoformat(data["time"]), channel=data["channel"], match_id=data["match_id"],
+                   player=data["player"], message_type=MessageType[data["message_type"]])
+
+
+@dataclass
+class ReplayReport:
+    ticks: int = 0
+    matches: int = 0  # checked over all the ticks, matches that were unchanged since the last tick are skipped
+    messages: list[ReplayMessage] = field(default_factory=list)
+    tick_seconds: list[float] = field(default_factory=list)
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(self.tick_seconds)
+
+    def latency(self, quantile: float) -> float:
+        """ The tick latency in seconds at the quantile, e.g. 0.95 """
+        if len(self.tick_seconds) < 2:
+            return self.total_seconds
+        return statistics.quantiles(self.tick_seconds, n=100, method="inclusive")[round(quantile * 100) - 1]
+
+    def verify(self, expected: Sequence[ReplayMessage]) -> None:
+        """ Raises a ReplayMismatchError at the first message that differs from the expected ones """
+        for i, (message, expected_message) in enumerate(zip(self.messages, expected)):
+            if message != expected_message:
+                raise ReplayMismatchError(f"Message {i} was {message}, expected {expected_message}")
+        if len(self.messages) != len(expected):
+            raise ReplayMismatchError(f"Sent {len(self.messages)} messages, expected {len(expected)}")
+
+    def __str__(self) -> str:
+        seconds = self.total_seconds
+        throughput = self.matches / seconds if seconds > 0 else float("inf")
+        return (f"{self.ticks} ticks, {self.matches} matches checked and {len(self.messages)} messages sent in "
+                f"{seconds:.3f}s, {throughput:.0f} matches/s. Tick latency p50 {self.latency(0.5) * 1000:.1f}ms, "
+                f"p95 {self.latency(0.95) * 1000:.1f}ms, max {max(self.tick_seconds, default=0) * 1000:.1f}ms")
+
+
+class ReplayWapi(Wapi):
+    """ Serves the latest recorded state of each match as of the replay's clock, in place of ChilliConnect """
+    def __init__(self, records: Iterable[ArchiveRecord]) -> None:
+        super().__init__(access_token="replay")
+        self._records = iter(records)
+        self._next: ArchiveRecord | None = next(self._records, None)
+        self._states: dict[str, ArchiveRecord] = {}
+
+    @property
+    def next_time(self) -> datetime | None:
+        """ When the next recorded state is from, or None once they've all been replayed """
+        return None if self._next is None else self._next.time
+
+    def advance(self, until: datetime) -> list[str]:
+        """ Moves on to the states recorded up to `until`, returning the matches seen for the first time """
+        new_matches = []
+        while self._next is not None and self._next.time <= until:
+            if self._next.match_id not in self._states:
+                new_matches.append(self._next.match_id)
+            self._states[self._next.match_id] = self._next
+            self._next = next(self._records, None)
+        return new_matches
+
+    def get_game_info(self, match_id: str) -> Match:
+        return self._record(match_id).match
+
+    def fetch_game_payload(self, match_id: str) -> GamePayload:
+        record = self._record(match_id)
+        return GamePayload(match_id=match_id, digest=record.digest, content=None, received=record.time)
+
+    def decode_game_payload(self, payload: GamePayload) -> Match:
+        return self._record(payload.match_id).match
+
+    def _record(self, match_id: str) -> ArchiveRecord:
+        record = self._states.get(match_id)
+        if record is None:
+            raise LookupError(f"No recorded state of match {match_id} yet")
+        return record
+
+    def fingerprint(self, match_id: str) -> str | None:
+        record = self._states.get(match_id)
+        return None if record is None else record.digest
+
+
+class Replay:
+    def __init__(self, records: Iterable[ArchiveRecord], db: DBConnection, config: ReplayConfig | None = None,
+                 sleep: Callable[[float], Awaitable[None]] = asyncio.sleep) -> None:
+        """
+        :param records: the recorded states, in the order they were recorded as read_archive returns them
+        :param db: the database for the DataController, which should start without any of the recorded matches
+        """
+        self.config = config if config is not None else ReplayConfig()
+        self.wapi = ReplayWapi(records)
+        self.dc = DataController(db, self.wapi)
+        self._sleep = sleep
+        self._monitored = 0
+
+    async def run(self) -> ReplayReport:
+        report = ReplayReport()
+        start = self.wapi.next_time
+        if start is None:
+            return report
+        wall_start = time.monotonic()
+        now = start
+        while self.wapi.next_time is not None:
+            if self.config.speed is not None:
+                delay = (now - start).total_seconds() / self.config.speed - (time.monotonic() - wall_start)
+                if delay > 0:
+                    await self._sleep(delay)
+            for match_id in self.wapi.advance(now):
+                self.dc.add(self._monitored // self.config.matches_per_channel, match_id)
+                self._monitored += 1
+            tick_start = time.perf_counter()
+            await self._tick(now, report)
+            report.tick_seconds.append(time.perf_counter() - tick_start)
+            report.ticks += 1
+            now += self.config.tick_interval
+        return report
+
+    async def _tick(self, now: datetime, report: ReplayReport) -> None:
+        """ A turn check, the way Bot.check_turns makes one, with the messages recorded rather than sent to discord """
+        sent: list[ReplayMessage] = []
+
+        async def notify(channel: int, match: Match | str) -> None:
+            if not self.dc.should_send_message(channel, match):
+                return
+            player = None if isinstance(match, str) else match.current_player_name
+            message_type = self.dc.get_message_type(match)
+            self.dc.get_subscriptions(channel)
+            self.dc.add_message(match, channel, player, message_type)
+            sent.append(ReplayMessage(
+                time=now, channel=channel, match_id=str(match), player=player, message_type=message_type))
+
+        with self.dc.unit_of_work():
+            stats = await TurnCheckPipeline(self.dc, notify).run()
+        report.matches += stats["notify"].matches
+        # the pipeline notifies matches in the order they finish in, so they're sorted for replays to be comparable
+        report.messages.extend(sorted(sent, key=lambda message: (message.channel, message.match_id)))
+
+
+def replay_archive(path: Path, db: DBConnection, config: ReplayConfig | None = None) -> ReplayReport:
+    return asyncio.run(Replay(read_archive(path), db, config).run())
+
+
+def save_messages(path: Path, messages: Iterable[ReplayMessage]) -> None:
+    with path.open("w") as f:
+        for message in messages:
+            f.write(json.dumps(message.to_dict()) + "\n")
+
+
+def load_messages(path: Path) -> list[ReplayMessage]:
+    with path.open("r") as f:
+        return [ReplayMessage.from_dict(json.loads(line)) for line in f if line.strip()]
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.WARNING)
+    defaults = ReplayConfig()
+    parser = argparse.ArgumentParser(description="Replay a recording of matches through a database")
+    parser.add_argument("archive", type=Path, help="Recording from main.py --record")
+    parser.add_argument("db_connection", help="Database to replay into, e.g. sqlite:///replay.db")
+    parser.add_argument("--tick-minutes", type=float, default=defaults.tick_interval.total_seconds() / 60)
+    parser.add_argument("--speed", type=float, help="Replay this many times faster than recorded, e.g. 60, "
+                                                    "instead of as fast as possible")
+    parser.add_argument("--matches-per-channel", type=int, default=defaults.matches_per_channel)
+    parser.add_argument("--save-messages", type=Path, help="Save the messages sent, as JSON lines")
+    parser.add_argument("--expected", type=Path, help="Fail unless the messages sent are the same as the saved ones")
+    parser.add_argument("--create-tables", action="store_true", help="Create the tables instead of using alembic")
+    args = parser.parse_args()
+
+    db = DBConnection(args.db_connection)
+    if args.create_tables:
+        Base.metadata.create_all(db.engine)
+    report = replay_archive(args.archive, db, ReplayConfig(
+        tick_interval=timedelta(minutes=args.tick_minutes),
+        speed=args.speed,
+        matches_per_channel=args.matches_per_channel))
+    print(report)
+    if args.save_messages is not None:
+        save_messages(args.save_messages, report.messages)
+    if args.expected is not None:
+        try:
+            report.verify(load_messages(args.expected))
+        except ReplayMismatchError as e:
+            sys.exit(f"Replay differs from {args.expected}: {e}")
+        print(f"Messages match {args.expected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+A snapshot of the bot's in-memory state, saved after each turn check and on shutdown and loaded at startup. A restart
+then resumes with the ChilliConnect access token, the last payload of each match and which have already been handled,
+rather than logging in through Steamworks and reprocessing every match. The previous messages are in the database.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from wingspan_bot.data.data_controller import DataController, Fingerprints
+from wingspan_bot.deadlines import DeadlineScheduler
+from wingspan_api.wapi import CachedPayload, Match, Wapi
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 2  # increased when the format changes, so older snapshots are ignored rather than misread
+
+
+@dataclass
+class Snapshot:
+    access_token: str | None = None
+    payloads: dict[str, CachedPayload] = field(default_factory=dict)
+    fingerprints: Fingerprints = field(default_factory=lambda: Fingerprints(processed={}, scores={}))
+    deadlines: dict[tuple[int, str], datetime] = field(default_factory=dict)  # (channel, match id): when it's due
+    saved: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    @classmethod
+    def take(cls, wapi: Wapi, data_controller: DataController,
+             deadlines: DeadlineScheduler[tuple[int, str]]) -> Snapshot:
+        return cls(
+            access_token=wapi.access_token,
+            payloads=wapi.cached_payloads(),
+            fingerprints=data_controller.get_fingerprints(),
+            deadlines=deadlines.deadlines())
+
+    def restore(self, wapi: Wapi, data_controller: DataController,
+                deadlines: DeadlineScheduler[tuple[int, str]]) -> None:
+        """ Warms up the components with the state, keeping anything newer they already have """
+        wapi.restore_payloads(self.payloads)
+        data_controller.restore_fingerprints(self.fingerprints)
+        known = deadlines.deadlines()
+        for key, when in self.deadlines.items():
+            if key not in known:
+                deadlines.schedule(key, when)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "version": SNAPSHOT_VERSION,
+            "saved": self.saved.isoformat(),
+            "access_token": self.access_token,
+            "payloads": [
+                {"match_id": match_id, "digest": payload.digest, "etag": payload.etag,
+                 "received": payload.received.isoformat(), "first_received": payload.unchanged_since.isoformat(),
+                 "match": payload.match.to_dict(encode_json=True)}
+                for match_id, payload in self.payloads.items()],
+            "processed_fingerprints": [
+                [channel, match_id, digest] for (channel, match_id), digest in self.fingerprints.processed.items()],
+            "score_fingerprints": self.fingerprints.scores,
+            "deadlines": [
+                [channel, match_id, when.isoformat()] for (channel, match_id), when in self.deadlines.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> Snapshot:
+        if data.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {data.get('version')}, expected {SNAPSHOT_VERSION}")
+        return cls(
+            access_token=data["access_token"],
+            payloads={
+                payload["match_id"]: CachedPayload(
+                    digest=payload["digest"], match=Match.from_dict(payload["match"]), etag=payload["etag"],
+                    received=datetime.fromisoformat(payload["received"]),
+                    first_received=datetime.fromisoformat(payload["first_received"]))
+                for payload in data["payloads"]},
+            fingerprints=Fingerprints(
+                processed={(channel, match_id): digest for channel, match_id, digest in data["processed_fingerprints"]},
+                scores=data["score_fingerprints"]),
+            deadlines={
+                (channel, match_id): datetime.fromisoformat(when) for channel, match_id, when in data["deadlines"]},
+            saved=datetime.fromisoformat(data["saved"]))
+
+
+def save_snapshot(path: Path, snapshot: Snapshot) -> None:
+    """ Writes the snapshot, replacing the file in one step so it's never left half written """
+    with tempfile.NamedTemporaryFile("w", dir=path.parent, prefix=f"{path.name}.", delete=False) as f:
+        json.dump(snapshot.to_dict(), f)
+    os.replace(f.name, path)
+
+
+def load_snapshot(path: Path) -> Snapshot | None:
+    """ The snapshot saved at the path, or None if there isn't one or it can't be read, to start cold """
+    try:
+        with path.open("r") as f:
+            return Snapshot.from_dict(json.load(f))
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Ignoring the snapshot at {path}, starting without it: {e!r}")
+        return None
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import secrets
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+AttributeValue = str | int | float | bool
+
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: str | None
+    start_time_ns: int
+    end_time_ns: int | None = None
+    attributes: dict[str, AttributeValue] = field(default_factory=dict)
+    error: str | None = None
+
+    def set_attribute(self, key: str, value: AttributeValue) -> None:
+        self.attributes[key] = value
+
+    @property
+    def duration(self) -> float:
+        if self.end_time_ns is None:
+            raise ValueError(f"Span {self.name} hasn't ended")
+        return (self.end_time_ns - self.start_time_ns) / 1e9
+
+    def to_otlp(self) -> dict[str, Any]:
+        """ The span in the OpenTelemetry protocol's JSON encoding """
+        def encode_value(value: AttributeValue) -> dict[str, Any]:
+            if isinstance(value, bool):
+                return {"boolValue": value}
+            if isinstance(value, int):
+                return {"intValue": str(value)}
+            if isinstance(value, float):
+                return {"doubleValue": value}
+            return {"stringValue": value}
+
+        otlp: dict[str, Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns),
+            "attributes": [{"key": key, "value": encode_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error is not None else {"code": 0},
+        }
+        if self.parent_span_id is not None:
+            otlp["parentSpanId"] = self.parent_span_id
+        return otlp
+
+
+SpanExporter = Callable[[Span], None]
+
+
+class FileSpanExporter:
+    """ Appends finished spans to a file, one OTLP JSON encoded span per line """
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def __call__(self, span: Span) -> None:
+        line = json.dumps(span.to_otlp()) + "\n"
+        with self._lock, self.path.open("a") as f:
+            f.write(line)
+
+
+class Tracer:
+    """
+    Records nested spans of work. Spans started while another span is active in the same context become its children,
+    and are passed to the exporters when they end. Nothing is recorded while there are no exporters.
+    """
+    def __init__(self) -> None:
+        self.exporters: list[SpanExporter] = []
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.exporters) > 0
+
+    @contextmanager
+    def span(self, name: str, **attributes: AttributeValue) -> Iterator[Span | None]:
+        if not self.enabled:
+            yield None
+            return
+
+        parent = _current_span.get()
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent is not None else secrets.token_hex(16),
+            span_id=secrets.token_hex(8),
+            parent_span_id=parent.span_id if parent is not None else None,
+            start_time_ns=time.time_ns(),
+            attributes=dict(attributes))
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_time_ns = time.time_ns()
+            self._export(span)
+
+    def _export(self, span: Span) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter(span)
+            except Exception:
+                logger.exception(f"Failed to export span {span.name}")
+
+
+TRACER = Tracer()